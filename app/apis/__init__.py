@@ -1,12 +1,16 @@
 from flask import Flask, Blueprint, request, abort, make_response, jsonify, g, json
 from flask_restx import Namespace, Resource, fields
 from flask_restx import Api
+from elasticsearch.exceptions import TransportError
 from models.error import InvalidUsage
 from models.annotation import AnnotationError
+from parse.headers_params import get_project
+import models.tenant as tenant
 
 from .user import api as ns_user
 from .annotation import api as ns_annotation
 from .collection import api as ns_collection
+import stores
 
 blueprint = Blueprint('api', __name__)
 api = Api(blueprint,
@@ -22,6 +26,32 @@ api.add_namespace(ns_annotation)
 api.add_namespace(ns_collection)
 
 
+@blueprint.before_request
+def ensure_indices():
+    # the indices are bootstrapped on the first API request instead of at import time
+    if request.endpoint in ("api.doc", "api.specs"):
+        return None
+    try:
+        stores.ensure_indices()
+    except TransportError:
+        return make_response(jsonify({"message": "Annotation store is not available"}), 503)
+
+
+@blueprint.before_request
+def set_project():
+    # the project determines which annotation index the request is routed to
+    try:
+        g.project_token = tenant.set_project(get_project(request))
+    except InvalidUsage as error:
+        return make_response(jsonify(error.to_dict()), error.status_code)
+
+
+@blueprint.teardown_request
+def reset_project(_exception):
+    if "project_token" in g:
+        tenant.reset_project(g.pop("project_token"))
+
+
 @api.errorhandler(InvalidUsage)
 def handle_invalid_usage(error):
     return error.to_dict(), error.status_code
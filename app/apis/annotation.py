@@ -1,17 +1,16 @@
-from typing import Dict, Union
 from flask import request, abort, jsonify, make_response, g
 from flask_restx import Namespace, Resource, fields
-from parse.headers_params import get_params
-from models.annotation_store import AnnotationStore
-from models.user_store import UserStore
-from models.annotation_container import AnnotationContainer
+from parse.headers_params import get_params, get_link_params, get_es_setting, get_non_negative_int, \
+    check_result_window
+from models.annotation_container import LazyAnnotationContainer, update_url
+from models.error import InvalidUsage
+from apis.collection import make_external_id as make_external_collection_id
 from settings import server_config
+from stores import annotation_store, user_store
 from flask_httpauth import HTTPBasicAuth
 
 namespace = 'annotations'
 api_url = server_config['SWAServer']['url'] + server_config['SWAServer']['api_prefix']
-annotation_store = AnnotationStore(server_config["Elasticsearch"])
-user_store = UserStore(server_config["Elasticsearch"])
 api = Namespace(namespace, description='Annotation related operations')
 auth = HTTPBasicAuth()
 
@@ -118,6 +117,51 @@ collection_list_model = api.model("AnnotationCollectionListResponse", {
     "collections": fields.List(fields.Nested(annotation_collection_model), description="List of annotation collections")
 })
 
+count_model = api.model("AnnotationCountResponse", {
+    "total": fields.Integer(description="Total number of annotations matching the request")
+})
+
+search_result_model = api.model("AnnotationSearchResult", {
+    "annotation": fields.Nested(annotation_model),
+    "score": fields.Float(description="Relevance score of the annotation"),
+    "highlight": fields.Raw(description="Highlighted fragments of the matching body values")
+})
+
+search_model = api.model("AnnotationSearchResponse", {
+    "total": fields.Integer(description="Total number of annotations matching the query"),
+    "results": fields.List(fields.Nested(search_result_model)),
+    "next": fields.String(description="URL of the next page of results")
+})
+
+facets_model = api.model("AnnotationFacetsResponse", {
+    "total": fields.Integer(description="Total number of annotations matching the request"),
+    "facets": fields.Raw(description="Facet values and counts per facet")
+})
+
+target_counts_request_model = api.model("AnnotationTargetCountsRequest", {
+    "target_ids": fields.List(fields.String, description="ids of the targets to count annotations for")
+})
+
+target_counts_model = api.model("AnnotationTargetCountsResponse", {
+    "counts": fields.Raw(description="Number of annotations per target id, per access level and in total")
+})
+
+
+change_model = api.model("AnnotationChange", {
+    "seq": fields.Integer(description="Sequence number of the change"),
+    "id": fields.String(description="ID of the changed annotation or collection"),
+    "type": fields.String(description="Annotation Type", enum=["Annotation", "AnnotationCollection"]),
+    "action": fields.String(description="Change action", enum=["created", "updated", "deleted"]),
+    "timestamp": fields.DateTime(description="Time of the change")
+})
+
+changes_model = api.model("AnnotationChangesResponse", {
+    "changes": fields.List(fields.Nested(change_model)),
+    "last_seq": fields.Integer(description="Sequence number to pass as 'since' to get the next changes"),
+    "next": fields.String(description="URL of the next changes")
+})
+
+
 
 @auth.verify_password
 def verify_password(token_or_username, password):
@@ -144,12 +188,6 @@ def unauthorized():
     return make_response(jsonify({'message': 'Unauthorized access'}), 403)
 
 
-# Update configuration
-def configure_store(config: Dict[str, Union[str, int]]):
-    annotation_store.configure(config)
-    user_store.configure(config)
-
-
 def make_external_id(annotation_id: str) -> str:
     """Turn a full external id with API URL into an internal id without API URL."""
     return f"{api_url}/{namespace}/{annotation_id}"
@@ -160,14 +198,38 @@ def make_internal_id(annotation_id: str) -> str:
     return annotation_id.split('/')[-1]
 
 
+def annotation_page_fetcher(params, fetched_pages=None):
+    """Return a callback that retrieves a single page of annotations matching the request parameters.
+    Pages that were fetched already (by page number) are not fetched again."""
+    def fetch_page(page_num, page_size):
+        if fetched_pages and page_num in fetched_pages:
+            return fetched_pages[page_num]
+        page_params = dict(params, page=page_num, page_size=page_size)
+        return annotation_store.get_annotations_es(page_params)["annotations"]
+    return fetch_page
+
+
 """--------------- Annotation endpoints ------------------"""
 
 
 annotation_parameters = {
     'iris': 'Integer: 0 (show full annotations) or 1 (show only IRIs)',
+    'page': 'Integer: the number of the annotation page to show (starting at 0)',
+    'page_size': 'Integer: the number of annotations per page (capped by the server configuration)',
+    'cursor': 'cursor returned in the "next" link of a cursor page, or empty to start at the first page',
     'access_status': 'access and permission status: "private", "public"',
+    'q': 'full-text query on the annotation bodies',
+    'fields': 'comma-separated list of annotation fields to return (id and type are always returned)',
     'target_id': 'annotation target id: only retrieve annotations targeting a specific id',
-    'target_type': 'annotation target type: only retrieve annotations targeting a specific type'
+    'target_type': 'annotation target type: only retrieve annotations targeting a specific type',
+    'project': 'project to read from (alternatively given in the X-Project header)',
+    'all_projects': 'Boolean: "true" to read annotations across all projects'
+}
+
+
+facet_parameters = {
+    'facets': 'comma-separated list of facets: "target_id", "target_type", "motivation", "creator", "created"',
+    'facet_size': 'Integer: maximum number of values per facet (default 10)'
 }
 
 
@@ -180,14 +242,35 @@ class AnnotationsAPI(Resource):
     @api.response(404, 'Annotation Error', response_model)
     def get(self):
         params = get_params(request)
-        data = annotation_store.get_annotations_es(params)
-        # print('ANNOTATION API - request.url:', request.url)
-        # print('ANNOTATION API - request.base_url:', request.base_url)
-        # print('ANNOTATION API - request.url_root:', request.url_root)
-        container = AnnotationContainer(request.base_url, data["annotations"],
-                                        view=params["view"], total=data["total"])
+        page_size = params["container_page_size"]
+        if params["cursor"] is not None:
+            # cursor pages are fetched directly, the response contains the cursor for the next page
+            data = annotation_store.get_annotations_es(dict(params, page_size=page_size))
+            container = LazyAnnotationContainer(request.base_url, data["total"], annotation_page_fetcher(params),
+                                                page_size=page_size, view=params["view"],
+                                                link_params=get_link_params(request))
+            return container.view_cursor_page(request.args.get("cursor"), data["annotations"], data["cursor"])
+        check_result_window(dict(params, page_size=page_size))
+        # the total comes with the page that is rendered, a minimal container only needs the total
+        renders_items = params["show_page"] or params["view"] != "PreferMinimalContainer"
+        data = annotation_store.get_annotations_es(dict(params, page_size=page_size if renders_items else 0))
+        fetched_pages = {params["page"]: data["annotations"]} if renders_items else None
+        container = LazyAnnotationContainer(request.base_url, data["total"],
+                                            annotation_page_fetcher(params, fetched_pages),
+                                            page_size=page_size, view=params["view"],
+                                            link_params=get_link_params(request))
+        if params["show_page"]:
+            return container.view_page(params["page"])
         return container.view()
 
+    @auth.login_required
+    @api.response(200, 'Success')
+    @api.response(404, 'Annotation Error', response_model)
+    def head(self):
+        params = get_params(request)
+        total = annotation_store.count_annotations_es(params)
+        return {}, 200, {"X-Total-Count": str(total)}
+
     @auth.login_required
     @api.response(201, 'Success', annotation_model)
     @api.response(403, 'Invalid Annotation Error', response_model)
@@ -201,6 +284,112 @@ class AnnotationsAPI(Resource):
         return annotation, 201
 
 
+@api.doc(params=annotation_parameters, required=False)
+@api.route("/_count", endpoint='annotation_count')
+class AnnotationsCountAPI(Resource):
+
+    @auth.login_required
+    @api.response(200, 'Success', count_model)
+    @api.response(404, 'Annotation Error', response_model)
+    def get(self):
+        params = get_params(request)
+        return {"total": annotation_store.count_annotations_es(params)}
+
+
+@api.doc(params=dict(annotation_parameters, **facet_parameters), required=False)
+@api.route("/_facets", endpoint='annotation_facets')
+class AnnotationsFacetsAPI(Resource):
+
+    @auth.login_required
+    @api.response(200, 'Success', facets_model)
+    @api.response(400, 'Invalid facet parameters', response_model)
+    def get(self):
+        params = get_params(request)
+        return annotation_store.get_facets_es(params)
+
+
+@api.doc(params=annotation_parameters, required=False)
+@api.route("/_target_counts", endpoint='annotation_target_counts')
+class AnnotationsTargetCountsAPI(Resource):
+
+    @auth.login_required
+    @api.response(200, 'Success', target_counts_model)
+    @api.response(400, 'Invalid target ids', response_model)
+    def get(self):
+        params = get_params(request)
+        if "filter" not in params or "target_id" not in params["filter"]:
+            raise InvalidUsage("target counts require a 'target_id' parameter")
+        return annotation_store.get_target_counts_es(params["filter"]["target_id"], params)
+
+    @auth.login_required
+    @api.response(200, 'Success', target_counts_model)
+    @api.response(400, 'Invalid target ids', response_model)
+    @api.expect(target_counts_request_model)
+    def post(self):
+        # many target ids don't fit in a URL, so they can be posted as well
+        params = get_params(request)
+        data = request.get_json()
+        if not isinstance(data, dict) or not isinstance(data.get("target_ids"), list):
+            raise InvalidUsage("Request should be an object with a list of 'target_ids'")
+        max_batch_size = get_es_setting("max_batch_size", 10000)
+        if len(data["target_ids"]) > max_batch_size:
+            raise InvalidUsage("Request can contain at most %s target ids" % max_batch_size)
+        return annotation_store.get_target_counts_es(data["target_ids"], params)
+
+
+change_parameters = {
+    'since': 'Integer: sequence number of the last change seen, 0 (default) to start at the first change',
+    'limit': 'Integer: maximum number of changes to read (capped by the server configuration)',
+    'wait': 'Integer: seconds to wait for new changes when there are none (long-polling), default 0',
+    'project': 'project to read from (alternatively given in the X-Project header)'
+}
+
+
+@api.doc(params=change_parameters, required=False)
+@api.route("/_changes", endpoint='annotation_changes')
+class AnnotationsChangesAPI(Resource):
+
+    @auth.login_required
+    @api.response(200, 'Success', changes_model)
+    @api.response(400, 'Invalid change parameters', response_model)
+    def get(self):
+        params = get_params(request)
+        since = get_non_negative_int(request.args.get("since", 0), "since")
+        limit = min(max(get_non_negative_int(request.args.get("limit", params["page_size"]), "limit"), 1),
+                    get_es_setting("max_page_size", params["page_size"]))
+        wait = min(get_non_negative_int(request.args.get("wait", 0), "wait"),
+                   get_es_setting("change_feed_max_wait", 10))
+        data = annotation_store.get_changes_es(since, limit, params, wait=wait)
+        for change in data["changes"]:
+            # collections are changed through the collections endpoint
+            if change["type"] == "AnnotationCollection":
+                change["id"] = make_external_collection_id(change["id"])
+            else:
+                change["id"] = make_external_id(change["id"])
+        data["next"] = update_url(request.url, {"since": data["last_seq"]})
+        return data
+
+
+@api.doc(params=annotation_parameters, required=False)
+@api.route("/_search", endpoint='annotation_search')
+class AnnotationsSearchAPI(Resource):
+
+    @auth.login_required
+    @api.response(200, 'Success', search_model)
+    @api.response(400, 'Invalid search parameters', response_model)
+    def get(self):
+        params = get_params(request)
+        if "query" not in params:
+            raise InvalidUsage("full-text search requires a 'q' parameter")
+        data = annotation_store.search_annotations_es(params)
+        for result in data["results"]:
+            result["annotation"]["id"] = make_external_id(result["annotation"]["id"])
+        response = {"total": data["total"], "results": data["results"]}
+        if data["cursor"]:
+            response["next"] = update_url(request.url, {"cursor": data["cursor"]})
+        return response
+
+
 @api.doc(params={'annotation_id': '<annotation_uuid>'}, required=False)
 @api.route('/<annotation_id>', endpoint='annotation')
 class AnnotationAPI(Resource):
@@ -1,17 +1,14 @@
-from typing import Dict, Union
 from flask import Flask, Blueprint, request, abort, make_response, jsonify, g, json
 from flask_restx import Namespace, Resource, fields
-from parse.headers_params import get_params
-from models.user_store import UserStore
-from models.annotation_store import AnnotationStore
-from models.annotation_container import AnnotationContainer
+from parse.headers_params import get_params, get_link_params, get_es_setting, check_result_window
+from models.annotation_container import AnnotationContainer, LazyAnnotationContainer
+from models.error import InvalidUsage
 from settings import server_config
+from stores import annotation_store, user_store
 from flask_httpauth import HTTPBasicAuth
 
 namespace = 'collections'
 api_url = server_config['SWAServer']['url'] + server_config['SWAServer']['api_prefix']
-annotation_store = AnnotationStore(server_config["Elasticsearch"])
-user_store = UserStore(server_config["Elasticsearch"])
 api = Namespace(namespace, description='Annotation Collection related operations')
 auth = HTTPBasicAuth()
 
@@ -107,6 +104,23 @@ container_model = api.model("AnnotationContainer", {
     "last": fields.String(description="URI for the last AnnotationPage of the collection"),
 })
 
+batch_model = api.model("CollectionBatch", {
+    "add": fields.List(fields.String, description="ids of annotations to add to the collection"),
+    "remove": fields.List(fields.String, description="ids of annotations to remove from the collection"),
+})
+
+rejected_model = api.model("RejectedAnnotation", {
+    "id": fields.String(description="Annotation ID"),
+    "message": fields.String(description="Reason why the annotation was not added or removed"),
+})
+
+batch_response_model = api.model("CollectionBatchResponse", {
+    "id": fields.String(description="AnnotationCollection ID"),
+    "total": fields.Integer(description="Total number of annotations in the collection after the update"),
+    "modified": fields.Boolean(description="Whether the collection was changed"),
+    "rejected": fields.List(fields.Nested(rejected_model)),
+})
+
 annotation_response = api.clone("AnnotationResponse", response_model, {"annotation": fields.Nested(annotation_model)})
 
 
@@ -144,12 +158,6 @@ def unauthorized():
     return make_response(jsonify({'message': 'Unauthorized access'}), 403)
 
 
-# Update configuration
-def configure_store(config: Dict[str, Union[str, int]]):
-    annotation_store.configure(config)
-    user_store.configure(config)
-
-
 def make_external_id(annotation_id: str) -> str:
     """Turn a full external id with API URL into an internal id without API URL."""
     return f"{api_url}/{namespace}/{annotation_id}"
@@ -160,6 +168,27 @@ def make_internal_id(annotation_id: str) -> str:
     return annotation_id.split('/')[-1]
 
 
+def collection_page_fetcher(annotation_ids, params):
+    """Return a callback that retrieves a single page of the annotations in a collection. Only the
+    descriptions view needs to fetch the annotations themselves, other views only show their ids."""
+    def fetch_page(page_num, page_size):
+        page_ids = annotation_ids[page_num * page_size: (page_num + 1) * page_size]
+        if params["view"] == "PreferContainedDescriptions":
+            return annotation_store.get_annotations_by_id_es(page_ids, params)
+        return page_ids
+    return fetch_page
+
+
+def collection_items_fetcher(collection_id):
+    """Return a callback that retrieves a page of the ids of the annotations in a collection, for
+    responses to changes that only return the metadata of the collection. The items are only read
+    if the view shows a page."""
+    def fetch_page(page_num, page_size):
+        annotation_ids = annotation_store.get_collection_items(collection_id)
+        return annotation_ids[page_num * page_size: (page_num + 1) * page_size]
+    return fetch_page
+
+
 """--------------- Collection endpoints ------------------"""
 
 
@@ -185,6 +214,7 @@ class CollectionsAPI(Resource):
     @api.response(404, 'Annotation Error', response_model)
     def get(self):
         params = get_params(request)
+        check_result_window(params)
         response_data = []
         collection_data = annotation_store.get_collections_es(params)
         for collection in collection_data["collections"]:
@@ -194,6 +224,14 @@ class CollectionsAPI(Resource):
             response_data.append(container.view())
         return response_data
 
+    @auth.login_required
+    @api.response(200, 'Success')
+    @api.response(404, 'Annotation Error', response_model)
+    def head(self):
+        params = get_params(request)
+        total = annotation_store.count_collections_es(params)
+        return {}, 200, {"X-Total-Count": str(total)}
+
 
 @api.route("/<collection_id>")
 class CollectionAPI(Resource):
@@ -206,9 +244,12 @@ class CollectionAPI(Resource):
         params = get_params(request)
         collection = annotation_store.get_collection_es(collection_id, params)
         collection['id'] = make_external_id(collection['id'])
-        if params["view"] == "PreferContainedDescriptions":
-            collection["items"] = annotation_store.get_annotations_by_id_es(collection["items"], params)
-        container = AnnotationContainer(request.base_url, collection, view=params["view"])
+        container = LazyAnnotationContainer(request.base_url, len(collection["items"]),
+                                            collection_page_fetcher(collection["items"], params),
+                                            page_size=params["container_page_size"], view=params["view"],
+                                            collection=collection, link_params=get_link_params(request))
+        if params["show_page"]:
+            return container.view_page(params["page"])
         return container.view()
 
     @auth.login_required
@@ -255,7 +296,9 @@ class CollectionAnnotationsAPI(Resource):
             annotation_data['id'] = make_internal_id(annotation_data['id'])
         collection = annotation_store.add_annotation_to_collection_es(annotation_data['id'], collection_id, params)
         collection['id'] = make_external_id(collection['id'])
-        container = AnnotationContainer(request.base_url, collection, view=params["view"])
+        container = LazyAnnotationContainer(request.base_url, collection["total"],
+                                            collection_items_fetcher(collection_id), view=params["view"],
+                                            collection=collection)
         return container.view()
 
     @auth.login_required
@@ -265,13 +308,40 @@ class CollectionAnnotationsAPI(Resource):
     def get(self, collection_id):
         params = get_params(request)
         collection = annotation_store.get_collection_es(collection_id, params)
-        if params["view"] == "PreferContainedDescriptions" or ("iris" in params and params["iris"] == 0):
-            annotations = annotation_store.get_annotations_by_id_es(collection["items"], params)
-            collection["items"] = annotations
-        container = AnnotationContainer(request.base_url, collection["items"], view=params["view"])
+        container = LazyAnnotationContainer(request.base_url, len(collection["items"]),
+                                            collection_page_fetcher(collection["items"], params),
+                                            page_size=params["container_page_size"], view=params["view"],
+                                            link_params=get_link_params(request))
+        if params["show_page"]:
+            return container.view_page(params["page"])
         return container.view()
 
 
+@api.route("/<collection_id>/annotations/_batch")
+class CollectionAnnotationsBatchAPI(Resource):
+
+    @auth.login_required
+    @api.response(200, 'Success', batch_response_model)
+    @api.response(400, 'Invalid Batch Error', response_model)
+    @api.response(403, 'Invalid Annotation Error', response_model)
+    @api.response(404, 'Invalid Annotation Error', response_model)
+    @api.expect(batch_model)
+    def post(self, collection_id):
+        params = get_params(request, anon_allowed=False)
+        batch = request.get_json()
+        if not isinstance(batch, dict) or not isinstance(batch.get("add", []), list) \
+                or not isinstance(batch.get("remove", []), list):
+            raise InvalidUsage("Batch should be an object with lists of annotation ids to 'add' and 'remove'")
+        add_ids = [make_internal_id(annotation_id) for annotation_id in batch.get("add", [])]
+        remove_ids = [make_internal_id(annotation_id) for annotation_id in batch.get("remove", [])]
+        max_batch_size = get_es_setting("max_batch_size", 10000)
+        if len(add_ids) + len(remove_ids) > max_batch_size:
+            raise InvalidUsage("Batch can contain at most %s annotation ids" % max_batch_size)
+        result = annotation_store.update_collection_items_es(collection_id, add_ids, remove_ids, params)
+        result["id"] = make_external_id(result["id"])
+        return result
+
+
 @api.route("/<collection_id>/annotations/<annotation_id>")
 class CollectionAnnotationAPI(Resource):
 
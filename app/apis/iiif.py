@@ -1,12 +1,10 @@
 from flask import request, abort
 from flask_restx import Namespace, Resource, fields
-from models.annotation_store import AnnotationStore
 from models.iiif_manifest import Manifest
 import models.iiif_manifest as iiif_manifest
-from settings import server_config
+from stores import annotation_store
 from flask_httpauth import HTTPBasicAuth
 
-annotation_store = AnnotationStore(server_config["Elasticsearch"])
 api = Namespace('annotations', description='Annotation related operations')
 auth = HTTPBasicAuth()
 # generic response model
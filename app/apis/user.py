@@ -1,12 +1,10 @@
-from typing import Dict, Union
 import logging
 from flask import request, abort, make_response, jsonify, g
 from flask_restx import Namespace, Resource, fields
-from models.user_store import UserStore
-from settings import server_config
+from stores import user_store
+from models.error import UserError
 from flask_httpauth import HTTPBasicAuth
 
-user_store = UserStore(server_config["Elasticsearch"])
 api = Namespace('users', description='User related operations')
 fh = logging.FileHandler("v1-users.log")
 api.logger.addHandler(fh)
@@ -33,6 +31,34 @@ user_response = api.model("UserResponse", {
 })
 
 
+# group model
+group_model = api.schema_model("Group", {
+    "properties": {
+        "name": {
+            "type": "string"
+        },
+        "members": {
+            "type": "array",
+            "items": {"type": "string"}
+        }
+    }
+})
+
+# group membership update model
+group_members_model = api.schema_model("GroupMembers", {
+    "properties": {
+        "add_members": {
+            "type": "array",
+            "items": {"type": "string"}
+        },
+        "remove_members": {
+            "type": "array",
+            "items": {"type": "string"}
+        }
+    }
+})
+
+
 @auth.verify_password
 def verify_password(token_or_username, password):
     # print('verifying password')
@@ -60,11 +86,6 @@ def unauthorized():
     return make_response(jsonify({'message': 'Unauthorized access'}), 403)
 
 
-# Update configuration
-def configure_store(config: Dict[str, Union[str, int]]):
-    user_store.configure(config)
-
-
 """--------------- User endpoints ------------------"""
 
 
@@ -135,3 +156,88 @@ class LogoutApi(Resource):
         # once token-based auth is implemented, remove token upon logout
         api.logger.info('user with name %s logged out successfully', 'bla')
         return {"action": "logged out"}, 200
+
+
+"""--------------- Group endpoints ------------------"""
+
+
+@api.route("/groups")
+class GroupsApi(Resource):
+
+    @auth.login_required
+    @api.response(201, 'Success')
+    @api.response(400, 'Invalid group data')
+    @api.response(403, 'Unauthorized access')
+    @api.expect(group_model)
+    def post(self):
+        if not g.user:
+            abort(403)
+        group_details = request.get_json()
+        if not group_details or "name" not in group_details:
+            return {"message": "group data requires 'name'"}, 400
+        try:
+            group = user_store.create_group(group_details["name"], g.user.username,
+                                            members=group_details["members"] if "members" in group_details else None)
+        except UserError as error:
+            return error.to_dict(), error.status_code
+        api.logger.info('group with id %s created successfully', group.group_id)
+        return {"action": "created", "group": group.json()}, 201
+
+    @auth.login_required
+    @api.response(200, 'Success')
+    @api.response(403, 'Unauthorized access')
+    def get(self):
+        if not g.user:
+            abort(403)
+        return {"groups": [group.json() for group in user_store.get_groups(g.user.username)]}, 200
+
+
+@api.route("/groups/<group_id>")
+class GroupApi(Resource):
+
+    @auth.login_required
+    @api.response(200, 'Success')
+    @api.response(403, 'Unauthorized access')
+    @api.response(404, 'Group does not exist')
+    def get(self, group_id):
+        if not g.user:
+            abort(403)
+        try:
+            group = user_store.get_group(group_id)
+        except UserError as error:
+            return error.to_dict(), error.status_code
+        if g.user.username not in group.members:
+            abort(403)
+        return {"group": group.json()}, 200
+
+    @auth.login_required
+    @api.response(200, 'Success')
+    @api.response(403, 'Unauthorized access')
+    @api.response(404, 'Group does not exist')
+    @api.expect(group_members_model)
+    def put(self, group_id):
+        if not g.user:
+            abort(403)
+        group_details = request.get_json() or {}
+        try:
+            group = user_store.update_group_members(group_id, g.user.username,
+                                                    add_members=group_details.get("add_members"),
+                                                    remove_members=group_details.get("remove_members"))
+        except UserError as error:
+            return error.to_dict(), error.status_code
+        api.logger.info('group with id %s updated successfully', group.group_id)
+        return {"action": "updated", "group": group.json()}, 200
+
+    @auth.login_required
+    @api.response(200, 'Success')
+    @api.response(403, 'Unauthorized access')
+    @api.response(404, 'Group does not exist')
+    def delete(self, group_id):
+        if not g.user:
+            abort(403)
+        try:
+            group = user_store.delete_group(group_id, g.user.username)
+        except UserError as error:
+            return error.to_dict(), error.status_code
+        api.logger.info('group with id %s deleted successfully', group.group_id)
+        return {"action": "deleted", "group": group.json()}, 200
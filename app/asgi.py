@@ -0,0 +1,256 @@
+"""ASGI entry point for running the server with an ASGI server, e.g.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8080 --workers 4
+
+Reading an annotation and adding an existing annotation to a collection are served natively by
+async handlers on the async stores, so a worker process keeps serving other requests while these
+wait on ES. All other requests go to the Flask app through the asgiref WSGI adapter, which runs
+them in a thread pool.
+"""
+import io
+import json
+import re
+from typing import Callable, Dict, List, Pattern, Tuple, Union
+from asgiref.wsgi import WsgiToAsgi
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.exceptions import TransportError
+from flask import Flask, g
+from werkzeug.wrappers import Request
+
+import stores
+import models.instrumentation as instrumentation
+import models.tenant as tenant
+from apis.annotation import make_external_id as make_external_annotation_id, make_internal_id
+from apis.collection import make_external_id as make_external_collection_id
+from models.annotation import AnnotationError
+from models.annotation_container import LazyAnnotationContainer
+from models.async_annotation_store import AsyncAnnotationStore
+from models.async_calls import run_in_thread
+from models.async_user_store import AsyncUserStore
+from models.error import InvalidUsage, PermissionError, UserError
+from parse.headers_params import get_params, get_project
+from server import create_app
+from settings import server_config
+
+
+def make_async_es_client(es_config: Dict[str, Union[str, int]]) -> AsyncElasticsearch:
+    # the connections of the async client are shared by all requests of the event loop
+    maxsize = es_config["maxsize"] if "maxsize" in es_config else 10
+    return AsyncElasticsearch([{"host": es_config['host'], "port": es_config['port']}], maxsize=maxsize)
+
+
+def make_environ(scope: Dict, body: bytes) -> Dict:
+    """Return the WSGI environ of an ASGI HTTP request, for parsing it with werkzeug."""
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": scope["server"][0] if scope.get("server") else "localhost",
+        "SERVER_PORT": str(scope["server"][1]) if scope.get("server") else "80",
+        "SERVER_PROTOCOL": "HTTP/%s" % scope["http_version"],
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body)
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        if name not in ["CONTENT_TYPE", "CONTENT_LENGTH"]:
+            name = "HTTP_" + name
+        environ[name] = environ[name] + "," + value.decode("latin1") if name in environ else value.decode("latin1")
+    return environ
+
+
+async def read_body(receive: Callable) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def replay_body(body: bytes) -> Callable:
+    """Return a receive callable that gives the request body that was read already."""
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+    return receive
+
+
+def get_json(request: Request) -> Union[None, Dict]:
+    # the same content types as the get_json of Flask requests
+    if request.mimetype != "application/json" and not request.mimetype.endswith("+json"):
+        return None
+    try:
+        return json.loads(request.get_data())
+    except ValueError:
+        return None
+
+
+def has_annotation_id(request: Request) -> bool:
+    # adding a new annotation to a collection creates it first, which is left to the Flask app
+    annotation_data = get_json(request)
+    return isinstance(annotation_data, dict) and "id" in annotation_data
+
+
+def ids_page_fetcher(annotation_ids: List[str]) -> Callable:
+    def fetch_page(page_num, page_size):
+        return annotation_ids[page_num * page_size: (page_num + 1) * page_size]
+    return fetch_page
+
+
+class NativeResponse(Exception):
+    """Response of a native handler, raised to leave the handler at any point."""
+
+    def __init__(self, data: Dict, status_code: int = 200):
+        Exception.__init__(self)
+        self.data = data
+        self.status_code = status_code
+
+
+class SWAServerASGI(object):
+    """ASGI application that serves some endpoints natively and passes all other requests to
+    the Flask app. The async stores share the state of the synchronous stores of the stores
+    module, and are created in the event loop of the worker on the first request."""
+
+    def __init__(self, flask_app: Flask, config: Dict[str, Union[str, Dict]] = server_config):
+        self.flask_app = flask_app
+        self.wsgi_app = WsgiToAsgi(flask_app)
+        self.config = config
+        self.annotation_store: Union[None, AsyncAnnotationStore] = None
+        self.user_store: Union[None, AsyncUserStore] = None
+        api_prefix = re.escape(config["SWAServer"]["api_prefix"])
+        # method, path, endpoint name of the Flask app (for the metrics), handler, and a check of the
+        # request for handlers that only serve some requests. The ids of annotations don't start with
+        # an underscore, paths like _search are endpoints.
+        self.routes: List[Tuple[str, Pattern, str, Callable, Union[None, Callable]]] = [
+            ("GET", re.compile(api_prefix + r"/annotations/(?P<annotation_id>[^/_][^/]*)$"), "api.annotation",
+             self.get_annotation, None),
+            ("POST", re.compile(api_prefix + r"/collections/(?P<collection_id>[^/]+)/annotations/$"),
+             "api.collections_collection_annotations_api", self.add_annotation_to_collection, has_annotation_id)
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] == "http":
+            for method, pattern, endpoint, handler, accepts in self.routes:
+                match = pattern.match(scope["path"])
+                if scope["method"] != method or not match:
+                    continue
+                body = await read_body(receive)
+                request = Request(make_environ(scope, body))
+                if accepts is not None and not accepts(request):
+                    return await self.wsgi_app(scope, replay_body(body), send)
+                return await self.handle(request, send, endpoint, handler, match.groupdict())
+        return await self.wsgi_app(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.open_stores()
+                stores.start_bootstrap()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.close_stores()
+                await send({"type": "lifespan.shutdown.complete"})
+                return None
+
+    def open_stores(self) -> None:
+        if self.annotation_store is not None:
+            return None
+        es = make_async_es_client(self.config["Elasticsearch"])
+        self.annotation_store = AsyncAnnotationStore(stores.annotation_store, es)
+        self.user_store = AsyncUserStore(stores.user_store, es)
+
+    async def close_stores(self) -> None:
+        if self.annotation_store is not None:
+            await self.annotation_store.close()
+            self.annotation_store = None
+            self.user_store = None
+
+    async def handle(self, request: Request, send, endpoint: str, handler: Callable, url_params: Dict):
+        timings_token = instrumentation.start_request()
+        try:
+            response = await self.handle_request(request, handler, url_params)
+        finally:
+            timings = instrumentation.finish_request(timings_token, endpoint, request.method)
+        headers = [(b"content-type", b"application/json"),
+                   (b"server-timing", timings.server_timing().encode("latin1"))]
+        if request.headers.get("Origin"):
+            # the CORS headers of the Flask app
+            headers += [(b"access-control-allow-origin", b"*"),
+                        (b"access-control-expose-headers", b"X-Total-Count, Server-Timing, X-Profile-Id")]
+        await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": json.dumps(response.data).encode("utf-8") + b"\n"})
+
+    async def handle_request(self, request: Request, handler: Callable, url_params: Dict) -> NativeResponse:
+        self.open_stores()
+        project_token = None
+        try:
+            # the indices are bootstrapped on the first API request, like the Flask app does
+            if not stores.indices_ready():
+                await run_in_thread(stores.ensure_indices)
+            project_token = tenant.set_project(get_project(request))
+            return await handler(request, **url_params)
+        except NativeResponse as response:
+            return response
+        except (AnnotationError, InvalidUsage) as error:
+            return NativeResponse(error.to_dict(), error.status_code)
+        except PermissionError:
+            return NativeResponse({'message': 'Unauthorized access'}, 403)
+        except TransportError as error:
+            if isinstance(error.status_code, int):
+                raise
+            # ES couldn't be reached
+            return NativeResponse({"message": "Annotation store is not available"}, 503)
+        finally:
+            if project_token is not None:
+                tenant.reset_project(project_token)
+
+    async def authenticate(self, request: Request):
+        """Return the user of the request, or None for anonymous requests, with the same checks as
+        the verify_password callback of the Flask API."""
+        username = request.authorization.username if request.authorization else None
+        password = request.authorization.password if request.authorization else None
+        if not username and not password:
+            return None
+        try:
+            user = await self.user_store.verify_auth_token(username)
+            if user:
+                return user
+            if await self.user_store.verify_user(username, password):
+                return await self.user_store.get_user(username)
+        except UserError:
+            pass
+        # return 403 instead of 401 to prevent browsers from displaying the default auth dialog
+        raise NativeResponse({'message': 'Unauthorized access'}, 403)
+
+    async def get_params(self, request: Request, anon_allowed: bool = True) -> Dict:
+        user = await self.authenticate(request)
+        # the parsing of the Flask API reads the user from g, there is no await while it is set
+        with self.flask_app.app_context():
+            g.user = user
+            return get_params(request, anon_allowed=anon_allowed)
+
+    async def get_annotation(self, request: Request, annotation_id: str) -> NativeResponse:
+        params = await self.get_params(request)
+        annotation = await self.annotation_store.get_annotation_es(annotation_id, params)
+        annotation['id'] = make_external_annotation_id(annotation['id'])
+        return NativeResponse(annotation)
+
+    async def add_annotation_to_collection(self, request: Request, collection_id: str) -> NativeResponse:
+        params = await self.get_params(request, anon_allowed=False)
+        annotation_id = make_internal_id(get_json(request)['id'])
+        collection = await self.annotation_store.add_annotation_to_collection_es(annotation_id, collection_id, params)
+        collection['id'] = make_external_collection_id(collection['id'])
+        # the update only returns the metadata, the items are read if the view shows the first page
+        annotation_ids = []
+        if params["view"] != "PreferMinimalContainer" and collection["total"] > 0:
+            annotation_ids = await self.annotation_store.get_collection_items(collection_id)
+        container = LazyAnnotationContainer(request.base_url, collection["total"], ids_page_fetcher(annotation_ids),
+                                            view=params["view"], collection=collection)
+        return NativeResponse(container.view())
+
+
+app = SWAServerASGI(create_app(server_config))
@@ -0,0 +1,397 @@
+"""Generator of synthetic annotation corpora for benchmarks and load tests. The annotations have
+the shapes of the annotation examples: targets with a plain id, a SubresourceSelector or a
+NestedPIDSelector, classifying bodies, chains of annotations on annotations and private, shared
+and public permissions. Collections get their items from the annotations their owner can see.
+
+Corpora are generated from a seeded random generator, so the same settings always give the same
+annotations, including their ids and creation times, and benchmark runs are comparable. The
+corpus is generated as a stream, so corpora of 10^7 annotations don't have to fit in memory.
+Write a corpus as NDJSON, or bulk load it into the annotation index of the settings:
+
+    python -m benchmark.corpus --size 1000000 --seed 1 --output corpus.ndjson
+    python -m benchmark.corpus --input corpus.ndjson --load
+"""
+import argparse
+import copy
+import datetime
+import json
+import random
+import sys
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, TextIO
+import pytz
+from annotation_examples import annotations as examples
+from models.annotation import Annotation
+from models.annotation_collection import AnnotationCollection
+from models.annotation_store import AnnotationStore, is_annotation
+import models.permissions as permissions
+from settings import server_config
+
+words = ["letter", "brother", "painting", "sunflowers", "arles", "paris", "theo", "vincent", "portrait",
+         "landscape", "colour", "yellow", "studio", "money", "health", "friend", "gauguin", "exhibition"]
+
+default_permission_mix = {"private": 0.5, "shared": 0.2, "public": 0.3}
+
+default_target_mix = {"resource": 0.4, "subresource": 0.3, "nestedpid": 0.3}
+
+body_examples = ["vincent", "theo", "brothers"]
+
+corpus_id = "urn:swa:corpus"
+
+corpus_start = datetime.datetime(2020, 1, 1, tzinfo=pytz.utc)
+
+
+def make_id(rng: random.Random) -> str:
+    return uuid.UUID(int=rng.getrandbits(128), version=4).urn
+
+
+def make_users(num_users: int) -> List[str]:
+    return ["user%d" % user_num for user_num in range(num_users)]
+
+
+def make_letter_id(letter_num: int) -> str:
+    return "%s:letter:%d" % (corpus_id, letter_num)
+
+
+def make_paragraph_id(letter_num: int, paragraph_num: int) -> str:
+    return "%s.p%d" % (make_letter_id(letter_num), paragraph_num)
+
+
+def parse_mix(mix: str, known: Dict[str, float]) -> Dict[str, float]:
+    """Parse a mix of weights like private:0.5,shared:0.2,public:0.3"""
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition(":")
+        if kind not in known:
+            raise ValueError("unknown kind {k}, expected one of {e}".format(k=kind, e=", ".join(known)))
+        weights[kind] = float(weight)
+    return weights
+
+
+def parse_permission_mix(permission_mix: str) -> Dict[str, float]:
+    return parse_mix(permission_mix, default_permission_mix)
+
+
+def parse_target_mix(target_mix: str) -> Dict[str, float]:
+    return parse_mix(target_mix, default_target_mix)
+
+
+def choose(rng: random.Random, mix: Dict[str, float]) -> str:
+    return rng.choices(list(mix.keys()), weights=list(mix.values()))[0]
+
+
+def make_params(rng: random.Random, users: List[str], permission_mix: Dict[str, float], share_size: int) -> Dict:
+    access_status = choose(rng, permission_mix)
+    params = {"username": rng.choice(users), "access_status": [access_status]}
+    if access_status == "shared":
+        params["can_see"] = rng.sample(users, min(share_size, len(users)))
+        params["can_edit"] = params["can_see"][:max(1, len(params["can_see"]) // 5)]
+    return params
+
+
+def make_resource_target(resource_id: str) -> Dict:
+    target = copy.deepcopy(examples["vincent"]["target"][0])
+    target["id"] = resource_id
+    target["type"] = "Paragraph"
+    return target
+
+
+def make_subresource_target(letter_num: int, paragraph_num: int) -> Dict:
+    target = copy.deepcopy(examples["vincent-subresource"]["target"][0])
+    target["source"] = make_letter_id(letter_num)
+    target["selector"]["value"]["subresource"]["id"] = make_paragraph_id(letter_num, paragraph_num)
+    target["selector"]["value"]["subresource"]["type"] = ["Paragraph", "Text"]
+    return target
+
+
+def make_nestedpid_target(letter_num: int, paragraph_num: int) -> Dict:
+    target = copy.deepcopy(examples["vincent-nestedpid"]["target"][0])
+    target["source"] = make_letter_id(letter_num)
+    correspondence, letter, paragraph = target["selector"]["value"]
+    correspondence["id"] = corpus_id
+    letter["id"] = make_letter_id(letter_num)
+    paragraph["id"] = make_paragraph_id(letter_num, paragraph_num)
+    paragraph["type"] = ["Paragraph", "Text"]
+    return target
+
+
+def make_target(rng: random.Random, target_kind: str, num_letters: int, paragraphs_per_letter: int) -> Dict:
+    letter_num = rng.randrange(num_letters)
+    paragraph_num = rng.randrange(paragraphs_per_letter)
+    if target_kind == "subresource":
+        return make_subresource_target(letter_num, paragraph_num)
+    if target_kind == "nestedpid":
+        return make_nestedpid_target(letter_num, paragraph_num)
+    return make_resource_target(make_paragraph_id(letter_num, paragraph_num))
+
+
+def make_annotation_target(annotation_id: str) -> Dict:
+    return {"id": annotation_id, "type": "Annotation"}
+
+
+def get_resource_ids(target: Dict) -> List[str]:
+    if "id" in target:
+        return [target["id"]]
+    if target["selector"]["type"] == "SubresourceSelector":
+        return [target["source"], target["selector"]["value"]["subresource"]["id"]]
+    return [resource["id"] for resource in target["selector"]["value"]]
+
+
+def make_annotation(rng: random.Random, annotation_id: str, targets: List[Dict], created: str) -> Dict:
+    example = examples[rng.choice(body_examples)]
+    body = copy.deepcopy(example["body"])
+    body.append({"type": "TextualBody", "value": " ".join(rng.choices(words, k=8)), "purpose": "commenting"})
+    return {
+        "@context": example["@context"],
+        "type": "Annotation",
+        "id": annotation_id,
+        "created": created,
+        "target": targets,
+        "motivation": example["motivation"],
+        "body": body
+    }
+
+
+def can_see(params: Dict, username: str) -> bool:
+    if "public" in params["access_status"] or params["username"] == username:
+        return True
+    return "shared" in params["access_status"] and username in params["can_see"]
+
+
+class ChainPool(object):
+    """Bounded sample of annotation ids that new annotations can target, so chains can be made
+    without keeping all ids of a large corpus in memory."""
+
+    def __init__(self, rng: random.Random, max_size: int):
+        self.rng = rng
+        self.max_size = max_size
+        self.ids: List[str] = []
+
+    def add(self, annotation_id: str) -> None:
+        if len(self.ids) < self.max_size:
+            self.ids.append(annotation_id)
+        else:
+            self.ids[self.rng.randrange(self.max_size)] = annotation_id
+
+    def choose(self) -> str:
+        return self.rng.choice(self.ids)
+
+
+def generate_annotations(size: int, seed: int = 0, chain_depth: int = 2, chain_ratio: float = 0.2,
+                         fan_out: int = 1, target_mix: Dict[str, float] = None,
+                         permission_mix: Dict[str, float] = None, num_users: int = 10, share_size: int = 3,
+                         paragraphs_per_letter: int = 10, chain_pool_size: int = 10000) -> Iterator[Dict]:
+    """Generate size annotation records, each with the annotation, the permission parameters to
+    create it with, its chain depth and the ids of the resources it targets. Annotations that
+    target other annotations (chains of at most chain_depth links) come after their targets,
+    so the annotations can be created in the given order."""
+    rng = random.Random(seed)
+    users = make_users(max(num_users, share_size))
+    num_letters = max(1, size // (paragraphs_per_letter * 10))
+    target_mix = target_mix if target_mix else default_target_mix
+    permission_mix = permission_mix if permission_mix else default_permission_mix
+    # annotations per chain depth, so no chain gets longer than chain_depth
+    chain_pools = [ChainPool(rng, chain_pool_size) for _ in range(chain_depth)]
+    for annotation_num in range(size):
+        annotation_id = make_id(rng)
+        created = (corpus_start + datetime.timedelta(seconds=annotation_num)).isoformat()
+        params = make_params(rng, users, permission_mix, share_size)
+        depths = [depth for depth in range(chain_depth) if chain_pools[depth].ids]
+        if depths and rng.random() < chain_ratio:
+            depth = rng.choice(depths)
+            targets = [make_annotation_target(chain_pools[depth].choose())]
+            depth += 1
+        else:
+            depth = 0
+            targets = [make_target(rng, choose(rng, target_mix), num_letters, paragraphs_per_letter)
+                       for _ in range(fan_out)]
+        if depth < chain_depth:
+            chain_pools[depth].add(annotation_id)
+        resource_ids = [resource_id for target in targets if not is_annotation(target)
+                        for resource_id in get_resource_ids(target)]
+        yield {"annotation": make_annotation(rng, annotation_id, targets, created), "params": params,
+               "depth": depth, "resource_ids": list(dict.fromkeys(resource_ids))}
+
+
+def generate_corpus(size: int, seed: int = 0, num_collections: int = 0, collection_size: int = 1000,
+                    **annotation_settings) -> Iterator[Dict]:
+    """Generate the annotation records, followed by num_collections collection records. The items of
+    each collection are a uniform sample of the annotations that the collection owner can see."""
+    # collections have their own random generator, so they don't change the annotations
+    rng = random.Random(seed + 1)
+    users = make_users(max(annotation_settings.get("num_users", 10), annotation_settings.get("share_size", 3)))
+    owners = [users[collection_num % len(users)] for collection_num in range(num_collections)]
+    samples = [[] for _ in range(num_collections)]
+    seen = [0] * num_collections
+    for record in generate_annotations(size, seed=seed, **annotation_settings):
+        yield record
+        for collection_num, owner in enumerate(owners):
+            if not can_see(record["params"], owner):
+                continue
+            # reservoir sampling
+            seen[collection_num] += 1
+            if len(samples[collection_num]) < collection_size:
+                samples[collection_num].append(record["annotation"]["id"])
+            else:
+                item_num = rng.randrange(seen[collection_num])
+                if item_num < collection_size:
+                    samples[collection_num][item_num] = record["annotation"]["id"]
+    for collection_num, owner in enumerate(owners):
+        collection = {
+            "@context": "http://www.w3.org/ns/anno.jsonld",
+            "type": "AnnotationCollection",
+            "id": make_id(rng),
+            "label": "Collection %d" % collection_num,
+            "creator": owner,
+            "created": (corpus_start + datetime.timedelta(seconds=size + collection_num)).isoformat()
+        }
+        yield {"collection": collection, "params": {"username": owner, "access_status": ["private"]},
+               "items": samples[collection_num]}
+
+
+def read_ndjson(fh: TextIO) -> Iterator[Dict]:
+    for line in fh:
+        if line.strip():
+            yield json.loads(line)
+
+
+class CorpusLoader(object):
+    """Loads corpus records into the store with bulk requests. Target lists are computed like the
+    store does, but the target lists of recently loaded annotations are kept in memory, so chains
+    don't need a request to ES per annotation."""
+
+    def __init__(self, store: AnnotationStore, batch_size: int = 1000, cache_size: int = 100000):
+        self.store = store
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.target_lists = OrderedDict()
+        self.batches = {"Annotation": [], "AnnotationCollection": []}
+        self.indexed = 0
+        self.errors = []
+
+    def get_target_list(self, annotation: Annotation) -> List[Dict]:
+        target_list = copy.deepcopy(annotation.get_targets_info())
+        target_ids = [target["id"] for target in target_list]
+        for target in list(target_list):
+            if not is_annotation(target):
+                continue
+            if target["id"] not in self.target_lists:
+                # the target was loaded earlier or by another process
+                self.flush()
+                self.store.index_refresh()
+                target_annotation = Annotation(self.store.get_from_index_by_id(target["id"], "Annotation"))
+                self.remember(target["id"], self.store.get_target_list(target_annotation))
+            for deeper_target in self.target_lists[target["id"]]:
+                if deeper_target["id"] not in target_ids:
+                    target_list.append(deeper_target)
+                    target_ids.append(deeper_target["id"])
+        return target_list
+
+    def remember(self, annotation_id: str, target_list: List[Dict]) -> None:
+        self.target_lists[annotation_id] = target_list
+        if len(self.target_lists) > self.cache_size:
+            self.target_lists.popitem(last=False)
+
+    def add(self, record: Dict) -> None:
+        params = copy.deepcopy(record["params"])
+        if "annotation" in record:
+            annotation = Annotation(copy.deepcopy(record["annotation"]))
+            permissions.add_permissions(annotation, params)
+            annotation.target_list = self.get_target_list(annotation)
+            self.remember(annotation.id, annotation.target_list)
+            self.add_to_batch(annotation.to_json(), "Annotation")
+        else:
+            collection_data = copy.deepcopy(record["collection"])
+            collection_data["items"] = record["items"]
+            collection = AnnotationCollection(collection_data)
+            permissions.add_permissions(collection, params)
+            self.add_to_batch(collection.to_json(), "AnnotationCollection")
+
+    def add_to_batch(self, document: Dict, annotation_type: str) -> None:
+        self.batches[annotation_type].append(document)
+        if len(self.batches[annotation_type]) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        for annotation_type, batch in self.batches.items():
+            if batch:
+                indexed, errors = self.store.add_bulk_to_index(batch, annotation_type)
+                self.indexed += indexed
+                self.errors += errors
+                self.batches[annotation_type] = []
+
+
+def load_corpus(store: AnnotationStore, records: Iterable[Dict], batch_size: int = 1000) -> CorpusLoader:
+    loader = CorpusLoader(store, batch_size=batch_size)
+    for record in records:
+        loader.add(record)
+    loader.flush()
+    store.index_refresh()
+    return loader
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Generate a synthetic annotation corpus")
+    parser.add_argument("--size", type=int, default=1000, help="number of annotations")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chain-depth", type=int, default=2, help="maximum length of annotation chains")
+    parser.add_argument("--chain-ratio", type=float, default=0.2, help="fraction of annotations on annotations")
+    parser.add_argument("--fan-out", type=int, default=1, help="number of resource targets per annotation")
+    parser.add_argument("--target-mix", default="resource:0.4,subresource:0.3,nestedpid:0.3",
+                        help="weights of the target shapes")
+    parser.add_argument("--permission-mix", default="private:0.5,shared:0.2,public:0.3",
+                        help="weights of the access statuses")
+    parser.add_argument("--users", type=int, default=10, help="number of users")
+    parser.add_argument("--share-size", type=int, default=3, help="number of users a shared annotation is shared with")
+    parser.add_argument("--collections", type=int, default=0, help="number of collections")
+    parser.add_argument("--collection-size", type=int, default=1000, help="number of annotations per collection")
+    parser.add_argument("--input", help="read the corpus from this NDJSON file instead of generating it")
+    parser.add_argument("--output", help="write the corpus as NDJSON to this file ('-' for stdout)")
+    parser.add_argument("--load", action="store_true", help="bulk load the corpus into the ES in the settings")
+    parser.add_argument("--batch-size", type=int, default=1000, help="number of documents per bulk request")
+    args = parser.parse_args(argv)
+    if not args.output and not args.load:
+        parser.error("use --output and/or --load")
+
+    if args.input:
+        input_fh = open(args.input, "rt")
+        records = read_ndjson(input_fh)
+    else:
+        input_fh = None
+        records = generate_corpus(args.size, seed=args.seed, num_collections=args.collections,
+                                  collection_size=args.collection_size, chain_depth=args.chain_depth,
+                                  chain_ratio=args.chain_ratio, fan_out=args.fan_out,
+                                  target_mix=parse_target_mix(args.target_mix),
+                                  permission_mix=parse_permission_mix(args.permission_mix),
+                                  num_users=args.users, share_size=args.share_size)
+    output_fh = None
+    if args.output:
+        output_fh = sys.stdout if args.output == "-" else open(args.output, "wt")
+    loader = CorpusLoader(AnnotationStore(server_config["Elasticsearch"]), batch_size=args.batch_size) \
+        if args.load else None
+    num_records = 0
+    try:
+        # a single pass, so the corpus never has to fit in memory
+        for record in records:
+            if output_fh:
+                output_fh.write(json.dumps(record) + "\n")
+            if loader:
+                loader.add(record)
+            num_records += 1
+        if loader:
+            loader.flush()
+            loader.store.index_refresh()
+    finally:
+        if input_fh:
+            input_fh.close()
+        if output_fh and output_fh is not sys.stdout:
+            output_fh.close()
+    print("{n} records".format(n=num_records), file=sys.stderr)
+    if loader:
+        print("indexed {n} documents, {e} errors".format(n=loader.indexed, e=len(loader.errors)), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,811 @@
+import asyncio
+import copy
+import datetime
+import functools
+import itertools
+import json
+import re
+import threading
+import time
+import unicodedata
+from types import SimpleNamespace
+from typing import Dict, List, Tuple, Union
+import pytz
+from elasticsearch.exceptions import ConflictError, NotFoundError, RequestError, TransportError
+from elasticsearch.serializer import JSONSerializer
+import models.es_scripts as es_scripts
+
+"""--------------- In-process stand-in for the Elasticsearch client ------------------"""
+
+# The fake implements the part of the client API and the query DSL that the stores use, with
+# the same responses and exceptions as ES 7, so the store code runs unchanged against it.
+# Searches scan all documents of an index, so search latencies grow linearly with the corpus
+# size. They are meant for comparing runs of the benchmark, not for predicting ES latencies.
+
+token_pattern = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text) -> List[str]:
+    """Approximation of the standard tokenizer with lowercasing and folding of diacritics."""
+    tokens = []
+    for token in token_pattern.findall(str(text).lower()):
+        tokens.append(token)
+        folded = "".join(char for char in unicodedata.normalize("NFKD", token) if not unicodedata.combining(char))
+        if folded != token:
+            tokens.append(folded)
+    return tokens
+
+
+def get_field_values(source, field: str) -> list:
+    """Return the values of a (dotted) field, descending into lists like ES does."""
+    values = [source]
+    for part in field.split("."):
+        next_values = []
+        for value in values:
+            if isinstance(value, list):
+                value = [item[part] for item in value if isinstance(item, dict) and part in item]
+                next_values += flatten(value)
+            elif isinstance(value, dict) and part in value:
+                next_values += flatten([value[part]])
+        values = next_values
+    return [value for value in values if value is not None]
+
+
+def flatten(values: list) -> list:
+    flat = []
+    for value in values:
+        if isinstance(value, list):
+            flat += flatten(value)
+        else:
+            flat.append(value)
+    return flat
+
+
+def is_keyword_field(field: str) -> bool:
+    # dynamically mapped strings are text with a keyword sub-field, status is mapped as keyword
+    return field.endswith(".keyword") or field in ["status", "_id"]
+
+
+def strip_keyword(field: str) -> str:
+    return field[:-len(".keyword")] if field.endswith(".keyword") else field
+
+
+date_math_pattern = re.compile(r"^now(?:([+-])(\d+)([smhdwMy]))?$")
+date_math_units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "M": 2592000, "y": 31536000}
+
+
+def parse_range_value(value):
+    if not isinstance(value, str):
+        return value
+    match = date_math_pattern.match(value)
+    if match:
+        now = datetime.datetime.now(pytz.utc)
+        if match.group(1):
+            delta = datetime.timedelta(seconds=int(match.group(2)) * date_math_units[match.group(3)])
+            now = now + delta if match.group(1) == "+" else now - delta
+        return now
+    return parse_date(value)
+
+
+def parse_date(value):
+    try:
+        date = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    return date if date.tzinfo else pytz.utc.localize(date)
+
+
+def in_range(value, bounds: Dict) -> bool:
+    value = parse_range_value(value)
+    try:
+        for operator, bound in bounds.items():
+            bound = parse_range_value(bound)
+            if operator == "lt" and not value < bound:
+                return False
+            if operator == "lte" and not value <= bound:
+                return False
+            if operator == "gt" and not value > bound:
+                return False
+            if operator == "gte" and not value >= bound:
+                return False
+    except TypeError:
+        return False
+    return True
+
+
+def field_and_value(clause: Dict):
+    field, value = list(clause.items())[0]
+    if isinstance(value, dict):
+        value = value["query"] if "query" in value else value["value"]
+    return field, value
+
+
+def matches(query: Union[None, Dict], doc_id: str, source: Dict) -> bool:
+    if not query:
+        return True
+    query_type, clause = list(query.items())[0]
+    if query_type == "match_all":
+        return True
+    if query_type == "bool":
+        return matches_bool(clause, doc_id, source)
+    if query_type == "ids":
+        return doc_id in clause["values"]
+    if query_type in ["term", "terms"]:
+        field, value = list(clause.items())[0]
+        if isinstance(value, dict):
+            value = value["value"]
+        wanted = value if query_type == "terms" else [value]
+        values = [doc_id] if field == "_id" else get_field_values(source, strip_keyword(field))
+        return any(value in wanted for value in values)
+    if query_type == "match":
+        field, value = field_and_value(clause)
+        values = get_field_values(source, strip_keyword(field))
+        if is_keyword_field(field):
+            return value in values
+        query_tokens = set(tokenize(value))
+        return any(query_tokens & set(tokenize(field_value)) for field_value in values)
+    if query_type == "range":
+        field, bounds = list(clause.items())[0]
+        return any(in_range(value, bounds) for value in get_field_values(source, field))
+    if query_type == "exists":
+        return len(get_field_values(source, clause["field"])) > 0
+    if query_type == "simple_query_string":
+        field_tokens = set()
+        for field in clause.get("fields", ["*"]):
+            for value in get_field_values(source, field):
+                field_tokens.update(tokenize(value))
+        query_tokens = set(tokenize(clause["query"]))
+        if clause.get("default_operator", "or").lower() == "and":
+            return len(query_tokens) > 0 and query_tokens <= field_tokens
+        return len(query_tokens & field_tokens) > 0
+    raise RequestError(400, "parsing_exception", {"error": "unknown query [%s]" % query_type})
+
+
+def as_list(clauses) -> list:
+    if clauses is None:
+        return []
+    return clauses if isinstance(clauses, list) else [clauses]
+
+
+def matches_bool(clause: Dict, doc_id: str, source: Dict) -> bool:
+    required = as_list(clause.get("must")) + as_list(clause.get("filter"))
+    if not all(matches(query, doc_id, source) for query in required):
+        return False
+    if any(matches(query, doc_id, source) for query in as_list(clause.get("must_not"))):
+        return False
+    should = as_list(clause.get("should"))
+    # should clauses are optional when there are required clauses
+    minimum_should_match = clause.get("minimum_should_match", 0 if required else 1)
+    if should and sum(1 for query in should if matches(query, doc_id, source)) < int(minimum_should_match):
+        return False
+    return True
+
+
+def score(query: Union[None, Dict], source: Dict) -> float:
+    """Only full-text queries in must context contribute to the score, as in the store's queries."""
+    if not query:
+        return 1.0
+    query_type, clause = list(query.items())[0]
+    if query_type == "bool":
+        return 1.0 + sum(score(must, source) - 1.0 for must in as_list(clause.get("must")))
+    if query_type == "simple_query_string":
+        query_tokens = set(tokenize(clause["query"]))
+        field_tokens = []
+        for field in clause.get("fields", ["*"]):
+            for value in get_field_values(source, field):
+                field_tokens += tokenize(value)
+        return 1.0 + sum(1 for token in field_tokens if token in query_tokens)
+    return 1.0
+
+
+def project_source(source: Dict, paths: List[List[str]]):
+    projected = {}
+    for key, value in source.items():
+        sub_paths = [path[1:] for path in paths if path[0] in [key, "*"]]
+        if not sub_paths:
+            continue
+        if any(len(path) == 0 for path in sub_paths):
+            projected[key] = copy.deepcopy(value)
+        elif isinstance(value, dict):
+            projected[key] = project_source(value, sub_paths)
+        elif isinstance(value, list):
+            projected[key] = [project_source(item, sub_paths) for item in value if isinstance(item, dict)]
+    return projected
+
+
+def exclude_source(source: Dict, paths: List[List[str]]):
+    excluded = {}
+    for key, value in source.items():
+        if [key] in paths:
+            continue
+        sub_paths = [path[1:] for path in paths if path[0] == key and len(path) > 1]
+        if sub_paths and isinstance(value, dict):
+            excluded[key] = exclude_source(value, sub_paths)
+        elif sub_paths and isinstance(value, list):
+            excluded[key] = [exclude_source(item, sub_paths) if isinstance(item, dict) else item for item in value]
+        else:
+            excluded[key] = copy.deepcopy(value)
+    return excluded
+
+
+def filter_source(source: Dict, source_filter=None, includes=None, excludes=None):
+    """Apply a _source parameter (False, a list of fields or includes/excludes) to a document."""
+    if source_filter is False:
+        return None
+    if isinstance(source_filter, str):
+        includes = [source_filter]
+    elif isinstance(source_filter, list):
+        includes = source_filter
+    elif isinstance(source_filter, dict):
+        includes = source_filter.get("includes", includes)
+        excludes = source_filter.get("excludes", excludes)
+    if isinstance(includes, str):
+        includes = includes.split(",")
+    if isinstance(excludes, str):
+        excludes = excludes.split(",")
+    if includes:
+        source = project_source(source, [path.split(".") for path in includes])
+    if excludes:
+        source = exclude_source(source, [path.split(".") for path in excludes])
+    return copy.deepcopy(source) if not includes and not excludes else source
+
+
+def update_items(source: Dict, params: Dict) -> bool:
+    """Python version of es_scripts.update_items_source. Returns False for a noop."""
+    if source.get("status") == "deleted":
+        return False
+    before = len(source["items"])
+    remove = set(params["remove"])
+    source["items"] = [item for item in source["items"] if item not in remove]
+    existing = set(source["items"])
+    added = 0
+    for annotation_id in params["add"]:
+        if annotation_id not in existing:
+            existing.add(annotation_id)
+            source["items"].append(annotation_id)
+            added += 1
+    if added == 0 and len(source["items"]) == before:
+        return False
+    source["total"] = len(source["items"])
+    source["modified"] = params["modified"]
+    if params.get("permissions") is not None:
+        source["permissions"] = params["permissions"]
+    return True
+
+
+def update_metadata(source: Dict, params: Dict) -> bool:
+    """Python version of es_scripts.update_metadata_source. Returns False for a noop."""
+    if source.get("status") == "deleted":
+        return False
+    if source.get("creator") == params["creator"] and source.get("label") == params["label"]:
+        return False
+    source["creator"] = params["creator"]
+    source["label"] = params["label"]
+    source["modified"] = params["modified"]
+    return True
+
+
+def increment_sequence(source: Dict, params: Dict) -> bool:
+    """Python version of es_scripts.increment_sequence_source."""
+    source["last_seq"] += params["count"]
+    return True
+
+
+# painless scripts can't be run in-process, so each known script has a python equivalent
+script_functions = {
+    es_scripts.update_items_source: update_items,
+    es_scripts.update_metadata_source: update_metadata,
+    es_scripts.increment_sequence_source: increment_sequence
+}
+
+
+def make_sort_key(sort_spec: List[Dict]):
+    def sort_values(hit):
+        values = []
+        for field, _ in sort_spec:
+            if field == "_score":
+                values.append(hit["_score"])
+            elif field == "_doc":
+                values.append(hit["_doc"])
+            elif field == "_id":
+                values.append(hit["_id"])
+            else:
+                field_values = get_field_values(hit["_source"], strip_keyword(field))
+                values.append(min(field_values) if field_values else None)
+        return values
+    return sort_values
+
+
+def compare_sort_values(sort_spec: List, values1: list, values2: list) -> int:
+    for (_, order), value1, value2 in zip(sort_spec, values1, values2):
+        if value1 == value2:
+            continue
+        # missing values sort last, regardless of the order
+        if value1 is None:
+            return 1
+        if value2 is None:
+            return -1
+        result = -1 if value1 < value2 else 1
+        return result if order == "asc" else -result
+    return 0
+
+
+def parse_sort(sort) -> List:
+    if sort is None:
+        return []
+    sort_spec = []
+    for item in as_list(sort):
+        if isinstance(item, str):
+            field, _, order = item.partition(":")
+            order = order or ("desc" if field == "_score" else "asc")
+        else:
+            field, order = list(item.items())[0]
+            if isinstance(order, dict):
+                order = order.get("order", "asc")
+        sort_spec.append((field, order))
+    return sort_spec
+
+
+def aggregate(aggregations: Dict, hits: List[Dict]) -> Dict:
+    results = {}
+    for name, aggregation in aggregations.items():
+        aggregation_type, clause = list(aggregation.items())[0]
+        counts = {}
+        for hit in hits:
+            values = get_field_values(hit["_source"], strip_keyword(clause["field"]))
+            if aggregation_type == "date_histogram":
+                values = [str(value)[:10] for value in values]
+            for value in set(values):
+                counts[value] = counts.get(value, 0) + 1
+        if aggregation_type == "terms":
+            buckets = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:clause.get("size", 10)]
+            results[name] = {"buckets": [{"key": key, "doc_count": count} for key, count in buckets]}
+        elif aggregation_type == "date_histogram":
+            buckets = []
+            for day, count in sorted(counts.items()):
+                date = pytz.utc.localize(datetime.datetime.strptime(day, "%Y-%m-%d"))
+                buckets.append({"key_as_string": day, "key": int(date.timestamp() * 1000), "doc_count": count})
+            results[name] = {"buckets": buckets}
+        else:
+            raise RequestError(400, "parsing_exception", {"error": "unknown aggregation [%s]" % aggregation_type})
+    return results
+
+
+def resolve_date_math(index: str) -> str:
+    # e.g. <swa-{now/d}-000001> becomes swa-2020.07.01-000001
+    if index.startswith("<") and index.endswith(">"):
+        today = datetime.datetime.now(pytz.utc).strftime("%Y.%m.%d")
+        return index[1:-1].replace("{now/d}", today)
+    return index
+
+
+def next_rollover_index_name(provided_name: str) -> str:
+    # like ES, increment the counter at the end of the name the old index was created with, so a
+    # date math name is resolved again for the new index
+    date_math = provided_name.startswith("<") and provided_name.endswith(">")
+    name = provided_name[1:-1] if date_math else provided_name
+    match = re.match(r"^(.*)-(\d+)$", name)
+    if not match:
+        raise RequestError(400, "illegal_argument_exception",
+                           {"error": "index name [%s] does not match pattern '^.*-\\d+$'" % name})
+    name = "%s-%06d" % (match.group(1), int(match.group(2)) + 1)
+    return "<%s>" % name if date_math else name
+
+
+def make_shards():
+    return {"total": 1, "successful": 1, "skipped": 0, "failed": 0}
+
+
+class FakeIndicesClient(object):
+
+    def __init__(self, client):
+        self.client = client
+
+    def exists(self, index, **kwargs) -> bool:
+        return all(name in self.client.docs or name in self.client.aliases for name in index.split(","))
+
+    def create(self, index, body=None, **kwargs):
+        provided_name = index
+        index = resolve_date_math(index)
+        with self.client.lock:
+            if index in self.client.docs or index in self.client.aliases:
+                raise RequestError(400, "resource_already_exists_exception",
+                                   {"error": "index [%s] already exists" % index})
+            self.client.create_index(index, provided_name)
+            if body and "aliases" in body:
+                for alias, properties in body["aliases"].items():
+                    self.client.aliases.setdefault(alias, {})[index] = dict(properties)
+        return {"acknowledged": True, "shards_acknowledged": True, "index": index}
+
+    def delete(self, index, **kwargs):
+        with self.client.lock:
+            for name in self.client.resolve(index):
+                del self.client.docs[name]
+                del self.client.created_at[name]
+                del self.client.provided_names[name]
+                for alias in list(self.client.aliases):
+                    self.client.aliases[alias].pop(name, None)
+                    if not self.client.aliases[alias]:
+                        del self.client.aliases[alias]
+        return {"acknowledged": True}
+
+    def refresh(self, index=None, **kwargs):
+        # documents are searchable as soon as they are written
+        return {"_shards": make_shards()}
+
+    def put_alias(self, index, name, body=None, **kwargs):
+        with self.client.lock:
+            for concrete_index in self.client.resolve(index):
+                self.client.aliases.setdefault(name, {})[concrete_index] = dict(body) if body else {}
+        return {"acknowledged": True}
+
+    def exists_alias(self, name, index=None, **kwargs) -> bool:
+        if name not in self.client.aliases:
+            return False
+        return index is None or any(concrete_index in self.client.aliases[name]
+                                    for concrete_index in self.client.resolve(index))
+
+    def get_alias(self, index=None, name=None, **kwargs):
+        indices = self.client.resolve(index) if index else list(self.client.docs.keys())
+        if name:
+            if name not in self.client.aliases:
+                raise NotFoundError(404, "aliases_not_found_exception", {"error": "alias [%s] missing" % name})
+            indices = [concrete_index for concrete_index in indices if concrete_index in self.client.aliases[name]]
+        response = {}
+        for concrete_index in indices:
+            aliases = {alias: dict(self.client.aliases[alias][concrete_index]) for alias in self.client.aliases
+                       if concrete_index in self.client.aliases[alias] and (name is None or alias == name)}
+            response[concrete_index] = {"aliases": aliases}
+        return response
+
+    def rollover(self, alias, new_index=None, body=None, dry_run=False, **kwargs):
+        old_index = self.client.resolve_write_index(alias)
+        conditions = body["conditions"] if body and "conditions" in body else {}
+        results = {}
+        if "max_docs" in conditions:
+            results["[max_docs: %s]" % conditions["max_docs"]] = \
+                len(self.client.docs[old_index]) >= conditions["max_docs"]
+        if "max_age" in conditions:
+            max_age = parse_range_value("now-%s" % conditions["max_age"])
+            results["[max_age: %s]" % conditions["max_age"]] = self.client.created_at[old_index] <= max_age
+        rolled_over = not conditions or any(results.values())
+        if new_index is None:
+            new_index = next_rollover_index_name(self.client.provided_names[old_index])
+        provided_name = new_index
+        new_index = resolve_date_math(new_index)
+        if rolled_over and not dry_run:
+            body = {"aliases": body.get("aliases", {})} if body else {}
+            self.create(provided_name, body=body)
+            with self.client.lock:
+                self.client.aliases[alias][old_index]["is_write_index"] = False
+                self.client.aliases[alias][new_index] = {"is_write_index": True}
+        return {"acknowledged": rolled_over, "shards_acknowledged": rolled_over, "old_index": old_index,
+                "new_index": new_index, "rolled_over": rolled_over and not dry_run, "dry_run": dry_run,
+                "conditions": results}
+
+
+class FakeElasticsearch(object):
+    """Keeps documents in memory per index and answers the client calls the stores make."""
+
+    def __init__(self):
+        self.docs: Dict[str, Dict[str, Dict]] = {}
+        self.aliases: Dict[str, Dict[str, Dict]] = {}
+        self.created_at: Dict[str, datetime.datetime] = {}
+        # the index names as given when the indices were created, before date math resolution
+        self.provided_names: Dict[str, str] = {}
+        self.scrolls: Dict[str, Tuple[List[Dict], int]] = {}
+        self.seq_no = itertools.count()
+        self.doc_counter = itertools.count()
+        self.lock = threading.RLock()
+        self.indices = FakeIndicesClient(self)
+        # the bulk helpers serialize actions with the serializer of the transport
+        self.transport = SimpleNamespace(serializer=JSONSerializer())
+
+    def create_index(self, index: str, provided_name: Union[None, str] = None) -> None:
+        self.docs[index] = {}
+        self.created_at[index] = datetime.datetime.now(pytz.utc)
+        self.provided_names[index] = provided_name if provided_name else index
+
+    def resolve(self, index: Union[None, str]) -> List[str]:
+        if index is None or index in ["_all", "*"]:
+            return list(self.docs.keys())
+        indices = []
+        for name in index.split(","):
+            if name in self.docs:
+                indices.append(name)
+            elif name in self.aliases:
+                indices += list(self.aliases[name].keys())
+            else:
+                raise NotFoundError(404, "index_not_found_exception", {"error": "no such index [%s]" % name})
+        return list(dict.fromkeys(indices))
+
+    def resolve_write_index(self, index: str) -> str:
+        if index in self.docs:
+            return index
+        if index in self.aliases:
+            indices = self.aliases[index]
+            write_indices = [name for name, properties in indices.items() if properties.get("is_write_index")]
+            if write_indices:
+                return write_indices[0]
+            if len(indices) == 1:
+                return list(indices.keys())[0]
+            raise RequestError(400, "illegal_argument_exception",
+                               {"error": "no write index is defined for alias [%s]" % index})
+        # like ES, writing to a missing index creates it
+        self.create_index(index)
+        return index
+
+    def find(self, index: str, doc_id: str):
+        for concrete_index in self.resolve(index):
+            if doc_id in self.docs[concrete_index]:
+                return concrete_index, self.docs[concrete_index][doc_id]
+        return None, None
+
+    def make_hit(self, concrete_index: str, doc_id: str, doc: Dict, source) -> Dict:
+        hit = {"_index": concrete_index, "_type": doc["_type"], "_id": doc_id, "_version": doc["_version"],
+               "_seq_no": doc["_seq_no"], "_primary_term": 1}
+        if source is not None:
+            hit["_source"] = source
+        return hit
+
+    def ping(self, **kwargs) -> bool:
+        return True
+
+    def info(self, **kwargs):
+        return {"name": "fake", "cluster_name": "fake", "version": {"number": "7.17.0"}}
+
+    def close(self) -> None:
+        return None
+
+    def exists(self, index, id, **kwargs) -> bool:
+        with self.lock:
+            return self.find(index, id)[1] is not None
+
+    def get(self, index, id, doc_type="_doc", _source=None, _source_includes=None, _source_excludes=None,
+            **kwargs):
+        with self.lock:
+            concrete_index, doc = self.find(index, id)
+            if doc is None:
+                raise NotFoundError(404, "not_found", {"_index": index, "_id": id, "found": False})
+            source = filter_source(doc["_source"], _source, _source_includes, _source_excludes)
+            hit = self.make_hit(concrete_index, id, doc, source)
+        hit["found"] = True
+        return hit
+
+    def mget(self, body, index=None, doc_type="_doc", _source=None, _source_includes=None, _source_excludes=None,
+             **kwargs):
+        ids = body["ids"] if "ids" in body else [doc["_id"] for doc in body["docs"]]
+        docs = []
+        with self.lock:
+            for doc_id in ids:
+                concrete_index, doc = self.find(index, doc_id)
+                if doc is None:
+                    docs.append({"_index": index, "_type": doc_type, "_id": doc_id, "found": False})
+                    continue
+                source = filter_source(doc["_source"], _source, _source_includes, _source_excludes)
+                hit = self.make_hit(concrete_index, doc_id, doc, source)
+                hit["found"] = True
+                docs.append(hit)
+        return {"docs": docs}
+
+    def index(self, index, body, id=None, doc_type="_doc", op_type="index", if_seq_no=None, if_primary_term=None,
+              **kwargs):
+        with self.lock:
+            concrete_index = self.resolve_write_index(index)
+            if id is None:
+                id = "fake-%d" % next(self.doc_counter)
+            existing = self.docs[concrete_index].get(id)
+            if existing is not None and op_type == "create":
+                raise ConflictError(409, "version_conflict_engine_exception",
+                                    {"error": "[%s]: version conflict, document already exists" % id})
+            if if_seq_no is not None and (existing is None or existing["_seq_no"] != if_seq_no):
+                raise ConflictError(409, "version_conflict_engine_exception",
+                                    {"error": "[%s]: version conflict, required seqNo [%s]" % (id, if_seq_no)})
+            doc = {"_type": doc_type, "_source": copy.deepcopy(body), "_seq_no": next(self.seq_no),
+                   "_version": existing["_version"] + 1 if existing else 1,
+                   "_doc": existing["_doc"] if existing else next(self.doc_counter)}
+            self.docs[concrete_index][id] = doc
+        return {"_index": concrete_index, "_type": doc_type, "_id": id, "_version": doc["_version"],
+                "result": "updated" if existing else "created", "_seq_no": doc["_seq_no"], "_primary_term": 1,
+                "_shards": make_shards()}
+
+    def update(self, index, id, body, doc_type="_doc", _source=None, _source_includes=None, _source_excludes=None,
+               retry_on_conflict=0, **kwargs):
+        # like ES, the updated source is returned if any of the source parameters is given
+        return_source = bool(_source or _source_includes or _source_excludes)
+        with self.lock:
+            concrete_index, existing = self.find(index, id)
+            if existing is None and "upsert" in body:
+                # the upsert document is indexed as is, without running the script
+                response = self.index(index, body["upsert"], id=id, doc_type=doc_type, op_type="create")
+                if return_source:
+                    response["get"] = {"found": True, "_seq_no": response["_seq_no"], "_primary_term": 1,
+                                       "_source": filter_source(body["upsert"], _source, _source_includes,
+                                                                _source_excludes)}
+                return response
+            if existing is None:
+                raise NotFoundError(404, "document_missing_exception", {"error": "[%s]: document missing" % id})
+            source = copy.deepcopy(existing["_source"])
+            if "script" in body:
+                script = body["script"]
+                if script["source"] not in script_functions:
+                    raise RequestError(400, "illegal_argument_exception", {"error": "unknown script"})
+                changed = script_functions[script["source"]](source, script.get("params", {}))
+            else:
+                changed = False
+                for field, value in body["doc"].items():
+                    if source.get(field) != value:
+                        source[field] = copy.deepcopy(value)
+                        changed = True
+            if changed:
+                existing = {"_type": existing["_type"], "_source": source, "_seq_no": next(self.seq_no),
+                            "_version": existing["_version"] + 1, "_doc": existing["_doc"]}
+                self.docs[concrete_index][id] = existing
+            response = {"_index": concrete_index, "_type": doc_type, "_id": id, "_version": existing["_version"],
+                        "result": "updated" if changed else "noop", "_seq_no": existing["_seq_no"],
+                        "_primary_term": 1, "_shards": make_shards()}
+            if return_source:
+                response["get"] = {"found": True, "_seq_no": existing["_seq_no"], "_primary_term": 1,
+                                   "_source": filter_source(existing["_source"], _source, _source_includes,
+                                                            _source_excludes)}
+        return response
+
+    def delete(self, index, id, doc_type="_doc", if_seq_no=None, if_primary_term=None, **kwargs):
+        with self.lock:
+            concrete_index, existing = self.find(index, id)
+            if existing is None:
+                raise NotFoundError(404, "not_found", {"_index": index, "_id": id, "result": "not_found"})
+            if if_seq_no is not None and existing["_seq_no"] != if_seq_no:
+                raise ConflictError(409, "version_conflict_engine_exception",
+                                    {"error": "[%s]: version conflict, required seqNo [%s]" % (id, if_seq_no)})
+            del self.docs[concrete_index][id]
+        return {"_index": concrete_index, "_type": doc_type, "_id": id, "_version": existing["_version"] + 1,
+                "result": "deleted", "_seq_no": next(self.seq_no), "_primary_term": 1, "_shards": make_shards()}
+
+    def bulk(self, body, index=None, doc_type="_doc", **kwargs):
+        start = time.perf_counter()
+        lines = body.splitlines() if isinstance(body, str) else body
+        lines = [json.loads(line) if isinstance(line, str) else line for line in lines if line]
+        items = []
+        errors = False
+        line_num = 0
+        while line_num < len(lines):
+            action, metadata = list(lines[line_num].items())[0]
+            line_num += 1
+            source = None
+            if action != "delete":
+                source = lines[line_num]
+                line_num += 1
+            target_index = metadata.get("_index", index)
+            try:
+                if action in ["create", "index"]:
+                    response = self.index(target_index, source, id=metadata.get("_id"),
+                                          doc_type=metadata.get("_type", doc_type), op_type=action)
+                elif action == "update":
+                    response = self.update(target_index, metadata["_id"], source,
+                                           doc_type=metadata.get("_type", doc_type))
+                else:
+                    response = self.delete(target_index, metadata["_id"], doc_type=metadata.get("_type", doc_type))
+                response["status"] = 201 if response["result"] == "created" else 200
+            except TransportError as error:
+                errors = True
+                response = {"_index": target_index, "_id": metadata.get("_id"), "status": error.status_code,
+                            "error": {"type": error.error, "reason": str(error.info)}}
+            items.append({action: response})
+        return {"took": int((time.perf_counter() - start) * 1000), "errors": errors, "items": items}
+
+    def matching_hits(self, index, query) -> List[Dict]:
+        hits = []
+        with self.lock:
+            for concrete_index in self.resolve(index):
+                for doc_id, doc in self.docs[concrete_index].items():
+                    if matches(query, doc_id, doc["_source"]):
+                        hit = self.make_hit(concrete_index, doc_id, doc, doc["_source"])
+                        hit["_score"] = score(query, doc["_source"])
+                        hit["_doc"] = doc["_doc"]
+                        hits.append(hit)
+        return hits
+
+    def search(self, index=None, body=None, scroll=None, size=None, from_=None, _source=None,
+               _source_includes=None, _source_excludes=None, **kwargs):
+        start = time.perf_counter()
+        # the scan helper passes the parts of the query as keyword arguments instead of a body
+        body = dict(body) if body else {}
+        for key in ["query", "sort", "search_after", "aggs", "aggregations", "highlight"]:
+            if key in kwargs:
+                body[key] = kwargs[key]
+        if size is not None:
+            body["size"] = size
+        if from_ is not None:
+            body["from"] = from_
+        if _source is not None:
+            body["_source"] = _source
+        hits = self.matching_hits(index, body.get("query"))
+        sort_spec = parse_sort(body.get("sort"))
+        if sort_spec:
+            sort_key = make_sort_key(sort_spec)
+            for hit in hits:
+                hit["sort"] = sort_key(hit)
+            hits.sort(key=functools.cmp_to_key(lambda hit1, hit2: compare_sort_values(sort_spec, hit1["sort"],
+                                                                                       hit2["sort"])))
+            if "search_after" in body:
+                hits = [hit for hit in hits if compare_sort_values(sort_spec, hit["sort"], body["search_after"]) > 0]
+        elif body.get("query"):
+            hits.sort(key=lambda hit: -hit["_score"])
+        response = {"timed_out": False, "_shards": make_shards(),
+                    "hits": {"total": {"value": len(hits), "relation": "eq"},
+                             "max_score": max([hit["_score"] for hit in hits], default=None)}}
+        aggregations = body.get("aggs", body.get("aggregations"))
+        if aggregations:
+            response["aggregations"] = aggregate(aggregations, hits)
+        for hit in hits:
+            hit.pop("_doc")
+            hit["_source"] = filter_source(hit["_source"], body.get("_source"), _source_includes, _source_excludes)
+            if hit["_source"] is None:
+                del hit["_source"]
+            if sort_spec and "_score" not in [field for field, _ in sort_spec]:
+                hit["_score"] = None
+        page_size = body.get("size", 10)
+        if scroll:
+            scroll_id = "scroll-%d" % next(self.doc_counter)
+            self.scrolls[scroll_id] = (hits[page_size:], page_size)
+            response["_scroll_id"] = scroll_id
+            hits = hits[:page_size]
+        else:
+            offset = body.get("from", 0)
+            hits = hits[offset:offset + page_size]
+        response["hits"]["hits"] = hits
+        response["took"] = int((time.perf_counter() - start) * 1000)
+        return response
+
+    def scroll(self, scroll_id=None, body=None, **kwargs):
+        if scroll_id is None:
+            scroll_id = body["scroll_id"]
+        if scroll_id not in self.scrolls:
+            raise NotFoundError(404, "search_context_missing_exception", {"error": "No search context found"})
+        remaining_hits, page_size = self.scrolls[scroll_id]
+        hits = remaining_hits[:page_size]
+        self.scrolls[scroll_id] = (remaining_hits[page_size:], page_size)
+        return {"_scroll_id": scroll_id, "took": 0, "timed_out": False, "_shards": make_shards(),
+                "hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": hits}}
+
+    def clear_scroll(self, scroll_id=None, body=None, **kwargs):
+        scroll_ids = as_list(scroll_id if scroll_id is not None else body["scroll_id"])
+        for scroll_id in scroll_ids:
+            self.scrolls.pop(scroll_id, None)
+        return {"succeeded": True, "num_freed": len(scroll_ids)}
+
+    def count(self, index=None, body=None, **kwargs):
+        query = body.get("query") if body else kwargs.get("query")
+        return {"count": len(self.matching_hits(index, query)), "_shards": make_shards()}
+
+    def delete_by_query(self, index, body, **kwargs):
+        start = time.perf_counter()
+        hits = self.matching_hits(index, body.get("query"))
+        with self.lock:
+            for hit in hits:
+                self.docs[hit["_index"]].pop(hit["_id"], None)
+        return {"took": int((time.perf_counter() - start) * 1000), "timed_out": False, "total": len(hits),
+                "deleted": len(hits), "version_conflicts": 0, "failures": []}
+
+
+class AsyncFakeElasticsearch(object):
+    """Stands in for AsyncElasticsearch with the documents of a FakeElasticsearch, so the sync and
+    async stores can work on the same documents. Every call yields to the event loop once before
+    it is answered, like a request that waits on the network."""
+
+    def __init__(self, client=None):
+        self.client = client if client is not None else FakeElasticsearch()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name == "indices":
+            return AsyncFakeElasticsearch(attribute)
+        if not callable(attribute) or name.startswith("_"):
+            return attribute
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(0)
+            return attribute(*args, **kwargs)
+
+        return call
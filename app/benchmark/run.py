@@ -0,0 +1,238 @@
+"""Benchmark of the annotation store hot paths on a synthetic corpus. Reports throughput, p50 and
+p99 latency and the number of ES calls of create, get, list-by-target, update-with-cascade,
+collection paging and IIIF export. Run it from the app directory:
+
+    python -m benchmark.run --size 5000 --chain-depth 3 --output results.json
+    python -m benchmark.run --size 5000 --chain-depth 3 --baseline results.json
+
+By default the store runs against an in-process fake of the ES client, which measures the
+overhead of the store itself. With --es, it runs against the ES in the settings, using a new
+index that is deleted afterwards. With --baseline, it exits with status 1 on regressions.
+"""
+import argparse
+import copy
+import json
+import math
+import random
+import sys
+import time
+from typing import Callable, Dict, List
+from elasticsearch import Elasticsearch
+from models.annotation_store import AnnotationStore
+from models.annotation_container import LazyAnnotationContainer
+import models.iiif_manifest as iiif_manifest
+import models.instrumentation as instrumentation
+from benchmark.fake_es import FakeElasticsearch
+import benchmark.corpus as corpus
+from settings import server_config
+
+operations = ["create", "get", "list_by_target", "update_cascade", "collection_paging", "iiif_export"]
+
+all_access = ["private", "shared", "public"]
+
+
+def percentile(latencies: List[float], pct: float) -> float:
+    ordered = sorted(latencies)
+    return ordered[max(0, int(math.ceil(pct / 100 * len(ordered))) - 1)]
+
+
+class OperationStats(object):
+    """Latencies and number of ES calls of the runs of a single operation."""
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.latencies: List[float] = []
+        self.es_calls = 0
+
+    def measure(self, function: Callable, *args):
+        token = instrumentation.current_timings.set(instrumentation.RequestTimings())
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+            self.es_calls += instrumentation.current_timings.get().es_calls
+            instrumentation.current_timings.reset(token)
+
+    def summary(self) -> Dict[str, float]:
+        if not self.latencies:
+            return {"count": 0}
+        return {
+            "count": len(self.latencies),
+            "throughput": len(self.latencies) / sum(self.latencies),
+            "p50_ms": percentile(self.latencies, 50) * 1000,
+            "p99_ms": percentile(self.latencies, 99) * 1000,
+            "es_calls": self.es_calls / len(self.latencies)
+        }
+
+
+def make_store(use_es: bool) -> AnnotationStore:
+    es_config = copy.deepcopy(server_config["Elasticsearch"])
+    es_config["annotation_index"] = "swa_benchmark_%d" % int(time.time())
+    es_config["rollover"] = False
+    if use_es:
+        es = Elasticsearch([{"host": es_config['host'], "port": es_config['port']}])
+    else:
+        es = FakeElasticsearch()
+    return AnnotationStore(es_config, es=instrumentation.InstrumentedElasticsearch(es))
+
+
+def fetch_page_callback(store: AnnotationStore, annotation_ids: List[str], params: Dict):
+    # same as the page fetcher of the collection API
+    def fetch_page(page_num, page_size):
+        page_ids = annotation_ids[page_num * page_size: (page_num + 1) * page_size]
+        return store.get_annotations_by_id_es(page_ids, params)
+    return fetch_page
+
+
+def export_manifests(store: AnnotationStore, resource_id: str):
+    # same as the IIIF exchange API, for all annotations of a resource
+    annotations = store.get_from_index_by_target({"id": resource_id})
+    for annotation in annotations:
+        annotation.pop("target_list", None)
+        annotation.pop("permissions", None)
+    manifests = iiif_manifest.web_anno_to_manifest(annotations)
+    if isinstance(manifests, iiif_manifest.Manifest):
+        return manifests.to_json()
+    return [manifest.to_json() for manifest in manifests]
+
+
+def run_benchmark(store: AnnotationStore, items: List[Dict], iterations: int, collection_size: int,
+                  page_size: int, seed: int) -> Dict[str, OperationStats]:
+    rng = random.Random(seed)
+    stats = {operation: OperationStats(operation) for operation in operations}
+    # create the corpus, targets before the annotations that target them
+    for item in items:
+        stats["create"].measure(store.add_annotation_es, copy.deepcopy(item["annotation"]),
+                                copy.deepcopy(item["params"]))
+    resources = sorted(set(resource_id for item in items for resource_id in item["resource_ids"]))
+    chained_ids = set(target["id"] for item in items for target in item["annotation"]["target"]
+                      if target["type"] == "Annotation")
+    chain_roots = [item for item in items if item["annotation"]["id"] in chained_ids and item["depth"] == 0]
+
+    for _ in range(iterations):
+        item = rng.choice(items)
+        params = {"username": item["params"]["username"], "action": "see"}
+        stats["get"].measure(store.get_annotation_es, item["annotation"]["id"], params)
+
+    for _ in range(iterations):
+        params = {"page": 0, "page_size": page_size, "cursor": None, "view": "PreferContainedDescriptions",
+                  "username": rng.choice(items)["params"]["username"], "access_status": all_access,
+                  "filter": {"target_id": [rng.choice(resources)]}}
+        stats["list_by_target"].measure(store.get_annotations_es, params)
+
+    for _ in range(iterations if chain_roots else 0):
+        item = rng.choice(chain_roots)
+        updated_annotation = copy.deepcopy(item["annotation"])
+        updated_annotation["target"] = [corpus.make_resource_target(rng.choice(resources))]
+        params = {"username": item["params"]["username"], "access_status": item["params"]["access_status"]}
+        stats["update_cascade"].measure(store.update_annotation_es, updated_annotation, params)
+
+    # a collection with annotations that its owner can see
+    owner = items[0]["params"]["username"]
+    collection_ids = [item["annotation"]["id"] for item in items
+                      if item["params"]["username"] == owner or "public" in item["params"]["access_status"]]
+    collection_ids = collection_ids[:collection_size]
+    owner_params = {"username": owner, "access_status": ["private"]}
+    collection = store.create_collection_es({"type": "AnnotationCollection", "label": "Benchmark collection",
+                                             "creator": owner}, copy.deepcopy(owner_params))
+    store.update_collection_items_es(collection["id"], collection_ids, [], copy.deepcopy(owner_params))
+    num_pages = int(math.ceil(len(collection_ids) / page_size))
+
+    def view_collection_page(page_num):
+        params = {"username": owner, "view": "PreferContainedDescriptions", "page_size": page_size}
+        collection_json = store.get_collection_es(collection["id"], params)
+        container = LazyAnnotationContainer("http://localhost/collections/", len(collection_json["items"]),
+                                            fetch_page_callback(store, collection_json["items"], params),
+                                            page_size=page_size, view=params["view"], collection=collection_json)
+        return container.view_page(page_num)
+
+    for _ in range(iterations if num_pages else 0):
+        stats["collection_paging"].measure(view_collection_page, rng.randrange(num_pages))
+
+    for _ in range(iterations):
+        stats["iiif_export"].measure(export_manifests, store, rng.choice(resources))
+    return stats
+
+
+def print_results(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]] = None):
+    print("{o:<20}{c:>8}{t:>12}{p50:>10}{p99:>10}{e:>10}".format(o="operation", c="count", t="ops/s",
+                                                                 p50="p50 ms", p99="p99 ms", e="es/op"))
+    for operation in operations:
+        result = results[operation]
+        if result["count"] == 0:
+            print("{o:<20}{c:>8}".format(o=operation, c=0))
+            continue
+        line = "{o:<20}{c:>8}{t:>12.1f}{p50:>10.2f}{p99:>10.2f}{e:>10.1f}".format(
+            o=operation, c=result["count"], t=result["throughput"], p50=result["p50_ms"], p99=result["p99_ms"],
+            e=result["es_calls"])
+        if baseline and operation in baseline and baseline[operation]["count"] > 0:
+            line += "  p50 {d:+.0%}".format(d=result["p50_ms"] / baseline[operation]["p50_ms"] - 1)
+        print(line)
+
+
+def find_regressions(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+                     tolerance: float) -> List[str]:
+    regressions = []
+    for operation, result in results.items():
+        if operation not in baseline or baseline[operation]["count"] == 0 or result["count"] == 0:
+            continue
+        for measure in ["p50_ms", "p99_ms"]:
+            if result[measure] > baseline[operation][measure] * (1 + tolerance):
+                regressions.append("{o} {m}".format(o=operation, m=measure))
+        if result["es_calls"] > baseline[operation]["es_calls"] * (1 + tolerance):
+            regressions.append("{o} es_calls".format(o=operation))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the annotation store on a synthetic corpus")
+    parser.add_argument("--size", type=int, default=1000, help="number of annotations in the corpus")
+    parser.add_argument("--chain-depth", type=int, default=2, help="maximum length of annotation chains")
+    parser.add_argument("--fan-out", type=int, default=1, help="number of resource targets per annotation")
+    parser.add_argument("--target-mix", default="resource:0.4,subresource:0.3,nestedpid:0.3",
+                        help="weights of the target shapes")
+    parser.add_argument("--permission-mix", default="private:0.5,shared:0.2,public:0.3",
+                        help="weights of the access statuses")
+    parser.add_argument("--share-size", type=int, default=3, help="number of users a shared annotation is shared with")
+    parser.add_argument("--iterations", type=int, default=200, help="runs of each operation after creation")
+    parser.add_argument("--collection-size", type=int, default=1000, help="number of annotations in the collection")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--es", action="store_true", help="run against the ES in the settings instead of the fake")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare with the JSON results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative increase in latency that counts as a regression")
+    args = parser.parse_args(argv)
+
+    items = list(corpus.generate_annotations(args.size, seed=args.seed, chain_depth=args.chain_depth,
+                                             fan_out=args.fan_out,
+                                             target_mix=corpus.parse_target_mix(args.target_mix),
+                                             permission_mix=corpus.parse_permission_mix(args.permission_mix),
+                                             share_size=args.share_size))
+    store = make_store(args.es)
+    try:
+        stats = run_benchmark(store, items, args.iterations, args.collection_size, args.page_size, args.seed)
+    finally:
+        if args.es:
+            store.es.indices.delete(index=store.es_index)
+    results = {operation: operation_stats.summary() for operation, operation_stats in stats.items()}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "rt") as fh:
+            baseline = json.load(fh)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "wt") as fh:
+            json.dump(results, fh, indent=2)
+    if baseline:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        if regressions:
+            print("regressions: {r}".format(r=", ".join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
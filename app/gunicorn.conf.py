@@ -0,0 +1,12 @@
+import multiprocessing
+
+bind = "0.0.0.0:8080"
+workers = multiprocessing.cpu_count() * 2 + 1
+threads = 2
+# load the app once in the master, workers get their own ES client in post_fork
+preload_app = True
+
+
+def post_fork(server, worker):
+    import wsgi
+    wsgi.post_fork()
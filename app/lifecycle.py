@@ -0,0 +1,22 @@
+"""Index lifecycle job for the annotation indices. Rolls over the project indices that meet the
+rollover conditions and purges tombstones older than the retention period. Run it periodically,
+e.g. daily from cron:
+
+    python lifecycle.py
+"""
+from models.annotation_store import AnnotationStore
+from settings import server_config
+
+
+def run_lifecycle(annotation_store: AnnotationStore):
+    rolled_over = annotation_store.rollover_indices() if annotation_store.rollover else {}
+    purged = annotation_store.purge_tombstones()
+    return {"rolled_over": rolled_over, "purged_tombstones": purged}
+
+
+if __name__ == "__main__":
+    store = AnnotationStore(server_config["Elasticsearch"])
+    result = run_lifecycle(store)
+    for index, rolled_over in result["rolled_over"].items():
+        print("index {i} rolled over: {r}".format(i=index, r=rolled_over))
+    print("purged tombstones: {p}".format(p=result["purged_tombstones"]))
@@ -5,6 +5,7 @@ import uuid
 import copy
 from rfc3987 import parse as parse_iri
 from typing import List, Union
+import models.permissions as permissions
 
 
 def validate_generic(annotation: dict) -> None:
@@ -125,6 +126,7 @@ class Annotation(object):
         self.motivation = annotation['motivation'] if 'motivation' in annotation else None
         self.in_collection = []
         self.permissions = None
+        self.permission_sets = None
         self.target_list = None
         self.set_permissions()
         self.set_target_list()
@@ -135,6 +137,7 @@ class Annotation(object):
             del self.data["permissions"]
         else:
             self.permissions = None
+        permissions.set_permission_sets(self)
 
     def set_target_list(self) -> None:
         if "target_list" in self.data:
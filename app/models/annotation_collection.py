@@ -3,6 +3,7 @@ import datetime
 import pytz
 import copy
 from models.annotation import AnnotationError
+import models.permissions as permissions
 
 
 class AnnotationCollection(object):
@@ -12,6 +13,7 @@ class AnnotationCollection(object):
         self.label = data["label"]
         self.type = "AnnotationCollection"
         self.permissions = None
+        self.permission_sets = None
         if 'id' in data:
             self.id = data['id']
         else:
@@ -32,6 +34,7 @@ class AnnotationCollection(object):
 
     def set_permissions(self, data):
         self.permissions = data["permissions"] if "permissions" in data else None
+        permissions.set_permission_sets(self)
 
     def get_permissions(self):
         return self.permissions
@@ -2,7 +2,7 @@ from urllib import parse as url_parser
 import math
 import copy
 import json
-from typing import List, Union
+from typing import Callable, List, Union
 from rfc3987 import parse as parse_iri
 
 from models.annotation import Annotation, AnnotationError
@@ -11,6 +11,9 @@ from settings import server_config
 
 api_url = server_config['SWAServer']['url'] + server_config['SWAServer']['api_prefix']
 
+# the number of items per container page if the request doesn't ask for a page size
+default_page_size = 100
+
 
 def is_annotation_list(annotations):
     if not isinstance(annotations, list):
@@ -62,7 +65,8 @@ def update_url(base_url, params):
 
 class AnnotationContainer(object):
 
-    def __init__(self, base_url: str, data, page_size=100, view="PreferMinimalContainer", total=None):
+    def __init__(self, base_url: str, data, page_size=default_page_size, view="PreferMinimalContainer", total=None,
+                 link_params: Union[None, dict] = None):
         self.base_url = base_url
         self.context = ["http://www.w3.org/ns/ldp.jsonld", "http://www.w3.org/ns/anno.jsonld"]
         self.metadata = {}
@@ -72,12 +76,25 @@ class AnnotationContainer(object):
         self.modified = None
         self.items = None
         self.page_size = 0
+        # extra parameters (e.g. filters and page_size) that are repeated in all page links
+        self.link_params = link_params if link_params else {}
         self.set_view(view)
         self.set_page_size(page_size)
         self.set_container_content(data, total)
         if self.metadata["total"] > 0:
-            self.first = update_url(self.base_url, {"iris": self.iris, "page": 0})
-            self.last = update_url(self.base_url, {"iris": self.iris, "page": self.num_pages - 1})
+            self.first = self.page_url(0)
+            self.last = self.page_url(self.num_pages - 1)
+
+    def container_url(self):
+        return update_url(self.base_url, dict(self.link_params, iris=self.iris))
+
+    def page_url(self, page_num=None, cursor=None):
+        url_params = dict(self.link_params, iris=self.iris)
+        if cursor is not None:
+            url_params["cursor"] = cursor
+        else:
+            url_params["page"] = page_num
+        return update_url(self.base_url, url_params)
 
     def generate_metadata_from_collection(self, collection):
         self.metadata = {
@@ -98,7 +115,7 @@ class AnnotationContainer(object):
             total = len(annotations)
         self.metadata = {
             "@context": self.context,
-            "id": update_url(self.base_url, {"iris": self.iris}),
+            "id": self.container_url(),
             "total": total,
             "type": ["BasicContainer", "AnnotationContainer"]
         }
@@ -129,7 +146,7 @@ class AnnotationContainer(object):
     def view_contained_iris(self):
         if self.metadata["total"] > 0:
             self.metadata["first"] = {
-                "id": update_url(self.base_url, {"iris": self.iris, "page": 0}),
+                "id": self.page_url(0),
                 "type": "AnnotationPage",
                 "items": self.add_page_items(0)
             }
@@ -140,7 +157,7 @@ class AnnotationContainer(object):
     def view_contained_descriptions(self):
         if self.metadata["total"] > 0:
             self.metadata["first"] = {
-                "id": update_url(self.base_url, {"iris": self.iris, "page": 0}),
+                "id": self.page_url(0),
                 "type": "AnnotationPage",
                 "items": self.add_page_items(0)
             }
@@ -156,7 +173,7 @@ class AnnotationContainer(object):
     def generate_page_metadata(self, page_num):
         page_metadata = {
             "@context": "http://www.w3.org/ns/anno.jsonld",
-            "id": update_url(self.base_url, {"iris": self.iris, "page": page_num}),
+            "id": self.page_url(page_num),
             "type": "AnnotationPage",
             "partOf": self.add_collection_ref(),
             "startIndex": self.page_size * page_num,
@@ -165,11 +182,25 @@ class AnnotationContainer(object):
         self.add_page_refs(page_metadata, page_num)
         return page_metadata
 
+    def view_cursor_page(self, cursor: str, items: list, next_cursor: Union[None, str] = None):
+        """Generate the page of items that follow a search cursor. Cursor pages have no page number,
+        so instead of prev and next page numbers, the next page link refers to the next cursor."""
+        page_metadata = {
+            "@context": "http://www.w3.org/ns/anno.jsonld",
+            "id": self.page_url(cursor=cursor),
+            "type": "AnnotationPage",
+            "partOf": self.add_collection_ref(),
+            "items": self.format_page_items(self.make_json(items))
+        }
+        if next_cursor:
+            page_metadata["next"] = self.page_url(cursor=next_cursor)
+        return page_metadata
+
     def add_page_refs(self, page_metadata, page_num):
         if page_num > 0:
-            page_metadata["prev"] = update_url(self.base_url, {"iris": self.iris, "page": page_num-1})
+            page_metadata["prev"] = self.page_url(page_num - 1)
         if page_num < self.num_pages - 1:
-            page_metadata["next"] = update_url(self.base_url, {"iris": self.iris, "page": page_num+1})
+            page_metadata["next"] = self.page_url(page_num + 1)
 
     def add_collection_ref(self):
         part_of = {
@@ -180,10 +211,17 @@ class AnnotationContainer(object):
             part_of["modified"] = self.metadata['modified']
         return part_of
 
-    def add_page_items(self, page_num):
+    def get_page_items(self, page_num):
         start_index = self.page_size * page_num
-        items = self.items[start_index: start_index + self.page_size]
-        if len(items) > 0 and isinstance(items[0], str):
+        return self.items[start_index: start_index + self.page_size]
+
+    def add_page_items(self, page_num):
+        return self.format_page_items(self.get_page_items(page_num))
+
+    def format_page_items(self, items):
+        if len(items) == 0:
+            return []
+        if isinstance(items[0], str):
             items = [api_url + '/annotations/' + item for item in items]
         else:
             for item in items:
@@ -225,6 +263,44 @@ class AnnotationContainer(object):
             raise AnnotationError(message="data should be an AnnotationCollection or a list of Annotations")
 
 
+class LazyAnnotationContainer(AnnotationContainer):
+    """An AnnotationContainer that only knows the total number of items up front and
+    fetches the items of a page through a callback when that page is rendered.
+
+    The callback is called as fetch_page(page_num, page_size) and should return the
+    list of annotations (or annotation ids) for that page."""
+
+    def __init__(self, base_url: str, total: int, fetch_page: Callable[[int, int], list],
+                 page_size=default_page_size, view="PreferMinimalContainer", collection: Union[None, dict] = None,
+                 link_params: Union[None, dict] = None):
+        if type(total) != int or total < 0:
+            raise AnnotationError(message='total must be a non-negative integer value')
+        self.fetch_page = fetch_page
+        self.total = total
+        self.collection = collection
+        super().__init__(base_url, None, page_size=page_size, view=view, total=total, link_params=link_params)
+
+    def set_container_content(self, data, total):
+        if self.collection is not None:
+            collection = copy.copy(self.collection)
+            collection["total"] = total
+            self.generate_metadata_from_collection(collection)
+        else:
+            self.metadata = {
+                "@context": self.context,
+                "id": self.container_url(),
+                "total": total,
+                "type": ["BasicContainer", "AnnotationContainer"]
+            }
+            self.num_pages = int(math.ceil(total / self.page_size))
+
+    def get_page_items(self, page_num):
+        if page_num >= self.num_pages:
+            return []
+        items = self.fetch_page(page_num, self.page_size)
+        return [item if isinstance(item, str) else self.make_json(item) for item in items]
+
+
 class AnnotationPage(object):
 
     def __init__(self, page_id: str, items: Union[None, List[Union[Annotation, dict]]] = None):
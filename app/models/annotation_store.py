@@ -1,12 +1,27 @@
 from typing import Dict, Union
 import copy
+import datetime
 import json
+import threading
+import pytz
+from types import SimpleNamespace
 from models.annotation import Annotation, AnnotationError
 from models.annotation_collection import AnnotationCollection
 from models.error import PermissionError
+from models.es_mapping import annotation_index
 import models.queries as query_helper
+import models.es_scripts as es_scripts
 import models.permissions as permissions
+import models.instrumentation as instrumentation
+import models.tenant as tenant
+from models.tombstones import TombstoneRegistry
+from models.bloom_filter import KnownIdFilter
+from models.target_counts import TargetCounts
+from models.change_feed import ChangeFeed
+from models.slow_query_log import make_slow_query_log, request_params
 from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ConflictError, NotFoundError, RequestError
+from elasticsearch.helpers import bulk
 
 
 # from elasticsearch.exceptions import NotFoundError
@@ -57,29 +72,256 @@ def get_objects_from_hits(hits):
             objects += [AnnotationCollection(hit["_source"])]
 
 
+def get_hits_total(response):
+    if isinstance(response['hits']['total'], dict):
+        # For Elasticsearch version 6 and higher
+        return response['hits']['total']['value']
+    else:
+        # For Elasticsearch version 5 and lower
+        return response['hits']['total']
+
+
+def get_next_cursor(response, params):
+    # a full page means there may be more hits after the last one
+    hits = response["hits"]["hits"]
+    if not hits or "page_size" not in params or len(hits) < params["page_size"] or "sort" not in hits[-1]:
+        return None
+    return query_helper.encode_cursor(hits[-1]["sort"])
+
+
+def is_tombstone(annotation):
+    return "status" in annotation and annotation["status"] == "deleted"
+
+
+def make_tombstone(annotation_id, annotation_type):
+    # the deletion timestamp is used to purge tombstones after the retention period
+    return {
+        "id": annotation_id,
+        "type": annotation_type,
+        "status": "deleted",
+        "deleted": make_timestamp()
+    }
+
+
+def is_allowed_action(username, action, annotation, groups=None):
+    with instrumentation.timed("permissions"):
+        return permissions.is_allowed_action(username, action, annotation, groups=groups)
+
+
+def make_timestamp():
+    return datetime.datetime.now(pytz.utc).isoformat()
+
+
+def check_allowed(username, action, annotation, groups=None):
+    if not is_allowed_action(username, action, annotation, groups=groups):
+        raise PermissionError(message="Unauthorized access - no permission to {a} annotation".format(a=action))
+
+
+def check_document_exists(document, annotation_id):
+    if document is None or is_tombstone(document["_source"]):
+        raise AnnotationError(message="Annotation with id %s does not exist" % annotation_id, status_code=404)
+    return document
+
+
+def check_script_update(document, response):
+    if is_tombstone(response["get"]["_source"]):
+        # deleted after it was read
+        raise AnnotationError(message="Annotation with id %s does not exist" % document["_id"], status_code=404)
+
+
+def make_annotation(document):
+    # a copy, as the annotation takes the permissions and target list out of its json, while the
+    # document should keep the stored version
+    annotation_json = dict(document["_source"])
+    if annotation_json["type"] == "Annotation":
+        return Annotation(annotation_json)
+    return AnnotationCollection(annotation_json)
+
+
+def with_type_field(source_includes):
+    # the type is needed to check the type of the document
+    if source_includes and "type" not in source_includes:
+        return source_includes + ["type"]
+    return source_includes
+
+
+def make_document_query(annotation_id, source_includes=None):
+    # the read alias of rolled over indices spans several backing indices, which a get request
+    # can't address, so a document is searched by id instead
+    query = {"query": query_helper.make_ids_query([annotation_id]), "size": 1, "seq_no_primary_term": True}
+    if source_includes:
+        query["_source"] = {"includes": source_includes}
+    return query
+
+
+def get_document_from_hits(hits, annotation_type):
+    if not hits or annotation_type not in ["_all", hits[0]["_source"]["type"]]:
+        return None
+    return hits[0]
+
+
+def make_items_script(document, add_ids, remove_ids, params):
+    """Return the script that adds and removes items of the collection document. The user changing
+    the items is added to the permissions of the collection."""
+    collection_permissions = SimpleNamespace(permissions=document["_source"]["permissions"])
+    permissions.add_permissions(collection_permissions, params)
+    return es_scripts.make_update_items_script(add_ids, remove_ids, modified=make_timestamp(),
+                                               permissions=collection_permissions.permissions)
+
+
+def make_update_source_params(source_excludes=None):
+    # an update only returns the updated source if it is asked for
+    if source_excludes:
+        return {"_source_excludes": source_excludes}
+    return {"_source": True}
+
+
+def make_collection_metadata(source, params):
+    """Return the metadata of a collection from a source without its items, with the total that
+    the item scripts maintain (see es_scripts.py)."""
+    collection = {"@context": "http://www.w3.org/ns/anno.jsonld"}
+    for field in ["id", "type", "label", "creator", "created", "total", "modified"]:
+        if field in source:
+            collection[field] = source[field]
+    if params and "include_permissions" in params and params["include_permissions"]:
+        collection["permissions"] = copy.copy(source["permissions"])
+    return collection
+
+
+def make_change_feed(es, es_config) -> Union[None, ChangeFeed]:
+    if "change_feed" in es_config and not es_config["change_feed"]:
+        return None
+    return ChangeFeed(es, gap_timeout=es_config["change_feed_gap_timeout"]
+                      if "change_feed_gap_timeout" in es_config else 5,
+                      max_waiting=es_config["change_feed_max_waiting"]
+                      if "change_feed_max_waiting" in es_config else 1)
+
+
+def write_alias_name(index):
+    return index + "-write"
+
+
+def backing_index_name(index, generation):
+    # date math name, which ES resolves to e.g. swa-2020.07.01-000001
+    return "<%s-{now/d}-%06d>" % (index, generation)
+
+
 class AnnotationStore(object):
 
-    def __init__(self, es_config):
-        self.es_config = es_config
-        self.es_index = es_config['annotation_index']
-        self.es = Elasticsearch([{"host": es_config['host'], "port": es_config['port']}])
-        if not self.es.indices.exists(index=self.es_index):
-            self.es.indices.create(index=self.es_index)
-        self.needs_refresh = False
+    def __init__(self, es_config, es: Union[None, Elasticsearch] = None, bootstrap: bool = True):
+        self.index_lock = threading.Lock()
+        self.configure(es_config, es=es, bootstrap=bootstrap)
 
-    def configure(self, es_config: Dict[str, Union[str, int]]):
+    def configure(self, es_config: Dict[str, Union[str, int]], es: Union[None, Elasticsearch] = None,
+                  bootstrap: bool = True):
         self.es_config = es_config
         self.es_index = es_config['annotation_index']
-        self.es = Elasticsearch([{"host": es_config['host'], "port": es_config['port']}])
-        if not self.es.indices.exists(index=self.es_index):
-            self.es.indices.create(index=self.es_index)
+        self.es = es if es else Elasticsearch([{"host": es_config['host'], "port": es_config['port']}])
+        # with a slow query threshold in the settings, slow ES calls are logged by a hook of the
+        # instrumented client
+        self.slow_queries = make_slow_query_log(es_config)
+        if self.slow_queries and isinstance(self.es, instrumentation.InstrumentedElasticsearch):
+            self.es = self.es.with_hook(self.slow_queries.record)
+        elif self.slow_queries:
+            self.es = instrumentation.InstrumentedElasticsearch(self.es, hooks=[self.slow_queries.record])
+        self.rollover = es_config["rollover"] if "rollover" in es_config else False
+        # the projects that can have an index, None allows any valid project name
+        self.projects = set(es_config["projects"]) if es_config.get("projects") is not None else None
+        self.tombstones = TombstoneRegistry(self.es, refresh_interval=es_config["tombstone_refresh_interval"]
+                                            if "tombstone_refresh_interval" in es_config else 60)
+        # without rollover, a create request conflicts on any existing id, so a filter that misses ids
+        # created by other workers is harmless. With rollover, a create request can't see ids in older
+        # backing indices, so the filter is not used and existence is always checked in ES.
+        self.known_ids = KnownIdFilter(self.es, capacity=es_config["id_filter_capacity"]
+                                       if "id_filter_capacity" in es_config else 1000000)
+        # every write is recorded in the change feed, unless it is disabled in the settings
+        self.changes = make_change_feed(self.es, es_config)
+        self.target_counts = TargetCounts(self.es, changes=self.changes,
+                                          refresh_interval=es_config["target_count_refresh_interval"]
+                                          if "target_count_refresh_interval" in es_config else 5,
+                                          reload_interval=es_config["target_count_reload_interval"]
+                                          if "target_count_reload_interval" in es_config else 300,
+                                          rollover=self.rollover)
+        self.ready_indices = set()
+        if bootstrap:
+            self.ensure_index()
         self.needs_refresh = False
 
+    @property
+    def index_ready(self) -> bool:
+        return self.es_index in self.ready_indices
+
+    def ensure_index(self, index: Union[None, str] = None, create: bool = True) -> bool:
+        """Create the annotation index (by default the index without project) if it doesn't exist,
+        or only check that it exists if create is False. Returns whether the index exists. Once an
+        index is known to exist, this no longer calls ES until the store is reconfigured."""
+        if index is None:
+            index = self.es_index
+        if index in self.ready_indices:
+            return True
+        with self.index_lock:
+            if index in self.ready_indices:
+                return True
+            if not self.es.indices.exists(index=index):
+                if not create:
+                    return False
+                try:
+                    self.create_index(index)
+                except RequestError as error:
+                    # another worker process created the index in the meantime
+                    if error.error != "resource_already_exists_exception":
+                        raise
+            else:
+                # indices created before project routing are not part of the alias yet
+                self.es.indices.put_alias(index=index, name=tenant.all_projects_alias(self.es_index))
+            self.ready_indices.add(index)
+        # the tombstones and known ids are loaded with the index, so the first request that checks
+        # an id doesn't wait for a scan of the index
+        self.tombstones.load(index)
+        if not self.rollover:
+            self.known_ids.load(index)
+        return True
+
+    def create_index(self, index):
+        body = copy.deepcopy(annotation_index)
+        body["aliases"] = {tenant.all_projects_alias(self.es_index): {}}
+        if not self.rollover:
+            return self.es.indices.create(index=index, body=body, include_type_name=True)
+        # with rollover, the index name is the read alias of dated backing indices and
+        # new annotations are written through the write alias to the newest backing index
+        body["aliases"][index] = {}
+        body["aliases"][write_alias_name(index)] = {"is_write_index": True}
+        return self.es.indices.create(index=backing_index_name(index, 1), body=body, include_type_name=True)
+
+    def tenant_index(self, project: Union[None, str] = None, create: bool = False) -> str:
+        """Return the index of the given project, or of the project of the current request. The index
+        of a project is only created by writes, reading from a project without index is an error, so
+        requests for arbitrary project names don't create indices."""
+        if project is None:
+            project = tenant.get_project()
+        index = tenant.project_index_name(self.es_index, project)
+        if project is not None and self.projects is not None and project not in self.projects:
+            raise AnnotationError(message="Project %s does not exist" % project, status_code=404)
+        if not self.ensure_index(index, create=create or project is None):
+            raise AnnotationError(message="Project %s does not exist" % project, status_code=404)
+        return index
+
+    def write_index(self) -> str:
+        index = self.tenant_index(create=True)
+        return write_alias_name(index) if self.rollover else index
+
+    def read_index(self, params) -> str:
+        # reading across projects is only done when explicitly requested
+        if params and params.get("all_projects"):
+            self.ensure_index()
+            return tenant.all_projects_alias(self.es_index)
+        return self.tenant_index()
+
     def index_needs_refresh(self):
         return self.needs_refresh
 
     def index_refresh(self):
-        self.es.indices.refresh(index=self.es_index)
+        self.es.indices.refresh(index=self.tenant_index())
         self.needs_refresh = False
 
     def set_index_needs_refresh(self):
@@ -91,60 +333,66 @@ class AnnotationStore(object):
             self.index_refresh()
 
     def add_annotation_es(self, annotation, params):
+        # ids generated by the server are fresh uuids, only ids supplied by the client can already exist
+        client_supplied_id = "id" in annotation
         # check if annotation is valid, add id and timestamp
-        anno = Annotation(annotation)
+        with instrumentation.timed("validation"):
+            anno = Annotation(annotation)
+        # the first annotation of a project creates its index
+        self.tenant_index(create=True)
         # if annotation already has ID, check if it already exists in the index
-        if "id" in annotation:
+        if client_supplied_id:
             self.should_not_exist(annotation['id'], annotation['type'])
         # add permissions for access (see) and update (edit)
         permissions.add_permissions(anno, params)
         # create target_list for easy target-based retrieval
         self.add_target_list(anno)
-        # index annotation
-        self.add_to_index(anno.to_json(), annotation["type"])
+        # index annotation, the create request itself fails if the id exists after all
+        self.add_to_index(anno.to_json(), annotation["type"], check_exists=False)
         # set index needs refresh before next GET
         self.set_index_needs_refresh()
         # exclude target_list and permissions when returning annotation
-        return anno.to_clean_json(params)
+        with instrumentation.timed("serialization"):
+            return anno.to_clean_json(params)
 
     def create_collection_es(self, collection_data, params):
         # check if collection is valid, add id and timestamp
-        collection = AnnotationCollection(collection_data)
+        with instrumentation.timed("validation"):
+            collection = AnnotationCollection(collection_data)
+        self.tenant_index(create=True)
         # if collection already has ID, check if it already exists in the index
         if "id" in collection_data:
             self.should_not_exist(collection_data['id'], collection_data['type'])
         # add permissions for access (see) and update (edit)
         permissions.add_permissions(collection, params)
-        # index collection
-        self.add_to_index(collection.to_json(), collection.type)
+        # index collection, the create request itself fails if the id exists after all
+        self.add_to_index(collection.to_json(), collection.type, check_exists=False)
         # set index needs refresh before next GET
         self.set_index_needs_refresh()
         # return collection to caller
-        return collection.to_clean_json(params)
+        with instrumentation.timed("serialization"):
+            return collection.to_clean_json(params)
 
     def add_annotation_to_collection_es(self, annotation_id, collection_id, params):
-        # check that user is allowed to edit collection
-        collection = self.get_from_index_if_allowed(collection_id,
-                                                    username=params["username"],
-                                                    action="edit",
-                                                    annotation_type="AnnotationCollection")
-        # check if collection contains annotation
-        if collection.has_annotation(annotation_id):
-            raise AnnotationError(message="Collection already contains this annotation")
+        # check that user is allowed to edit collection, without reading its items
+        document = self.check_allowed_action(collection_id,
+                                             username=params["username"],
+                                             groups=permissions.get_groups(params),
+                                             action="edit",
+                                             annotation_type="AnnotationCollection")
         # check that user is allowed to see annotation
-        self.get_from_index_if_allowed(annotation_id,
-                                       username=params["username"],
-                                       action="see",
-                                       annotation_type="Annotation")
-        # add annotation
-        collection.add_annotation(annotation_id)
-        # add permissions for access (see) and update (edit)
-        permissions.add_permissions(collection, params)
-        self.update_in_index(collection.to_json(), "AnnotationCollection")
-        # set index needs refresh before next GET
-        self.set_index_needs_refresh()
+        self.check_allowed_action(annotation_id,
+                                  username=params["username"],
+                                  groups=permissions.get_groups(params),
+                                  action="see",
+                                  annotation_type="Annotation")
+        # add annotation in place, a noop means the collection already contains it
+        script = make_items_script(document, [annotation_id], [], params)
+        response = self.update_by_script(document, "AnnotationCollection", script, source_excludes=["items"])
+        if response["result"] == "noop":
+            raise AnnotationError(message="Collection already contains this annotation")
         # return collection metadata
-        return collection.to_clean_json(params)
+        return make_collection_metadata(response["get"]["_source"], params)
 
     def get_annotation_es(self, annotation_id, params):
         if "action" not in params:
@@ -154,31 +402,136 @@ class AnnotationStore(object):
         # get annotation from index
         annotation = self.get_from_index_if_allowed(annotation_id,
                                                     username=params["username"],
+                                                    groups=permissions.get_groups(params),
                                                     action=params["action"],
                                                     annotation_type="Annotation")
-        return annotation.to_clean_json(params)
+        with instrumentation.timed("serialization"):
+            return annotation.to_clean_json(params)
 
     def get_annotations_es(self, params):
         # check index is up to date, refresh if needed
         self.check_index_is_fresh()
-        response = self.get_from_index_by_filters(params, annotation_type="Annotation")
-        annotations = [Annotation(hit["_source"]) for hit in response["hits"]["hits"]]
-        if isinstance(response['hits']['total'], dict):
-            # For Elasticsearch version 6 and higher
-            total = response['hits']['total']['value']
-        else:
-            # For Elasticsearch version 5 and lower
-            total = response['hits']['total']
+        source_filter = query_helper.make_source_filter(params)
+        response = self.get_from_index_by_filters(params, annotation_type="Annotation", source_filter=source_filter)
+        total = get_hits_total(response)
         return {
             "total": total,
-            "annotations": [annotation.to_clean_json(params) for annotation in annotations]
+            # ES only returns the requested parts of the annotations, so no cleaning is needed
+            "annotations": [hit["_source"] for hit in response["hits"]["hits"]],
+            "cursor": get_next_cursor(response, params)
         }
 
+    def search_annotations_es(self, params):
+        # check index is up to date, refresh if needed
+        self.check_index_is_fresh()
+        source_filter = query_helper.make_source_filter(params)
+        response = self.get_from_index_by_filters(params, annotation_type="Annotation", source_filter=source_filter,
+                                                  highlight=True)
+        results = []
+        for hit in response["hits"]["hits"]:
+            result = {"annotation": hit["_source"], "score": hit["_score"]}
+            if "highlight" in hit:
+                result["highlight"] = hit["highlight"]
+            results.append(result)
+        return {
+            "total": get_hits_total(response),
+            "results": results,
+            "cursor": get_next_cursor(response, params)
+        }
+
+    def count_annotations_es(self, params):
+        # check index is up to date, refresh if needed
+        self.check_index_is_fresh()
+        response = self.count_in_index_by_filters(params, annotation_type="Annotation")
+        return response["count"]
+
+    def count_collections_es(self, params):
+        # check index is up to date, refresh if needed
+        self.check_index_is_fresh()
+        response = self.count_in_index_by_filters(params, annotation_type="AnnotationCollection")
+        return response["count"]
+
+    def get_facets_es(self, params):
+        # check index is up to date, refresh if needed
+        self.check_index_is_fresh()
+        response = self.get_aggregations_from_index_by_filters(params, annotation_type="Annotation")
+        facets = {}
+        for facet, aggregation in response["aggregations"].items():
+            facets[facet] = [{"value": bucket["key_as_string"] if "key_as_string" in bucket else bucket["key"],
+                              "count": bucket["doc_count"]} for bucket in aggregation["buckets"]]
+        return {
+            "total": get_hits_total(response),
+            "facets": facets
+        }
+
+    def get_target_counts_es(self, target_ids, params):
+        """Return the number of annotations per target id and access level that the user can see,
+        from the in-memory counts instead of a query per target."""
+        with instrumentation.timed("target_counts"):
+            counts = self.target_counts.get_counts(self.tenant_index(), target_ids, username=params["username"],
+                                                   groups=permissions.get_groups(params),
+                                                   access_status=params["access_status"])
+        return {"counts": counts}
+
+    def get_changes_es(self, since, limit, params, wait=0):
+        """Return the changes after the since sequence number that the user can see, waiting up to
+        wait seconds for new changes if there are none."""
+        if not self.changes:
+            raise AnnotationError(message="The change feed is not enabled", status_code=404)
+        return self.changes.get_changes(self.tenant_index(), since, limit, username=params["username"],
+                                        groups=permissions.get_groups(params), wait=wait)
+
     def get_annotations_by_id_es(self, annotation_ids, params):
         # check index is up to date, refresh if needed
         self.check_index_is_fresh()
-        response = self.es.mget(index=self.es_index, doc_type="Annotation", body={"ids": annotation_ids})
-        return [hit["_source"] for hit in response["docs"]]
+        source_filter = query_helper.make_source_filter(params)
+        documents = self.get_documents(annotation_ids, source_filter, annotation_type="Annotation")
+        return [document["_source"] for document in documents]
+
+    def update_collection_items_es(self, collection_id, add_ids, remove_ids, params):
+        """Add and remove many annotations to and from a collection in a single update. The permissions
+        of all annotations are checked with a single multi-get. Annotations that don't exist or that the
+        user is not allowed to see are rejected, the other changes are applied."""
+        # check that user is allowed to edit collection, without reading its items
+        document = self.check_allowed_action(collection_id,
+                                             username=params["username"],
+                                             groups=permissions.get_groups(params),
+                                             action="edit",
+                                             annotation_type="AnnotationCollection")
+        annotation_ids = list(dict.fromkeys(add_ids + remove_ids))
+        source_filter = {"includes": ["id", "type", "status", "permissions"]}
+        found = {found_doc["_id"]: found_doc["_source"]
+                 for found_doc in self.get_documents(annotation_ids, source_filter, annotation_type="Annotation")}
+        rejected = []
+        allowed = set()
+        for annotation_id in annotation_ids:
+            if annotation_id not in found or is_tombstone(found[annotation_id]):
+                rejected.append({"id": annotation_id, "message": "Annotation does not exist"})
+            elif not is_allowed_action(params["username"], "see",
+                                       SimpleNamespace(permissions=found[annotation_id]["permissions"]),
+                                       groups=permissions.get_groups(params)):
+                rejected.append({"id": annotation_id,
+                                 "message": "Unauthorized access - no permission to see annotation"})
+            else:
+                allowed.add(annotation_id)
+        add_ids = [annotation_id for annotation_id in add_ids if annotation_id in allowed]
+        remove_ids = [annotation_id for annotation_id in remove_ids if annotation_id in allowed]
+        script = make_items_script(document, add_ids, remove_ids, params)
+        response = self.update_by_script(document, "AnnotationCollection", script, source_excludes=["items"])
+        # the items script maintains the total, so the items don't have to be returned
+        collection = response["get"]["_source"]
+        return {
+            "id": collection["id"],
+            "total": collection["total"],
+            "modified": response["result"] != "noop",
+            "rejected": rejected
+        }
+
+    def get_collection_items(self, collection_id):
+        """Return the ids of the annotations in the collection, for a caller that has checked the
+        permissions of the collection already."""
+        document = self.get_existing_document(collection_id, "AnnotationCollection", source_includes=["items"])
+        return document["_source"]["items"]
 
     def get_collection_es(self, collection_id, params):
         if "action" not in params:
@@ -188,21 +541,20 @@ class AnnotationStore(object):
         # get collection from index
         collection = self.get_from_index_if_allowed(collection_id,
                                                     username=params["username"],
+                                                    groups=permissions.get_groups(params),
                                                     action=params["action"],
                                                     annotation_type="AnnotationCollection")
-        return collection.to_clean_json(params)
+        with instrumentation.timed("serialization"):
+            return collection.to_clean_json(params)
 
     def get_collections_es(self, params):
         # check index is up to date, refresh if needed
         self.check_index_is_fresh()
-        response = self.get_from_index_by_filters(params, annotation_type="AnnotationCollection")
+        source_filter = query_helper.make_collection_source_filter(params)
+        response = self.get_from_index_by_filters(params, annotation_type="AnnotationCollection",
+                                                  source_filter=source_filter)
         collections = [AnnotationCollection(hit["_source"]) for hit in response["hits"]["hits"]]
-        if isinstance(response['hits']['total'], dict):
-            # For Elasticsearch version 6 and higher
-            total = response['hits']['total']['value']
-        else:
-            # For Elasticsearch version 5 and lower
-            total = response['hits']['total']
+        total = get_hits_total(response)
         return {
             "total": total,
             "collections": [collection.to_clean_json(params) for collection in collections]
@@ -211,10 +563,11 @@ class AnnotationStore(object):
     def update_annotation_es(self, updated_annotation_json, params):
         if "action" not in params:
             params["action"] = "edit"
-        annotation = self.get_from_index_if_allowed(updated_annotation_json["id"],
-                                                    username=params["username"],
-                                                    action=params["action"],
-                                                    annotation_type="Annotation")
+        annotation, document = self.get_document_if_allowed(updated_annotation_json["id"],
+                                                            username=params["username"],
+                                                            groups=permissions.get_groups(params),
+                                                            action=params["action"],
+                                                            annotation_type="Annotation")
         # get copy of original target list
         old_target_list = copy.copy(annotation.to_json()["target_list"])
         # update annotation with new data
@@ -224,7 +577,7 @@ class AnnotationStore(object):
         # update target_list
         self.add_target_list(annotation)
         # index updated annotation
-        self.update_in_index(annotation.to_json(), annotation.type)
+        self.update_in_index(annotation.to_json(), annotation.type, document=document)
         # if target list has changed, annotations targeting this annotation should also be updated
         if target_list_changed(annotation.to_json()["target_list"], old_target_list):
             # updates annotations that target this updated annotation
@@ -232,11 +585,12 @@ class AnnotationStore(object):
         # set index needs refresh before next GET
         self.set_index_needs_refresh()
         # return annotation to caller
-        return annotation.to_clean_json(params)
+        with instrumentation.timed("serialization"):
+            return annotation.to_clean_json(params)
 
     def update_chained_annotations(self, annotation_id):
         # first refresh the index
-        self.es.indices.refresh(index=self.es_index)
+        self.es.indices.refresh(index=self.tenant_index())
         chain_annotations = self.get_from_index_by_target({"id": annotation_id})
         for chain_annotation in chain_annotations:
             if chain_annotation["id"] == annotation_id:
@@ -246,69 +600,56 @@ class AnnotationStore(object):
             self.update_annotation_es(chain_annotation, params={"username": None, "action": "traverse"})
 
     def update_collection_es(self, collection_json):
-        self.should_exist(collection_json["id"], "AnnotationCollection")
-        collection = AnnotationCollection(self.get_from_index_by_id(collection_json["id"], "AnnotationCollection"))
-        collection.update(collection_json)
-        self.update_in_index(collection.to_json(), "AnnotationCollection")
-        # set index needs refresh before next GET
-        self.set_index_needs_refresh()
-        return collection.to_json()
+        document = self.get_existing_document(collection_json["id"], "AnnotationCollection",
+                                              source_includes=["id", "type", "status"])
+        script = es_scripts.make_update_metadata_script(collection_json["creator"], collection_json["label"],
+                                                        modified=make_timestamp())
+        response = self.update_by_script(document, "AnnotationCollection", script)
+        return AnnotationCollection(response["get"]["_source"]).to_json()
 
     def remove_annotation_es(self, annotation_id, params):
         if params and "action" not in params:
             params["action"] = "edit"
-        # remove annotation from index
-        self.remove_from_index_if_allowed(annotation_id, params, annotation_type="Annotation")
-        # replace with deleted annotation with same id
-        deleted_annotation = {
-            "id": annotation_id,
-            "type": "Annotation",
-            "status": "deleted"
-        }
-        self.add_to_index(deleted_annotation, "Annotation")
+        # check that user is allowed to remove annotation
+        document = self.get_removable_document(annotation_id, params, annotation_type="Annotation")
+        # replace with deleted annotation with same id, in a single versioned write
+        deleted_annotation = make_tombstone(annotation_id, "Annotation")
+        self.update_in_index(deleted_annotation, "Annotation", document=document)
         # updates annotations that target this deleted annotation
         self.update_chained_annotations(annotation_id)
         return deleted_annotation
 
     def remove_annotation_from_collection_es(self, annotation_id, collection_id, params):
-        # check that user is allowed to edit collection
-        collection = self.get_from_index_if_allowed(collection_id,
-                                                    username=params["username"],
-                                                    action="edit",
-                                                    annotation_type="AnnotationCollection")
-        # check if collection contains annotation
-        if not collection.has_annotation(annotation_id):
-            raise AnnotationError(message="Collection doesn't contain this annotation")
+        # check that user is allowed to edit collection, without reading its items
+        document = self.check_allowed_action(collection_id,
+                                             username=params["username"],
+                                             groups=permissions.get_groups(params),
+                                             action="edit",
+                                             annotation_type="AnnotationCollection")
         # check that user is allowed to see annotation
-        self.get_from_index_if_allowed(annotation_id,
-                                       username=params["username"],
-                                       action="see",
-                                       annotation_type="Annotation")
-        # remove annotation
-        collection.remove_annotation(annotation_id)
-        self.update_in_index(collection.to_json(), "AnnotationCollection")
+        self.check_allowed_action(annotation_id,
+                                  username=params["username"],
+                                  groups=permissions.get_groups(params),
+                                  action="see",
+                                  annotation_type="Annotation")
+        # remove annotation in place, a noop means the collection doesn't contain it
+        script = es_scripts.make_update_items_script([], [annotation_id], modified=make_timestamp())
+        response = self.update_by_script(document, "AnnotationCollection", script)
+        if response["result"] == "noop":
+            raise AnnotationError(message="Collection doesn't contain this annotation")
         # return collection metadata
-        return collection.to_json()
+        return AnnotationCollection(response["get"]["_source"]).to_json()
 
     def remove_collection_es(self, collection_id, params):
         # check that user is allowed to edit collection
-        self.get_from_index_if_allowed(collection_id,
-                                       username=params["username"],
-                                       action="edit",
-                                       annotation_type="AnnotationCollection")
-        # check index is up to date, refresh if needed
-        self.check_index_is_fresh()
-        # check if collection already exists
-        self.should_exist(collection_id, "AnnotationCollection")
-        # remove collection from index
-        self.remove_from_index(collection_id, "AnnotationCollection")
-        # replace with deleted collection with same id
-        deleted_collection = {
-            "id": collection_id,
-            "type": "AnnotationCollection",
-            "status": "deleted"
-        }
-        self.add_to_index(deleted_collection, "AnnotationCollection")
+        _, document = self.get_document_if_allowed(collection_id,
+                                                   username=params["username"],
+                                                   groups=permissions.get_groups(params),
+                                                   action="edit",
+                                                   annotation_type="AnnotationCollection")
+        # replace with deleted collection with same id, in a single versioned write
+        deleted_collection = make_tombstone(collection_id, "AnnotationCollection")
+        self.update_in_index(deleted_collection, "AnnotationCollection", document=document)
         return deleted_collection
 
     ####################
@@ -324,8 +665,14 @@ class AnnotationStore(object):
                     raise AnnotationError(message="Annotation cannot target itself")
                 if self.is_deleted(target["id"]):
                     continue
-                target_annotation = self.get_annotation_es(target['id'],
-                                                           params={"username": None, "action": "traverse"})
+                try:
+                    target_annotation = self.get_annotation_es(target['id'],
+                                                               params={"username": None, "action": "traverse"})
+                except AnnotationError as error:
+                    # the registry of deleted ids can miss recent deletes of other worker processes
+                    if error.status_code != 404:
+                        raise
+                    continue
                 deeper_targets += self.get_target_list(Annotation(target_annotation))
         target_ids = [target["id"] for target in target_list]
         for target in deeper_targets:
@@ -341,100 +688,285 @@ class AnnotationStore(object):
     # ES interactions #
     ###################
 
-    def add_to_index(self, annotation, annotation_type):
+    def add_to_index(self, annotation, annotation_type, check_exists=True):
         should_have_target_list(annotation)
         should_have_permissions(annotation)
-        self.should_not_exist(annotation['id'], annotation_type)
-        return self.es.index(index=self.es_index, doc_type=annotation_type, id=annotation['id'], body=annotation)
+        # a create request conflicts with an existing id in the same index, with rollover
+        # the id can also exist in an older backing index
+        if check_exists and self.rollover:
+            self.should_not_exist(annotation['id'], annotation_type)
+        self.set_index_needs_refresh()
+        try:
+            # op_type create only succeeds if the id doesn't exist in the (write) index
+            response = self.es.index(index=self.write_index(), doc_type=annotation_type, id=annotation['id'],
+                                     body=annotation, op_type="create")
+        except ConflictError:
+            raise AnnotationError(message="Annotation with id %s already exists" % annotation['id'])
+        self.known_ids.add(self.tenant_index(), annotation['id'])
+        self.target_counts.set(self.tenant_index(), annotation['id'], annotation)
+        if is_tombstone(annotation):
+            self.tombstones.add(self.tenant_index(), annotation['id'])
+        self.record_change(annotation, "deleted" if is_tombstone(annotation) else "created")
+        return response
 
     def add_bulk_to_index(self, annotations, annotation_type):
-        raise ValueError("Function not yet implemented")
+        """Index many new annotations (or collections), that already have a target list and permissions,
+        in bulk requests. Returns the number of indexed documents and the errors of the documents that
+        failed, e.g. because their id already exists."""
+        for annotation in annotations:
+            should_have_target_list(annotation)
+            should_have_permissions(annotation)
+        write_index = self.write_index()
+        actions = ({"_op_type": "create", "_index": write_index, "_type": annotation_type, "_id": annotation["id"],
+                    "_source": annotation} for annotation in annotations)
+        self.set_index_needs_refresh()
+        indexed, errors = bulk(self.es, actions, raise_on_error=False)
+        failed_ids = set(error["create"]["_id"] for error in errors)
+        for annotation in annotations:
+            if annotation["id"] not in failed_ids:
+                self.known_ids.add(self.tenant_index(), annotation["id"])
+                self.target_counts.set(self.tenant_index(), annotation["id"], annotation)
+        if self.changes:
+            self.changes.record_bulk(self.tenant_index(), [annotation for annotation in annotations
+                                                           if annotation["id"] not in failed_ids],
+                                     annotation_type, "created")
+        return indexed, errors
+
+    def get_from_index_if_allowed(self, annotation_id, username, action, annotation_type="_all", groups=None):
+        annotation, _ = self.get_document_if_allowed(annotation_id, username, action, annotation_type, groups=groups)
+        return annotation
 
-    def get_from_index_if_allowed(self, annotation_id, username, action, annotation_type="_all"):
+    def check_allowed_action(self, annotation_id, username, action, annotation_type="_all", groups=None):
+        """Permission check that only reads the permissions of the annotation (or collection).
+        Returns the ES document with just those fields."""
+        # check index is up to date, refresh if needed
+        self.check_index_is_fresh()
+        document = self.get_existing_document(annotation_id, annotation_type,
+                                              source_includes=["id", "type", "status", "permissions"])
+        check_allowed(username, action, SimpleNamespace(permissions=document["_source"]["permissions"]), groups=groups)
+        return document
+
+    def get_documents(self, annotation_ids, source_filter, annotation_type="_all"):
+        """Return the ES documents with the given ids that exist, in the order of the ids."""
+        if not annotation_ids:
+            return []
+        if self.rollover:
+            # the read alias spans several backing indices, which mget can't address
+            self.check_index_is_fresh()
+            query = {"query": query_helper.make_ids_query(annotation_ids), "size": len(annotation_ids),
+                     "_source": source_filter}
+            response = self.es.search(index=self.tenant_index(), body=query)
+            found = {hit["_id"]: hit for hit in response["hits"]["hits"]}
+            return [found[annotation_id] for annotation_id in annotation_ids if annotation_id in found]
+        response = self.es.mget(index=self.tenant_index(), doc_type=annotation_type, body={"ids": annotation_ids},
+                                _source_includes=source_filter.get("includes"),
+                                _source_excludes=source_filter.get("excludes"))
+        return [document for document in response["docs"] if document["found"]]
+
+    def get_document_if_allowed(self, annotation_id, username, action, annotation_type="_all", groups=None):
+        """Return the annotation (or collection) and its ES document, which holds the version
+        to make a subsequent update conditional on."""
         # check index is up to date, refresh if needed
         self.check_index_is_fresh()
-        # check that annotation exists (and is not deleted)
-        self.should_exist(annotation_id, annotation_type)
-        # get original annotation json
-        annotation_json = self.get_from_index_by_id(annotation_id, annotation_type)
-        annotation = Annotation(annotation_json) if annotation_json["type"] == "Annotation" else AnnotationCollection(
-            annotation_json)
+        # get original annotation json, if it exists (and is not deleted)
+        document = self.get_existing_document(annotation_id, annotation_type)
+        annotation = make_annotation(document)
         # check if user has appropriate permissions
-        if not permissions.is_allowed_action(username, action, annotation):
-            raise PermissionError(message="Unauthorized access - no permission to {a} annotation".format(a=action))
-        return annotation
+        check_allowed(username, action, annotation, groups=groups)
+        return annotation, document
 
     def get_from_index_by_id(self, annotation_id, annotation_type="_all"):
-        self.should_exist(annotation_id, annotation_type)
-        return self.es.get(index=self.es_index, doc_type=annotation_type, id=annotation_id)['_source']
-
-    def get_from_index_by_filters(self, params, annotation_type="_all"):
-        filter_queries = query_helper.make_param_filter_queries(params, annotation_type)
-        filter_queries += [query_helper.make_permission_see_query(params)]
-        query = {
-            "from": params["page"] * self.es_config["page_size"],
-            "size": self.es_config["page_size"],
-            "query": query_helper.bool_must(filter_queries)
-        }
-        return self.es.search(index=self.es_index, body=query)
+        return self.get_existing_document(annotation_id, annotation_type)['_source']
+
+    def get_document(self, annotation_id, annotation_type="_all", source_includes=None):
+        """Return the ES document (including the index that holds it) with the given id, or None.
+        With source_includes, only those fields of the document are read."""
+        index = self.tenant_index()
+        source_includes = with_type_field(source_includes)
+        if not self.rollover:
+            try:
+                return self.es.get(index=index, doc_type=annotation_type, id=annotation_id,
+                                   _source_includes=source_includes)
+            except NotFoundError:
+                return None
+        self.check_index_is_fresh()
+        hits = self.es.search(index=index, body=make_document_query(annotation_id, source_includes))["hits"]["hits"]
+        return get_document_from_hits(hits, annotation_type)
+
+    def get_existing_document(self, annotation_id, annotation_type="_all", source_includes=None):
+        document = self.get_document(annotation_id, annotation_type, source_includes=source_includes)
+        return check_document_exists(document, annotation_id)
+
+    def get_from_index_by_filters(self, params, annotation_type="_all", source_filter=None, highlight=False):
+        query = query_helper.make_paged_query(params, self.es_config["page_size"], annotation_type,
+                                              source_filter=source_filter, highlight=highlight)
+        with request_params(params):
+            return self.es.search(index=self.read_index(params), body=query)
+
+    def get_aggregations_from_index_by_filters(self, params, annotation_type="_all"):
+        query = query_helper.make_aggregation_query(params, annotation_type)
+        with request_params(params):
+            return self.es.search(index=self.read_index(params), body=query)
+
+    def count_in_index_by_filters(self, params, annotation_type="_all"):
+        query = {"query": query_helper.make_search_query(params, annotation_type)}
+        with request_params(params):
+            return self.es.count(index=self.read_index(params), body=query)
 
     def get_from_index_by_target(self, target):
         target_list_query = query_helper.make_target_list_query(target)
-        query = {"query": query_helper.bool_must([target_list_query])}
-        response = self.es.search(index=self.es_index, body=query)
+        query = {"query": {"bool": {"must": [target_list_query], "must_not": [query_helper.make_tombstone_query()]}}}
+        response = self.es.search(index=self.tenant_index(), body=query)
         return [hit["_source"] for hit in response['hits']['hits']]
 
     def get_from_index_by_target_list(self, target, params):
         target_list_query = query_helper.make_target_list_query(target)
         permission_query = query_helper.make_permission_see_query(params)
         query = {"query": query_helper.bool_must([target_list_query, permission_query])}
-        response = self.es.search(index=self.es_index, body=query)
+        with request_params(params):
+            response = self.es.search(index=self.read_index(params), body=query)
         return [hit["_source"] for hit in response['hits']['hits']]
 
-    def update_in_index(self, annotation, annotation_type):
+    def update_in_index(self, annotation, annotation_type, document=None):
+        """Replace the annotation in the (backing) index that holds it. The write only succeeds if the
+        stored version is still the version of the given document, or else the version just read."""
         should_have_target_list(annotation)
         should_have_permissions(annotation)
-        self.should_exist(annotation['id'], annotation_type)
-        return self.es.index(index=self.es_index, doc_type=annotation_type, id=annotation['id'], body=annotation)
-
-    def remove_from_index(self, annotation_id, annotation_type):
-        self.should_exist(annotation_id, annotation_type)
-        return self.es.delete(index=self.es_index, doc_type=annotation_type, id=annotation_id)
+        if document is None:
+            document = self.get_existing_document(annotation['id'], annotation_type)
+        self.set_index_needs_refresh()
+        try:
+            response = self.es.index(index=document["_index"], doc_type=annotation_type, id=annotation['id'],
+                                     body=annotation, if_seq_no=document["_seq_no"],
+                                     if_primary_term=document["_primary_term"])
+        except ConflictError:
+            raise AnnotationError(message="Annotation with id %s was changed by another request" % annotation['id'],
+                                  status_code=409)
+        self.target_counts.set(self.tenant_index(), annotation['id'], annotation)
+        if is_tombstone(annotation):
+            self.tombstones.add(self.tenant_index(), annotation['id'])
+            # deletes are filtered with the permissions of the last version
+            self.record_change(annotation, "deleted", document["_source"].get("permissions"))
+        else:
+            self.record_change(annotation, "updated")
+        return response
 
-    def remove_from_index_if_allowed(self, annotation_id, params, annotation_type="_all"):
+    def update_by_script(self, document, annotation_type, script, source_excludes=None):
+        """Apply a painless script to the document in the (backing) index that holds it. The
+        response contains the updated source without the source_excludes fields, and result "noop"
+        if the script changed nothing."""
+        self.set_index_needs_refresh()
+        try:
+            # a script is applied to the latest version, so on a concurrent change it is simply retried
+            response = self.es.update(index=document["_index"], doc_type=annotation_type, id=document["_id"],
+                                      body={"script": script}, retry_on_conflict=3,
+                                      **make_update_source_params(source_excludes))
+        except NotFoundError:
+            raise AnnotationError(message="Annotation with id %s does not exist" % document["_id"], status_code=404)
+        check_script_update(document, response)
+        if response["result"] != "noop":
+            self.record_change(response["get"]["_source"], "updated")
+        return response
+
+    def remove_from_index(self, annotation_id, annotation_type, document=None):
+        if document is None:
+            document = self.get_existing_document(annotation_id, annotation_type)
+        self.set_index_needs_refresh()
+        try:
+            response = self.es.delete(index=document["_index"], doc_type=annotation_type, id=annotation_id,
+                                      if_seq_no=document["_seq_no"], if_primary_term=document["_primary_term"])
+        except ConflictError:
+            raise AnnotationError(message="Annotation with id %s was changed by another request" % annotation_id,
+                                  status_code=409)
+        except NotFoundError:
+            raise AnnotationError(message="Annotation with id %s does not exist" % annotation_id, status_code=404)
+        self.target_counts.set(self.tenant_index(), annotation_id, None)
+        self.record_change(document["_source"], "deleted")
+        return response
+
+    def record_change(self, annotation, action, annotation_permissions=None):
+        if not self.changes:
+            return None
+        if annotation_permissions is None:
+            annotation_permissions = annotation.get("permissions")
+        self.changes.record(self.tenant_index(), annotation["id"], annotation["type"], action, annotation_permissions)
+
+    def get_removable_document(self, annotation_id, params, annotation_type="_all"):
         if "username" not in params:
             params["username"] = None
         # check index is up to date, refresh if needed
         self.check_index_is_fresh()
-        # check that annotation exists (and is not deleted)
-        self.should_exist(annotation_id, annotation_type)
-        # get original annotation json
-        annotation_json = self.get_from_index_by_id(annotation_id, annotation_type)
+        # get original annotation json, if it exists (and is not deleted)
+        document = self.get_existing_document(annotation_id, annotation_type)
         # check if user has appropriate permissions
-        if not permissions.is_allowed_action(params["username"], "edit", Annotation(annotation_json)):
+        annotation = SimpleNamespace(permissions=document["_source"]["permissions"])
+        if not is_allowed_action(params["username"], "edit", annotation, groups=permissions.get_groups(params)):
             raise PermissionError(
                 message="Unauthorized access - no permission to {a} annotation".format(a=params["action"]))
-        return self.remove_from_index(annotation_id, "Annotation")
+        return document
+
+    def remove_from_index_if_allowed(self, annotation_id, params, annotation_type="_all"):
+        document = self.get_removable_document(annotation_id, params, annotation_type)
+        return self.remove_from_index(annotation_id, "Annotation", document=document)
 
     def is_deleted(self, annotation_id, annotation_type="_all"):
-        if self.es.exists(index=self.es_index, doc_type=annotation_type, id=annotation_id):
-            res = self.es.get(index=self.es_index, doc_type=annotation_type, id=annotation_id)
-            if "status" in res["_source"] and res["_source"]["status"] == "deleted":
-                return True
-        return False
+        # answered from the in-memory tombstone registry, ids are unique across types
+        return self.tombstones.is_deleted(self.tenant_index(), annotation_id)
 
     def should_exist(self, annotation_id, annotation_type="_all"):
-        if self.es.exists(index=self.es_index, doc_type=annotation_type, id=annotation_id):
-            if not self.is_deleted(annotation_id, annotation_type):
-                return True
-        raise AnnotationError(message="Annotation with id %s does not exist" % annotation_id, status_code=404)
+        self.get_existing_document(annotation_id, annotation_type)
+        return True
 
     def should_not_exist(self, annotation_id, annotation_type="_all"):
-        if self.es.exists(index=self.es_index, doc_type=annotation_type, id=annotation_id):
+        # ids that are not in the filter of known ids don't need a request to ES
+        if not self.rollover and not self.known_ids.might_contain(self.tenant_index(), annotation_id):
+            return True
+        if self.get_document(annotation_id, annotation_type) is not None:
             raise AnnotationError(message="Annotation with id %s already exists" % annotation_id)
         else:
             return True
 
+    ###################
+    # Index lifecycle #
+    ###################
+
+    def rollover_indices(self, conditions=None):
+        """Roll over the write alias of each project index for which the rollover conditions are met."""
+        if not self.rollover:
+            raise ValueError("Rollover is not enabled for the annotation index")
+        if conditions is None:
+            conditions = self.es_config["rollover_conditions"]
+        self.ensure_index()
+        backing_indices = self.es.indices.get_alias(index=tenant.all_projects_alias(self.es_index))
+        write_aliases = set()
+        for backing_index in backing_indices.values():
+            for alias, alias_properties in backing_index["aliases"].items():
+                if alias_properties.get("is_write_index"):
+                    write_aliases.add(alias)
+        results = {}
+        for write_alias in write_aliases:
+            read_alias = write_alias[:-len("-write")]
+            body = copy.deepcopy(annotation_index)
+            body["aliases"] = {read_alias: {}, tenant.all_projects_alias(self.es_index): {}}
+            body["conditions"] = conditions
+            # without a new index name, ES increments the counter of the current write index (and
+            # resolves its date math again), so the name doesn't depend on the other backing indices
+            response = self.es.indices.rollover(alias=write_alias, body=body, include_type_name=True)
+            results[read_alias] = response["rolled_over"]
+        return results
+
+    def purge_tombstones(self, retention=None):
+        """Delete the tombstones of annotations and collections that were deleted longer than the
+        retention period ago, in all project indices. Returns the number of purged tombstones."""
+        if retention is None:
+            retention = self.es_config["tombstone_retention"] if "tombstone_retention" in self.es_config else "30d"
+        self.ensure_index()
+        query = {"query": query_helper.make_expired_tombstone_query(retention)}
+        response = self.es.delete_by_query(index=tenant.all_projects_alias(self.es_index), body=query,
+                                           conflicts="proceed")
+        self.tombstones.expire(retention)
+        return response["deleted"]
+
     def list_annotation_ids(self):
         return list(self.annotation_index.keys())
 
@@ -0,0 +1,125 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Union
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.exceptions import NotFoundError
+from models.annotation import AnnotationError
+from models.annotation_store import AnnotationStore, check_allowed, check_document_exists, \
+    check_script_update, get_document_from_hits, make_annotation, make_collection_metadata, make_document_query, \
+    make_items_script, make_update_source_params, with_type_field
+from models.async_calls import run_in_thread
+import models.instrumentation as instrumentation
+import models.permissions as permissions
+import models.tenant as tenant
+
+
+class AsyncAnnotationStore(object):
+    """Asyncio variant of the annotation store for the requests that the ASGI app serves natively
+    (see asgi.py). It makes the ES requests with an AsyncElasticsearch client, and uses the
+    settings, project routing and in-memory indexes of the synchronous store it is given, so both
+    stores see the same writes. The rare blocking calls, creating an index and recording a change,
+    run on the synchronous store in a thread."""
+
+    def __init__(self, store: AnnotationStore, es: AsyncElasticsearch):
+        self.store = store
+        self.es = es
+
+    async def close(self) -> None:
+        await self.es.close()
+
+    async def tenant_index(self) -> str:
+        index = tenant.project_index_name(self.store.es_index, tenant.get_project())
+        if index in self.store.ready_indices:
+            return index
+        # the index is only checked (or created) in ES the first time
+        return await run_in_thread(self.store.tenant_index)
+
+    async def check_index_is_fresh(self) -> None:
+        # check index is up to date, refresh if needed
+        if self.store.index_needs_refresh():
+            await self.es.indices.refresh(index=await self.tenant_index())
+            self.store.needs_refresh = False
+
+    async def get_annotation_es(self, annotation_id, params):
+        if "action" not in params:
+            params["action"] = "see"
+        if "username" not in params:
+            params["username"] = None
+        annotation, _ = await self.get_document_if_allowed(annotation_id,
+                                                           username=params["username"],
+                                                           groups=permissions.get_groups(params),
+                                                           action=params["action"],
+                                                           annotation_type="Annotation")
+        with instrumentation.timed("serialization"):
+            return annotation.to_clean_json(params)
+
+    async def add_annotation_to_collection_es(self, annotation_id, collection_id, params):
+        groups = permissions.get_groups(params)
+        # the permission checks of the collection and the annotation don't depend on each other
+        document, _ = await asyncio.gather(
+            self.check_allowed_action(collection_id, username=params["username"], groups=groups, action="edit",
+                                      annotation_type="AnnotationCollection"),
+            self.check_allowed_action(annotation_id, username=params["username"], groups=groups, action="see",
+                                      annotation_type="Annotation"))
+        # add annotation in place, a noop means the collection already contains it
+        script = make_items_script(document, [annotation_id], [], params)
+        response = await self.update_by_script(document, "AnnotationCollection", script, source_excludes=["items"])
+        if response["result"] == "noop":
+            raise AnnotationError(message="Collection already contains this annotation")
+        # return collection metadata
+        return make_collection_metadata(response["get"]["_source"], params)
+
+    async def get_collection_items(self, collection_id):
+        document = await self.get_existing_document(collection_id, "AnnotationCollection", source_includes=["items"])
+        return document["_source"]["items"]
+
+    ###################
+    # ES interactions #
+    ###################
+
+    async def check_allowed_action(self, annotation_id, username, action, annotation_type="_all", groups=None):
+        """Permission check that only reads the permissions of the annotation (or collection).
+        Returns the ES document with just those fields."""
+        await self.check_index_is_fresh()
+        document = await self.get_existing_document(annotation_id, annotation_type,
+                                                    source_includes=["id", "type", "status", "permissions"])
+        check_allowed(username, action, SimpleNamespace(permissions=document["_source"]["permissions"]), groups=groups)
+        return document
+
+    async def get_document_if_allowed(self, annotation_id, username, action, annotation_type="_all", groups=None):
+        await self.check_index_is_fresh()
+        document = await self.get_existing_document(annotation_id, annotation_type)
+        annotation = make_annotation(document)
+        check_allowed(username, action, annotation, groups=groups)
+        return annotation, document
+
+    async def get_document(self, annotation_id, annotation_type="_all", source_includes=None) -> Union[None, dict]:
+        index = await self.tenant_index()
+        source_includes = with_type_field(source_includes)
+        if not self.store.rollover:
+            try:
+                return await self.es.get(index=index, doc_type=annotation_type, id=annotation_id,
+                                         _source_includes=source_includes)
+            except NotFoundError:
+                return None
+        await self.check_index_is_fresh()
+        response = await self.es.search(index=index, body=make_document_query(annotation_id, source_includes))
+        return get_document_from_hits(response["hits"]["hits"], annotation_type)
+
+    async def get_existing_document(self, annotation_id, annotation_type="_all", source_includes=None):
+        document = await self.get_document(annotation_id, annotation_type, source_includes=source_includes)
+        return check_document_exists(document, annotation_id)
+
+    async def update_by_script(self, document, annotation_type, script, source_excludes=None):
+        self.store.set_index_needs_refresh()
+        try:
+            # a script is applied to the latest version, so on a concurrent change it is simply retried
+            response = await self.es.update(index=document["_index"], doc_type=annotation_type, id=document["_id"],
+                                            body={"script": script}, retry_on_conflict=3,
+                                            **make_update_source_params(source_excludes))
+        except NotFoundError:
+            raise AnnotationError(message="Annotation with id %s does not exist" % document["_id"], status_code=404)
+        check_script_update(document, response)
+        if response["result"] != "noop":
+            await run_in_thread(self.store.record_change, response["get"]["_source"], "updated")
+        return response
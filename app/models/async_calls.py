@@ -0,0 +1,11 @@
+import asyncio
+import contextvars
+import functools
+from typing import Awaitable, Callable
+
+
+def run_in_thread(call: Callable, *args, **kwargs) -> Awaitable:
+    """Run a blocking call in the default thread pool of the event loop. The call runs in a copy of
+    the current context, so a call of the synchronous stores is routed to the project of the request."""
+    context = contextvars.copy_context()
+    return asyncio.get_event_loop().run_in_executor(None, functools.partial(context.run, call, *args, **kwargs))
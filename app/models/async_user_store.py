@@ -0,0 +1,77 @@
+from typing import List, Union
+from elasticsearch import AsyncElasticsearch
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, BadSignature, SignatureExpired
+from models.async_calls import run_in_thread
+from models.error import UserError
+from models.group import Group
+from models.user import User
+from models.user_store import UserStore, make_member_groups_query
+
+
+def get_total(response) -> int:
+    if isinstance(response["hits"]["total"], int):
+        return response["hits"]["total"]
+    return response["hits"]["total"]["value"]
+
+
+class AsyncUserStore(object):
+    """Asyncio variant of the user lookups that authenticate the requests the ASGI app serves
+    natively (see asgi.py). It uses the secret key and group cache of the synchronous store it is
+    given. Registering users and changing groups stays with the synchronous store."""
+
+    def __init__(self, store: UserStore, es: AsyncElasticsearch):
+        self.store = store
+        self.es = es
+
+    async def close(self) -> None:
+        await self.es.close()
+
+    async def get_user_from_index(self, username=None, user_id=None) -> Union[None, User]:
+        if not username and not user_id:
+            return None
+        if user_id and not await self.user_exists(user_id):
+            raise UserError("User {u} doesn't exist".format(u=username))
+        if user_id:
+            response = await self.es.get(index=self.store.es_index, doc_type="user", id=user_id)
+            return await self.with_groups(User(response["_source"]))
+        response = await self.es.search(index=self.store.es_index, body={"query": {"match": {"username": username}}})
+        if get_total(response) == 0:
+            raise UserError("User {u} doesn't exist".format(u=username))
+        return await self.with_groups(User(response["hits"]["hits"][0]["_source"]))
+
+    async def with_groups(self, user: User) -> User:
+        user.groups = await self.get_user_groups(user.username)
+        return user
+
+    async def verify_user(self, username, password) -> bool:
+        user = await self.get_user_from_index(username=username)
+        # hashing the password takes long enough to hold up the other requests of the event loop
+        return bool(user) and await run_in_thread(user.verify_password, password)
+
+    async def verify_auth_token(self, token) -> Union[None, User]:
+        s = Serializer(self.store.secret_key)
+        try:
+            data = s.loads(token)
+        except SignatureExpired:
+            return None
+        except BadSignature:
+            return None
+        return await self.get_user_from_index(user_id=data["user_id"])
+
+    async def get_user(self, username) -> Union[None, User]:
+        return await self.get_user_from_index(username=username)
+
+    async def user_exists(self, user_id) -> bool:
+        return await self.es.exists(index=self.store.es_index, doc_type="user", id=user_id)
+
+    async def get_user_groups(self, username) -> List[str]:
+        """Return the ids of the groups the user is a member of, from the group cache of the
+        synchronous store if they are cached."""
+        if not username:
+            return []
+        group_ids = self.store.group_cache.get(username)
+        if group_ids is None:
+            response = await self.es.search(index=self.store.es_index, body=make_member_groups_query(username))
+            group_ids = [Group(hit["_source"]).group_id for hit in response["hits"]["hits"]]
+            self.store.group_cache.set(username, group_ids)
+        return group_ids
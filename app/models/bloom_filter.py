@@ -0,0 +1,100 @@
+import hashlib
+import math
+import threading
+import time
+from typing import Dict, Union
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import scan
+from models.single_flight import SingleFlight
+
+
+class BloomFilter(object):
+    """Set membership with false positives but no false negatives, in a fixed number of bits.
+    The bit array size and the number of hash functions follow from the expected number of
+    items and the acceptable false positive rate."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.num_bits = int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(int(round(self.num_bits / self.capacity * math.log(2))), 1)
+        self.bits = bytearray(int(math.ceil(self.num_bits / 8)))
+        self.count = 0
+
+    def bit_positions(self, item: str):
+        # double hashing: the k positions are derived from two 64-bit halves of a single digest
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        hash1 = int.from_bytes(digest[:8], "big")
+        hash2 = int.from_bytes(digest[8:], "big") | 1
+        return [(hash1 + i * hash2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item: str) -> None:
+        for position in self.bit_positions(item):
+            self.bits[position // 8] |= 1 << (position % 8)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        for position in self.bit_positions(item):
+            if not self.bits[position // 8] & (1 << (position % 8)):
+                return False
+        return True
+
+
+class KnownIdFilter(object):
+    """Bloom filter per index of the ids of all documents in the index. If an id is not in the
+    filter, it doesn't exist in the index (as far as this process knows), so creating it doesn't
+    need an existence check in ES. The filter of an index is loaded with a scroll over the ids when
+    the store bootstraps the index (or on first use) and updated on create. With a refresh
+    interval, it is reloaded periodically to pick up ids created by other worker processes."""
+
+    def __init__(self, es: Elasticsearch, capacity: int = 1000000, error_rate: float = 0.01,
+                 refresh_interval: Union[None, int] = None):
+        self.es = es
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.filters: Dict[str, BloomFilter] = {}
+        self.loaded_at: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.loads = SingleFlight()
+
+    def load(self, index: str) -> None:
+        # threads that find the same index stale at the same time share a single load
+        self.loads.run(index, lambda: self.load_index(index))
+
+    def load_index(self, index: str) -> None:
+        self.es.indices.refresh(index=index)
+        num_docs = self.es.count(index=index)["count"]
+        # leave room to grow, a filter filled beyond its capacity has more false positives
+        bloom_filter = BloomFilter(max(self.capacity, num_docs * 2), self.error_rate)
+        with self.lock:
+            # ids created while loading are added to both the old and the new filter
+            self.filters["loading:" + index] = bloom_filter
+        try:
+            for hit in scan(self.es, index=index, query={"_source": False}):
+                bloom_filter.add(hit["_id"])
+            with self.lock:
+                self.filters[index] = bloom_filter
+                self.loaded_at[index] = time.time()
+        finally:
+            # after a failed load, the index is still stale and the next check loads it again
+            with self.lock:
+                self.filters.pop("loading:" + index, None)
+
+    def is_stale(self, index: str) -> bool:
+        loaded_at = self.loaded_at.get(index)
+        if loaded_at is None:
+            return True
+        return self.refresh_interval is not None and time.time() - loaded_at > self.refresh_interval
+
+    def might_contain(self, index: str, annotation_id: str) -> bool:
+        if self.is_stale(index):
+            self.load(index)
+        with self.lock:
+            return annotation_id in self.filters[index]
+
+    def add(self, index: str, annotation_id: str) -> None:
+        with self.lock:
+            for key in [index, "loading:" + index]:
+                if key in self.filters:
+                    self.filters[key].add(annotation_id)
@@ -0,0 +1,280 @@
+import datetime
+import logging
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Tuple, Union
+import pytz
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import NotFoundError, RequestError, TransportError
+import models.es_scripts as es_scripts
+import models.permissions as permissions
+
+"""--------------- Change feed ------------------"""
+
+# Every write of an annotation or collection is recorded with a sequence number in a changes index
+# next to the annotation index, so clients can sync incrementally by asking for the changes since
+# the last sequence number they saw. Sequence numbers come from a counter document that all worker
+# processes increment, so they are monotonic across processes, but a change with a lower number can
+# become visible after one with a higher number. The changes that threads of a process record while
+# a previous change is being written are written together, with a single increment of the counter
+# for the whole block, so the counter document isn't updated once per write. Readers therefore only move past a gap in the
+# sequence once it is older than the gap timeout, after which the write is assumed to have failed.
+#
+# Recording a change is best effort: the annotation is written first, and if ES fails to hand out a
+# sequence number or to store the change, the failure is logged and the write still succeeds. Such
+# a change is missing from the feed, so clients that need every write should resync periodically.
+
+logger = logging.getLogger(__name__)
+
+sequence_id = "sequence"
+
+change_mapping = {
+    "change": {
+        "properties": {
+            "seq": {"type": "long"},
+            "id": {"type": "keyword"},
+            "type": {"type": "keyword"},
+            "action": {"type": "keyword"},
+            "timestamp": {"type": "date"},
+            # the permissions of the changed version, or of the last version for deletes, are only
+            # used to filter the changes per user
+            "permissions": {"type": "object", "enabled": False},
+            "last_seq": {"type": "long"}
+        }
+    }
+}
+
+
+def change_index_name(index: str) -> str:
+    # project names can't contain dots, so this doesn't clash with the index of a project
+    return index + ".changes"
+
+
+def make_timestamp() -> str:
+    return datetime.datetime.now(pytz.utc).isoformat()
+
+
+def make_change(seq: int, annotation_id: str, annotation_type: str, action: str,
+                annotation_permissions: Union[None, Dict]) -> Dict:
+    return {
+        "seq": seq,
+        "id": annotation_id,
+        "type": annotation_type,
+        "action": action,
+        "timestamp": make_timestamp(),
+        "permissions": annotation_permissions
+    }
+
+
+def get_change_age(change: Dict) -> float:
+    timestamp = datetime.datetime.fromisoformat(change["timestamp"])
+    return (datetime.datetime.now(pytz.utc) - timestamp).total_seconds()
+
+
+def is_visible(change: Dict, username: Union[None, str], groups: Union[None, List[str]]) -> bool:
+    if not change["permissions"]:
+        return False
+    return permissions.is_allowed_action(username, "see", SimpleNamespace(permissions=change["permissions"]),
+                                         groups=groups)
+
+
+def clean_change(change: Dict) -> Dict:
+    return {field: change[field] for field in ["seq", "id", "type", "action", "timestamp"]}
+
+
+class ChangeFeed(object):
+
+    def __init__(self, es: Elasticsearch, gap_timeout: float = 5, poll_interval: float = 1, max_waiting: int = 1):
+        self.es = es
+        self.gap_timeout = gap_timeout
+        self.poll_interval = poll_interval
+        self.ready_indices = set()
+        self.index_lock = threading.Lock()
+        # notified on every change recorded by this process, so long-polling readers return at once
+        self.changed = threading.Condition()
+        # a long-poll holds a request thread of the worker, requests beyond this number don't wait
+        self.waiting = threading.BoundedSemaphore(max_waiting)
+        # the changes of this process waiting for a sequence number, per change index, and the
+        # change indices for which a thread is writing them
+        self.pending: Dict[str, List[SimpleNamespace]] = {}
+        self.writing = set()
+        self.batch_lock = threading.Lock()
+        # change indices with changes recorded by this process that readers may not see yet, changes
+        # of other processes become visible with the periodic refresh of ES
+        self.unrefreshed = set()
+
+    def ensure_index(self, index: str) -> str:
+        change_index = change_index_name(index)
+        if change_index in self.ready_indices:
+            return change_index
+        with self.index_lock:
+            if change_index in self.ready_indices:
+                return change_index
+            if not self.es.indices.exists(index=change_index):
+                try:
+                    self.es.indices.create(index=change_index, body={"mappings": change_mapping},
+                                           include_type_name=True)
+                except RequestError as error:
+                    # another worker process created the index in the meantime
+                    if error.error != "resource_already_exists_exception":
+                        raise
+            self.ready_indices.add(change_index)
+        return change_index
+
+    def next_seq(self, change_index: str, count: int = 1) -> int:
+        """Reserve count sequence numbers and return the last one."""
+        response = self.es.update(index=change_index, doc_type="change", id=sequence_id,
+                                  body={"script": es_scripts.make_increment_sequence_script(count),
+                                        "upsert": {"last_seq": count}},
+                                  retry_on_conflict=10, _source=True)
+        return response["get"]["_source"]["last_seq"]
+
+    def get_last_seq(self, index: str) -> int:
+        """Return the last sequence number that was handed out for the index, 0 if there is none."""
+        change_index = self.ensure_index(index)
+        try:
+            return self.es.get(index=change_index, doc_type="change", id=sequence_id)["_source"]["last_seq"]
+        except NotFoundError:
+            return 0
+
+    def record(self, index: str, annotation_id: str, annotation_type: str, action: str,
+               annotation_permissions: Union[None, Dict]) -> Union[None, int]:
+        """Record a change and return its sequence number, or None if it couldn't be recorded."""
+        try:
+            change_index = self.ensure_index(index)
+        except TransportError as error:
+            logger.warning("change %s of %s is not recorded: %s", action, annotation_id, error)
+            return None
+        pending = SimpleNamespace(change=make_change(None, annotation_id, annotation_type, action,
+                                                     annotation_permissions),
+                                  done=threading.Event(), recorded=False)
+        with self.batch_lock:
+            self.pending.setdefault(change_index, []).append(pending)
+            leader = change_index not in self.writing
+            if leader:
+                self.writing.add(change_index)
+        if leader:
+            self.write_pending(change_index)
+        else:
+            pending.done.wait()
+        return pending.change["seq"] if pending.recorded else None
+
+    def write_pending(self, change_index: str) -> None:
+        """Write the changes that are waiting to be recorded, until there are none. Changes recorded
+        by other threads while a batch is written are written together in the next batch, so the
+        counter document is updated once per batch instead of once per change."""
+        batch = []
+        try:
+            while True:
+                with self.batch_lock:
+                    batch = self.pending.pop(change_index, [])
+                    if not batch:
+                        self.writing.discard(change_index)
+                        return None
+                self.write_batch(change_index, batch)
+                batch = []
+        except BaseException:
+            # the changes of this batch and the waiting ones are not recorded, and the next change
+            # starts a new writer
+            with self.batch_lock:
+                batch += self.pending.pop(change_index, [])
+                self.writing.discard(change_index)
+            for pending in batch:
+                pending.done.set()
+            raise
+
+    def write_batch(self, change_index: str, batch: List[SimpleNamespace]) -> None:
+        try:
+            self.write_changes(change_index, [pending.change for pending in batch])
+            for pending in batch:
+                pending.recorded = True
+        except TransportError as error:
+            for pending in batch:
+                logger.warning("change %s of %s is not recorded: %s", pending.change["action"],
+                               pending.change["id"], error)
+        finally:
+            for pending in batch:
+                pending.done.set()
+        self.notify(change_index)
+
+    def write_changes(self, change_index: str, changes: List[Dict]) -> None:
+        """Give the changes a block of consecutive sequence numbers and index them in one request."""
+        last_seq = self.next_seq(change_index, count=len(changes))
+        if len(changes) == 1:
+            changes[0]["seq"] = last_seq
+            self.es.index(index=change_index, doc_type="change", id=str(last_seq), body=changes[0])
+            return None
+        body = []
+        for seq, change in enumerate(changes, start=last_seq - len(changes) + 1):
+            change["seq"] = seq
+            body.append({"index": {"_index": change_index, "_type": "change", "_id": str(seq)}})
+            body.append(change)
+        self.es.bulk(body=body)
+
+    def record_bulk(self, index: str, annotations: List[Dict], annotation_type: str, action: str) -> None:
+        if not annotations:
+            return None
+        try:
+            change_index = self.ensure_index(index)
+            self.write_changes(change_index, [make_change(None, annotation["id"], annotation_type, action,
+                                                          annotation.get("permissions"))
+                                              for annotation in annotations])
+        except TransportError as error:
+            logger.warning("%s changes %s are not recorded: %s", len(annotations), action, error)
+            return None
+        self.notify(change_index)
+
+    def notify(self, change_index: str) -> None:
+        with self.index_lock:
+            self.unrefreshed.add(change_index)
+        with self.changed:
+            self.changed.notify_all()
+
+    def read(self, index: str, since: int, limit: int) -> Tuple[List[Dict], int]:
+        """Return the changes after the since sequence number, up to the first gap that is younger
+        than the gap timeout, and the sequence number to continue from."""
+        change_index = self.ensure_index(index)
+        with self.index_lock:
+            needs_refresh = change_index in self.unrefreshed
+            self.unrefreshed.discard(change_index)
+        if needs_refresh:
+            self.es.indices.refresh(index=change_index)
+        query = {
+            "query": {"range": {"seq": {"gt": since}}},
+            "sort": [{"seq": "asc"}],
+            "size": limit
+        }
+        response = self.es.search(index=change_index, body=query)
+        changes = []
+        last_seq = since
+        for hit in response["hits"]["hits"]:
+            change = hit["_source"]
+            if change["seq"] != last_seq + 1 and get_change_age(change) < self.gap_timeout:
+                # an earlier change may not be visible yet
+                break
+            changes.append(change)
+            last_seq = change["seq"]
+        return changes, last_seq
+
+    def get_changes(self, index: str, since: int, limit: int, username: Union[None, str] = None,
+                    groups: Union[None, List[str]] = None, wait: float = 0) -> Dict:
+        """Return the changes after the since sequence number that the user can see. If there are
+        none, wait up to the given number of seconds for new changes, unless the maximum number of
+        long-polls of this process are waiting already. The last sequence number includes changes
+        the user can't see, so the next request continues after them."""
+        changes, last_seq = self.read(index, since, limit)
+        visible = [clean_change(change) for change in changes if is_visible(change, username, groups)]
+        if visible or wait <= 0 or not self.waiting.acquire(blocking=False):
+            return {"changes": visible, "last_seq": last_seq}
+        try:
+            deadline = time.time() + wait
+            while not visible and time.time() < deadline:
+                with self.changed:
+                    # changes of other worker processes are only seen by polling
+                    self.changed.wait(min(self.poll_interval, deadline - time.time()))
+                changes, last_seq = self.read(index, last_seq, limit)
+                visible = [clean_change(change) for change in changes if is_visible(change, username, groups)]
+        finally:
+            self.waiting.release()
+        return {"changes": visible, "last_seq": last_seq}
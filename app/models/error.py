@@ -9,7 +9,7 @@ class InvalidUsage(Exception):
         self.message = message
         if status_code is not None:
             self.status_code = status_code
-            self.payload = payload
+        self.payload = payload
 
     def to_dict(self):
         rv = dict(self.payload or ())
@@ -25,7 +25,7 @@ class PermissionError(Exception):
         self.message = message
         if status_code is not None:
             self.status_code = status_code
-            self.payload = payload
+        self.payload = payload
 
     def to_dict(self):
         rv = dict(self.payload or ())
@@ -32,3 +32,66 @@ user_mapping = {
         }
     }
 }
+
+
+# Annotation bodies can be written in any language, so the analyzer only uses language independent
+# steps: unicode word boundaries, lowercasing, folding of diacritics (keeping the original token
+# for exact matches) and elision of articles like l' and d'.
+annotation_settings = {
+    "analysis": {
+        "filter": {
+            "scholarly_folding": {
+                "type": "asciifolding",
+                "preserve_original": True
+            },
+            "scholarly_elision": {
+                "type": "elision",
+                "articles_case": True,
+                "articles": ["l", "m", "t", "qu", "n", "s", "j", "d", "c", "dell", "dall", "nell", "sull",
+                             "jusqu", "quoiqu", "lorsqu", "puisqu"]
+            }
+        },
+        "analyzer": {
+            "scholarly_text": {
+                "type": "custom",
+                "tokenizer": "standard",
+                "filter": ["scholarly_elision", "lowercase", "scholarly_folding"]
+            }
+        }
+    }
+}
+
+annotation_mapping = {
+    "Annotation": {
+        "properties": {
+            # deleted annotations are replaced by tombstones with status "deleted" and a deletion timestamp
+            "status": {
+                "type": "keyword"
+            },
+            "deleted": {
+                "type": "date"
+            },
+            "body": {
+                "properties": {
+                    "value": {
+                        "type": "text",
+                        "analyzer": "scholarly_text",
+                        # store offsets to make highlighting fast for long bodies
+                        "index_options": "offsets",
+                        "fields": {
+                            "keyword": {
+                                "type": "keyword",
+                                "ignore_above": 256
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+annotation_index = {
+    "settings": annotation_settings,
+    "mappings": annotation_mapping
+}
\ No newline at end of file
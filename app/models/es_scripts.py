@@ -0,0 +1,57 @@
+from typing import Dict, List
+
+"""--------------- Painless scripts for partial updates ------------------"""
+
+# The scripts change collections in place in ES, so the items of large collections don't have to be
+# sent back and forth, and concurrent changes are applied to the latest version of the document.
+# A script that changes nothing sets the operation to noop, so no new version is written.
+
+update_items_source = """
+if (ctx._source.status == 'deleted') { ctx.op = 'noop'; return; }
+Set existing = new HashSet(ctx._source.items);
+int before = ctx._source.items.size();
+int added = 0;
+if (params.remove.size() > 0) {
+    Set remove = new HashSet(params.remove);
+    ctx._source.items.removeIf(id -> remove.contains(id));
+    existing.removeAll(remove);
+}
+for (String id : params.add) {
+    if (existing.add(id)) { ctx._source.items.add(id); added++; }
+}
+if (added == 0 && ctx._source.items.size() == before) { ctx.op = 'noop'; return; }
+ctx._source.total = ctx._source.items.size();
+ctx._source.modified = params.modified;
+if (params.permissions != null) { ctx._source.permissions = params.permissions; }
+"""
+
+update_metadata_source = """
+if (ctx._source.status == 'deleted') { ctx.op = 'noop'; return; }
+if (ctx._source.creator == params.creator && ctx._source.label == params.label) { ctx.op = 'noop'; return; }
+ctx._source.creator = params.creator;
+ctx._source.label = params.label;
+ctx._source.modified = params.modified;
+"""
+
+# hands out the next block of sequence numbers of the change feed, see models/change_feed.py
+increment_sequence_source = """
+ctx._source.last_seq += params.count;
+"""
+
+
+def make_script(source: str, params: Dict) -> Dict:
+    return {"source": source, "lang": "painless", "params": params}
+
+
+def make_update_items_script(add_ids: List[str], remove_ids: List[str], modified: str,
+                             permissions: Dict = None) -> Dict:
+    return make_script(update_items_source, {"add": add_ids, "remove": remove_ids, "modified": modified,
+                                             "permissions": permissions})
+
+
+def make_update_metadata_script(creator: str, label: str, modified: str) -> Dict:
+    return make_script(update_metadata_source, {"creator": creator, "label": label, "modified": modified})
+
+
+def make_increment_sequence_script(count: int = 1) -> Dict:
+    return make_script(increment_sequence_source, {"count": count})
@@ -0,0 +1,52 @@
+import uuid
+from models.error import UserError
+
+# Group ids share the can_see and can_edit lists of annotations with usernames, the prefix keeps
+# them apart. Usernames with this prefix can't be registered.
+group_prefix = "group:"
+
+
+def generate_group_id():
+    return group_prefix + uuid.uuid4().hex
+
+
+def is_group_id(principal):
+    return isinstance(principal, str) and principal.startswith(group_prefix)
+
+
+class Group(object):
+
+    def __init__(self, group_data):
+        if "name" not in group_data:
+            raise UserError(message="group_data must have property 'name'")
+        if "owner" not in group_data:
+            raise UserError(message="group_data must have property 'owner'")
+        if type(group_data["name"]) != str:
+            raise UserError(message="group name must be a string")
+        self.name = group_data["name"]
+        self.owner = group_data["owner"]
+        self.group_id = group_data["group_id"] if "group_id" in group_data else generate_group_id()
+        if not is_group_id(self.group_id):
+            raise UserError(message="group_id must start with '{p}'".format(p=group_prefix))
+        members = group_data["members"] if "members" in group_data else []
+        if not isinstance(members, list):
+            raise UserError(message="group members must be a list of usernames")
+        # the owner is always a member
+        self.members = list(dict.fromkeys([self.owner] + members))
+
+    def add_members(self, usernames):
+        self.members = list(dict.fromkeys(self.members + usernames))
+
+    def remove_members(self, usernames):
+        if self.owner in usernames:
+            raise UserError(message="Cannot remove the owner from a group")
+        self.members = [member for member in self.members if member not in usernames]
+
+    def json(self):
+        return {
+            "type": "group",
+            "group_id": self.group_id,
+            "name": self.name,
+            "owner": self.owner,
+            "members": self.members
+        }
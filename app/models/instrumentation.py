@@ -0,0 +1,200 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple, Union
+
+"""--------------- Instrumentation ------------------"""
+
+# Metrics are kept per process. With several worker processes, each worker reports its own
+# metrics on /metrics, so the scraper should aggregate over the workers.
+
+default_buckets = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+class Histogram(object):
+
+    def __init__(self, buckets: List[float] = None):
+        self.buckets = buckets if buckets else default_buckets
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry(object):
+    """Counters and histograms with labels, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[Tuple, float]] = {}
+        self.histograms: Dict[str, Dict[Tuple, Histogram]] = {}
+        self.help: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def describe(self, name: str, description: str) -> None:
+        self.help[name] = description
+
+    def inc(self, name: str, labels: Dict[str, str] = None, value: float = 1) -> None:
+        key = tuple(sorted(labels.items())) if labels else ()
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Dict[str, str] = None) -> None:
+        key = tuple(sorted(labels.items())) if labels else ()
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                if name in self.help:
+                    lines.append("# HELP {n} {h}".format(n=name, h=self.help[name]))
+                lines.append("# TYPE {n} counter".format(n=name))
+                for key, value in sorted(series.items()):
+                    lines.append("{n}{l} {v}".format(n=name, l=format_labels(key), v=value))
+            for name, series in sorted(self.histograms.items()):
+                if name in self.help:
+                    lines.append("# HELP {n} {h}".format(n=name, h=self.help[name]))
+                lines.append("# TYPE {n} histogram".format(n=name))
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bucket, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        bucket_key = key + (("le", str(bucket)),)
+                        lines.append("{n}_bucket{l} {c}".format(n=name, l=format_labels(bucket_key), c=cumulative))
+                    lines.append("{n}_sum{l} {s}".format(n=name, l=format_labels(key), s=histogram.sum))
+                    lines.append("{n}_count{l} {c}".format(n=name, l=format_labels(key), c=histogram.count))
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(key: Tuple) -> str:
+    if not key:
+        return ""
+    labels = ",".join('{k}="{v}"'.format(k=label, v=str(value).replace('"', '\\"')) for label, value in key)
+    return "{" + labels + "}"
+
+
+metrics = MetricsRegistry()
+metrics.describe("swa_es_requests_total", "Number of Elasticsearch calls per operation")
+metrics.describe("swa_es_request_duration_seconds", "Latency of Elasticsearch calls per operation")
+metrics.describe("swa_section_duration_seconds", "Time spent in sections of request handling")
+metrics.describe("swa_request_duration_seconds", "Latency of API requests per endpoint")
+metrics.describe("swa_request_es_calls", "Number of Elasticsearch calls per API request")
+
+
+class RequestTimings(object):
+    """ES calls and section timings of a single request, reported in the Server-Timing header."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.es_calls = 0
+        self.es_time = 0.0
+        self.sections: Dict[str, float] = {}
+
+    def add_section(self, section: str, duration: float) -> None:
+        self.sections[section] = self.sections.get(section, 0.0) + duration
+
+    def duration(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        timings = ['es;dur={d:.2f};desc="{c} calls"'.format(d=self.es_time * 1000, c=self.es_calls)]
+        for section, duration in self.sections.items():
+            timings.append("{s};dur={d:.2f}".format(s=section, d=duration * 1000))
+        timings.append("total;dur={d:.2f}".format(d=self.duration() * 1000))
+        return ", ".join(timings)
+
+
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+
+def start_request() -> contextvars.Token:
+    return current_timings.set(RequestTimings())
+
+
+def finish_request(token: contextvars.Token, endpoint: str, method: str) -> Union[None, RequestTimings]:
+    timings = current_timings.get()
+    current_timings.reset(token)
+    if timings is None:
+        return None
+    labels = {"endpoint": str(endpoint), "method": method}
+    metrics.observe("swa_request_duration_seconds", timings.duration(), labels)
+    metrics.observe("swa_request_es_calls", timings.es_calls, labels)
+    return timings
+
+
+@contextmanager
+def timed(section: str):
+    """Time a section of request handling, e.g. validation, permissions or serialization."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        metrics.observe("swa_section_duration_seconds", duration, {"section": section})
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add_section(section, duration)
+
+
+def record_es_call(operation: str, duration: float, kwargs: Dict = None, response=None, error=None) -> None:
+    metrics.inc("swa_es_requests_total", {"operation": operation})
+    metrics.observe("swa_es_request_duration_seconds", duration, {"operation": operation})
+    timings = current_timings.get()
+    if timings is not None:
+        timings.es_calls += 1
+        timings.es_time += duration
+
+
+class InstrumentedElasticsearch(object):
+    """Wraps an ES client (or one of its namespaced clients, like indices) and calls the hooks
+    after each call made through it, with the operation, its duration, the keyword arguments and
+    the response or error. By default, the only hook records the number and latency of the calls."""
+
+    def __init__(self, client, hooks: List[Callable] = None, prefix: str = ""):
+        self.client = client
+        self.hooks = hooks if hooks is not None else [record_es_call]
+        self.prefix = prefix
+
+    def with_hook(self, hook: Callable) -> "InstrumentedElasticsearch":
+        """Return a wrapper of the same client that also calls the given hook."""
+        return InstrumentedElasticsearch(self.client, hooks=self.hooks + [hook], prefix=self.prefix)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name in ["indices", "cluster", "nodes", "cat", "ingest", "tasks"]:
+            return InstrumentedElasticsearch(attribute, hooks=self.hooks, prefix=self.prefix + name + ".")
+        if not callable(attribute) or name.startswith("_"):
+            return attribute
+        operation = self.prefix + name
+
+        def instrumented_call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                response = attribute(*args, **kwargs)
+            except Exception as error:
+                self.call_hooks(operation, time.perf_counter() - start, kwargs, error=error)
+                raise
+            self.call_hooks(operation, time.perf_counter() - start, kwargs, response=response)
+            return response
+
+        return instrumented_call
+
+    def call_hooks(self, operation: str, duration: float, kwargs: Dict, response=None, error=None) -> None:
+        for hook in self.hooks:
+            hook(operation, duration, kwargs, response=response, error=error)
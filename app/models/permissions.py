@@ -1,57 +1,118 @@
+from typing import FrozenSet, List, NamedTuple, Union
 from models.error import PermissionError, InvalidUsage
 
 
-def is_allowed_action(username, action, annotation):
-    if action == "traverse":  # traversing chained annotations requires no permissions
-        return True
-    if action == "see":
-        return is_allowed_to_see(username, annotation)
-    if action == "edit":
-        return is_allowed_to_edit(username, annotation)
+class PermissionSets(NamedTuple):
+    """The permissions of an annotation (or collection) as sets, so checking a user is a lookup
+    instead of a scan of the can_see and can_edit lists."""
+    source: Union[None, dict]
+    access_status: FrozenSet[str]
+    owner: Union[None, str]
+    can_see: FrozenSet[str]
+    can_edit: FrozenSet[str]
 
 
-def is_allowed_to_see(username, annotation):
-    if not username:
-        return is_public(annotation)
-    if is_public(annotation):
+def as_frozenset(values) -> FrozenSet[str]:
+    if not values:
+        return frozenset()
+    if isinstance(values, str):
+        return frozenset([values])
+    return frozenset(values)
+
+
+def make_permission_sets(permissions: Union[None, dict]) -> PermissionSets:
+    if not permissions:
+        return PermissionSets(permissions, frozenset(), None, frozenset(), frozenset())
+    return PermissionSets(permissions,
+                          as_frozenset(permissions["access_status"]),
+                          permissions["owner"] if "owner" in permissions else None,
+                          as_frozenset(permissions["can_see"]) if "can_see" in permissions else frozenset(),
+                          as_frozenset(permissions["can_edit"]) if "can_edit" in permissions else frozenset())
+
+
+def set_permission_sets(annotation) -> PermissionSets:
+    permission_sets = make_permission_sets(annotation.permissions)
+    try:
+        annotation.permission_sets = permission_sets
+    except AttributeError:
+        pass
+    return permission_sets
+
+
+def get_permission_sets(annotation) -> PermissionSets:
+    """Return the permission sets of the annotation, made when it was loaded. They are remade when the
+    permissions were replaced since, changes in place must go through add_permissions."""
+    permission_sets = getattr(annotation, "permission_sets", None)
+    if permission_sets is None or permission_sets.source is not annotation.permissions:
+        return set_permission_sets(annotation)
+    return permission_sets
+
+
+def is_shared_with(principals: FrozenSet[str], username: Union[None, str], groups=None) -> bool:
+    if username in principals:
         return True
-    if is_owned_by(annotation, username):
+    return bool(groups) and not principals.isdisjoint(groups)
+
+
+def can_see(username: Union[None, str], permission_sets: PermissionSets, groups=None) -> bool:
+    if "public" in permission_sets.access_status:
         return True
-    if is_see_shared_with(annotation, username):
+    if not username:
+        return False
+    if permission_sets.owner == username:
         return True
-    return False
+    return "shared" in permission_sets.access_status and is_shared_with(permission_sets.can_see, username, groups)
 
 
-def is_allowed_to_edit(username, annotation):
+def can_edit(username: Union[None, str], permission_sets: PermissionSets, groups=None) -> bool:
     if not username:  # anonymous users are not allowed to edit
         return False
-    if is_public(annotation) and not is_owned_by(annotation, username):  # only owner can edit public annotation
-        return False
-    if is_owned_by(annotation, username):
+    if permission_sets.owner == username:
         return True
-    if is_edit_shared_with(annotation, username):
+    if "public" in permission_sets.access_status:  # only owner can edit public annotation
+        return False
+    return "shared" in permission_sets.access_status and is_shared_with(permission_sets.can_edit, username, groups)
+
+
+action_checks = {
+    "see": can_see,
+    "edit": can_edit
+}
+
+
+def get_groups(params) -> Union[None, List[str]]:
+    """Return the ids of the groups of the requesting user, that annotations can be shared with."""
+    return params["groups"] if params and "groups" in params else None
+
+
+def is_allowed_action(username, action, annotation, groups=None):
+    if action == "traverse":  # traversing chained annotations requires no permissions
         return True
-    return False
+    if action not in action_checks:
+        return None
+    return action_checks[action](username, get_permission_sets(annotation), groups=groups)
+
+
+def is_allowed_to_see(username, annotation, groups=None):
+    return can_see(username, get_permission_sets(annotation), groups=groups)
+
+
+def is_allowed_to_edit(username, annotation, groups=None):
+    return can_edit(username, get_permission_sets(annotation), groups=groups)
 
 
 def is_owned_by(annotation, username):
-    return annotation.permissions["owner"] == username
+    return get_permission_sets(annotation).owner == username
 
 
-def is_see_shared_with(annotation, username):
-    if not is_shared(annotation):
-        return False
-    if "can_see" not in annotation.permissions:
-        return False
-    return username in annotation.permissions["can_see"]
+def is_see_shared_with(annotation, username, groups=None):
+    permission_sets = get_permission_sets(annotation)
+    return "shared" in permission_sets.access_status and is_shared_with(permission_sets.can_see, username, groups)
 
 
-def is_edit_shared_with(annotation, username):
-    if not is_shared(annotation):
-        return False
-    if "can_edit" not in annotation.permissions:
-        return False
-    return username in annotation.permissions["can_edit"]
+def is_edit_shared_with(annotation, username, groups=None):
+    permission_sets = get_permission_sets(annotation)
+    return "shared" in permission_sets.access_status and is_shared_with(permission_sets.can_edit, username, groups)
 
 
 def is_private(annotation):
@@ -74,6 +135,7 @@ def add_permissions(annotation, params):
     else:
         update_permissions_of_existing_annotation(annotation, params)
     add_share_permissions(annotation, params)
+    set_permission_sets(annotation)
     return annotation
 
 
@@ -107,7 +169,8 @@ def add_share_permissions(annotation, params):
     # private and public annotations have a no share details
     if not is_shared(annotation):
         return True
-    # only set can_see and can_edit permissions when they are passed as params
+    # only set can_see and can_edit permissions when they are passed as params, they list
+    # usernames and ids of groups
     if "can_see" in params:
         if not isinstance(params["can_see"], list):
             raise PermissionError("can_see parameter must have a list as value")
@@ -116,7 +179,7 @@ def add_share_permissions(annotation, params):
         if not isinstance(params["can_edit"], list):
             raise PermissionError("can_edit parameter must have a list as value")
         annotation.permissions["can_edit"] = params["can_edit"]
-        # make sure users who can edit are also in can_see list
+        # make sure users and groups who can edit are also in can_see list
         for user in params["can_edit"]:
             if user not in annotation.permissions["can_see"]:
                 annotation.permissions["can_see"] += [user]
@@ -0,0 +1,144 @@
+import cProfile
+import hmac
+import io
+import itertools
+import marshal
+import pstats
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Union
+
+"""--------------- Profiling of single requests ------------------"""
+
+# A request is only profiled when it carries the profiling token of the settings, so a slow
+# production request can be profiled without redeploying. Without a token in the settings, the
+# profiling hooks are not registered at all.
+
+# the code paths that the aggregated hot frames are limited to
+default_profile_modules = ["models/annotation_store.py", "models/annotation.py", "models/annotation_container.py",
+                           "models/permissions.py"]
+
+
+def is_valid_token(given_token: Union[None, str], profiling_token: Union[None, str]) -> bool:
+    if not given_token or not profiling_token:
+        return False
+    return hmac.compare_digest(given_token.encode("utf-8"), profiling_token.encode("utf-8"))
+
+
+def format_function(function: Tuple[str, int, str]) -> str:
+    filename, line_number, function_name = function
+    return "{f}:{l}({n})".format(f=filename, l=line_number, n=function_name)
+
+
+def get_hot_frames(stats: pstats.Stats, modules: Union[None, List[str]] = None, limit: int = 30) -> List[Dict]:
+    """Return the functions with the highest cumulative time, optionally only those of the given modules."""
+    frames = []
+    for function, (primitive_calls, calls, total_time, cumulative_time, _) in stats.stats.items():
+        if modules and not any(function[0].endswith(module) for module in modules):
+            continue
+        frames.append({
+            "function": format_function(function),
+            "calls": calls,
+            "primitive_calls": primitive_calls,
+            "total_time": total_time,
+            "cumulative_time": cumulative_time
+        })
+    frames.sort(key=lambda frame: frame["cumulative_time"], reverse=True)
+    return frames[:limit]
+
+
+class RequestProfile(object):
+
+    def __init__(self, profile_id: int, method: str, path: str, endpoint: str, duration: float,
+                 stats: pstats.Stats):
+        self.profile_id = profile_id
+        self.method = method
+        self.path = path
+        self.endpoint = endpoint
+        self.duration = duration
+        self.created = time.time()
+        self.stats = stats
+
+    def summary(self) -> Dict:
+        return {
+            "id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "endpoint": self.endpoint,
+            "duration": self.duration,
+            "created": self.created
+        }
+
+    def dump(self) -> bytes:
+        # the format of pstats.Stats.dump_stats, which tools like snakeviz can read
+        return marshal.dumps(self.stats.stats)
+
+
+class ProfileStore(object):
+    """Keeps the profiles of the most recent profiled requests and the stats of all profiled requests
+    aggregated, per process. Only one request at a time is profiled, as the profiler of one thread
+    would otherwise interfere with that of another."""
+
+    def __init__(self, max_profiles: int = 20, modules: Union[None, List[str]] = None):
+        self.max_profiles = max_profiles
+        self.modules = modules if modules is not None else default_profile_modules
+        self.profiles: Dict[int, RequestProfile] = OrderedDict()
+        self.aggregate: Union[None, pstats.Stats] = None
+        self.num_profiled = 0
+        self.profile_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.profiling = threading.Lock()
+
+    def start(self) -> Union[None, cProfile.Profile]:
+        if not self.profiling.acquire(blocking=False):
+            # another request is being profiled
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is active in this process
+            self.profiling.release()
+            return None
+        return profiler
+
+    def stop(self, profiler: cProfile.Profile, method: str, path: str, endpoint: str,
+             duration: float) -> RequestProfile:
+        profiler.disable()
+        self.profiling.release()
+        stats = pstats.Stats(profiler, stream=io.StringIO())
+        with self.lock:
+            profile = RequestProfile(next(self.profile_ids), method, path, endpoint, duration, stats)
+            self.profiles[profile.profile_id] = profile
+            if len(self.profiles) > self.max_profiles:
+                self.profiles.popitem(last=False)
+            if self.aggregate is None:
+                self.aggregate = pstats.Stats(profiler, stream=io.StringIO())
+            else:
+                self.aggregate.add(profiler)
+            self.num_profiled += 1
+        return profile
+
+    def get_profile(self, profile_id: int) -> Union[None, RequestProfile]:
+        with self.lock:
+            return self.profiles.get(profile_id)
+
+    def list_profiles(self) -> List[Dict]:
+        with self.lock:
+            return [profile.summary() for profile in reversed(self.profiles.values())]
+
+    def hot_frames(self, all_modules: bool = False, limit: int = 30) -> List[Dict]:
+        with self.lock:
+            if self.aggregate is None:
+                return []
+            return get_hot_frames(self.aggregate, None if all_modules else self.modules, limit)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.profiles = OrderedDict()
+            self.aggregate = None
+            self.num_profiled = 0
+
+
+profiles = ProfileStore()
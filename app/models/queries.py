@@ -1,4 +1,7 @@
-from typing import Dict, List
+import base64
+import json
+from functools import lru_cache
+from typing import Dict, List, Union
 
 
 def bool_must(queries):
@@ -7,6 +10,14 @@ def bool_must(queries):
     return {"bool": {"must": queries}}
 
 
+def bool_filter(queries, must=None):
+    if not isinstance(queries, list):
+        raise TypeError("queries parameter must be a list of queries")
+    if must:
+        return {"bool": {"must": must, "filter": queries}}
+    return {"bool": {"filter": queries}}
+
+
 def bool_should(queries):
     if not isinstance(queries, list):
         raise TypeError("queries parameter must be a list of queries")
@@ -26,6 +37,61 @@ def make_param_filter_queries(params, annotation_type: str = "_all") -> List[Dic
     return filter_queries
 
 
+def make_search_filter_queries(params, annotation_type: str = "_all") -> List[Dict[str, any]]:
+    filter_queries = make_param_filter_queries(params, annotation_type)
+    filter_queries += [make_permission_see_query(params)]
+    return filter_queries
+
+
+def make_text_query(text: str) -> Dict[str, any]:
+    # simple_query_string never fails on syntax errors in user input
+    return {"simple_query_string": {"query": text, "fields": ["body.value"], "default_operator": "and"}}
+
+
+def make_search_query(params, annotation_type: str = "_all") -> Dict[str, any]:
+    """Make the query for the request parameters. Filters and permissions are applied in filter context,
+    only the full-text query (if any) contributes to scoring."""
+    filter_queries = make_search_filter_queries(params, annotation_type)
+    if "query" in params and params["query"]:
+        return bool_filter(filter_queries, must=[make_text_query(params["query"])])
+    return bool_filter(filter_queries)
+
+
+def make_paged_query(params, default_page_size: int, annotation_type: str = "_all",
+                     source_filter: Union[None, Dict[str, List[str]]] = None, highlight: bool = False):
+    page_size = params["page_size"] if "page_size" in params else default_page_size
+    query = {
+        "from": params["page"] * page_size,
+        "size": page_size,
+        "sort": make_sort_order(params),
+        "query": make_search_query(params, annotation_type),
+        # the total of a container comes from the search, so it should be exact beyond 10,000 hits
+        "track_total_hits": True
+    }
+    if "cursor" in params and params["cursor"] is not None:
+        # cursor based paging continues after the sort values of the last hit of the previous page
+        query["from"] = 0
+        if len(params["cursor"]) > 0:
+            query["search_after"] = params["cursor"]
+    if source_filter:
+        query["_source"] = source_filter
+    if highlight:
+        query["highlight"] = make_highlight()
+    return query
+
+
+def make_aggregation_query(params, annotation_type: str = "_all"):
+    return {
+        "size": 0,
+        "query": make_search_query(params, annotation_type),
+        "aggs": make_facet_aggregations(params["facets"], params["facet_size"])
+    }
+
+
+def make_highlight():
+    return {"fields": {"body.value": {}}}
+
+
 def permission_match(field, value):
     field = "permissions.{f}".format(f=field)
     return {"match": {field, value}}
@@ -39,39 +105,70 @@ def owner_match(value):
     return {"match": {"permissions.owner": value}}
 
 
-def can_see_match(value):
-    return {"match": {"permissions.can_see": value}}
+def can_see_match(principals):
+    return {"terms": {"permissions.can_see.keyword": list(principals)}}
+
+
+def can_edit_match(principals):
+    return {"terms": {"permissions.can_edit.keyword": list(principals)}}
 
 
-def can_edit_match(value):
-    return {"match": {"permissions.can_edit": value}}
+def make_principals(username: str, groups: frozenset) -> List[str]:
+    # the user and the groups the user is a member of, which annotations can be shared with
+    return [username] + sorted(groups)
 
 
 def private_match(username):
     return bool_must([access_match("private"), owner_match(username)])
 
 
-def shared_see_match(username):
-    return bool_must([access_match("shared"), bool_should([owner_match(username), can_see_match(username)])])
+def shared_see_match(username, groups: frozenset = frozenset()):
+    principals = make_principals(username, groups)
+    return bool_must([access_match("shared"), bool_should([owner_match(username), can_see_match(principals)])])
 
 
-def shared_edit_match(username):
-    return bool_must([access_match("shared"), can_edit_match(username)])
+def shared_edit_match(username, groups: frozenset = frozenset()):
+    return bool_must([access_match("shared"), can_edit_match(make_principals(username, groups))])
+
+
+def groups_key(params) -> frozenset:
+    return frozenset(params["groups"]) if "groups" in params and params["groups"] else frozenset()
+
+
+def access_status_key(access_status) -> frozenset:
+    if not access_status:
+        return frozenset()
+    if isinstance(access_status, str):
+        return frozenset([access_status])
+    return frozenset(access_status)
 
 
 def make_permission_see_query(params):
-    if not params["username"]:
+    """Return the see permission fragment for the user, groups and access status of the request.
+    Fragments are memoized and shared between requests, so callers must not modify them."""
+    return make_user_see_query(params["username"], access_status_key(params["access_status"]), groups_key(params))
+
+
+def make_permission_edit_query(params):
+    """Return the edit permission fragment for the user, groups and access status of the request.
+    Fragments are memoized and shared between requests, so callers must not modify them."""
+    return make_user_edit_query(params["username"], access_status_key(params["access_status"]), groups_key(params))
+
+
+@lru_cache(maxsize=4096)
+def make_user_see_query(username: Union[None, str], access_status: frozenset, groups: frozenset = frozenset()):
+    if not username:
         # without username, anonymous access so must be public
         return access_match("public")
-    if params["username"] and not params["access_status"]:
+    if username and not access_status:
         # username without explicit access_status is assumed private access
-        return private_match(params["username"])
+        return private_match(username)
     access_matches = []
-    if "private" in params["access_status"]:
-        access_matches += [private_match(params["username"])]
-    if "shared" in params["access_status"]:
-        access_matches += [shared_see_match(params["username"])]
-    if "public" in params["access_status"]:
+    if "private" in access_status:
+        access_matches += [private_match(username)]
+    if "shared" in access_status:
+        access_matches += [shared_see_match(username, groups)]
+    if "public" in access_status:
         access_matches += [access_match("public")]
     if len(access_matches) == 1:
         # avoid should being interpreted as boost
@@ -80,13 +177,14 @@ def make_permission_see_query(params):
         return bool_should(access_matches)
 
 
-def make_permission_edit_query(params):
+@lru_cache(maxsize=4096)
+def make_user_edit_query(username: Union[None, str], access_status: frozenset, groups: frozenset = frozenset()):
     access_matches = []
-    if "private" in params["access_status"]:
-        access_matches += [private_match(params["username"])]
-    if "shared" in params["access_status"]:
-        access_matches += [shared_edit_match(params["username"])]
-    if "public" in params["access_status"]:
+    if "private" in access_status:
+        access_matches += [private_match(username)]
+    if "shared" in access_status:
+        access_matches += [shared_edit_match(username, groups)]
+    if "public" in access_status:
         access_matches += [access_match("public")]
     if len(access_matches) == 1:
         # avoid should being interpreted as boost
@@ -95,6 +193,22 @@ def make_permission_edit_query(params):
         return bool_should(access_matches)
 
 
+def make_ids_query(ids):
+    return {"ids": {"values": ids}}
+
+
+def make_tombstone_query():
+    return {"term": {"status": "deleted"}}
+
+
+def make_expired_tombstone_query(retention):
+    # tombstones that were deleted longer than the retention period ago (e.g. "30d")
+    return bool_filter([
+        make_tombstone_query(),
+        {"range": {"deleted": {"lt": "now-%s" % retention}}}
+    ])
+
+
 def make_target_list_query(target):
     target_field = list(target.keys())[0]
     list_field = "target_list.%s.keyword" % target_field
@@ -102,3 +216,67 @@ def make_target_list_query(target):
         return {"match": {list_field: target[target_field]}}
     elif type(target[target_field]) == list:
         return bool_should([{"match": {list_field: target_item}} for target_item in target[target_field]])
+
+
+def make_source_filter(params) -> Dict[str, List[str]]:
+    """Determine which parts of the annotation source ES should return, based on the requested view
+    and fields. Internal fields are only returned when explicitly asked for."""
+    if "fields" in params and params["fields"]:
+        return {"includes": ["id", "type"] + [field for field in params["fields"] if field not in ["id", "type"]]}
+    if "view" in params and params["view"] in ["PreferMinimalContainer", "PreferContainedIRIs"]:
+        # IRI-only views need nothing but the id (and type to recognise the annotation)
+        return {"includes": ["id", "type"]}
+    excludes = ["target_list"]
+    if "include_permissions" not in params or not params["include_permissions"]:
+        excludes += ["permissions"]
+    return {"excludes": excludes}
+
+
+def make_collection_source_filter(params) -> Dict[str, List[str]]:
+    if "include_permissions" in params and params["include_permissions"]:
+        return {"excludes": []}
+    return {"excludes": ["permissions"]}
+
+
+facet_fields = {
+    "target_id": "target_list.id.keyword",
+    "target_type": "target_list.type.keyword",
+    "motivation": "motivation.keyword",
+    "creator": "creator.keyword",
+    "created": "created"
+}
+
+
+def make_facet_aggregations(facets: List[str], facet_size: int = 10) -> Dict[str, any]:
+    aggregations = {}
+    for facet in facets:
+        if facet not in facet_fields:
+            raise ValueError("unknown facet {f}".format(f=facet))
+        if facet == "created":
+            # count annotations per day of creation
+            aggregations[facet] = {"date_histogram": {"field": facet_fields[facet], "calendar_interval": "day",
+                                                      "format": "yyyy-MM-dd", "min_doc_count": 1}}
+        else:
+            aggregations[facet] = {"terms": {"field": facet_fields[facet], "size": facet_size}}
+    return aggregations
+
+
+def make_sort_order(params=None):
+    # sort on a unique field so pages and search_after cursors are stable
+    if params and "query" in params and params["query"]:
+        return [{"_score": "desc"}, {"id.keyword": "asc"}]
+    return [{"id.keyword": "asc"}]
+
+
+def encode_cursor(sort_values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(sort_values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Union[None, list]:
+    try:
+        sort_values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(sort_values, list):
+        return None
+    return sort_values
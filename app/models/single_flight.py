@@ -0,0 +1,35 @@
+import threading
+from types import SimpleNamespace
+from typing import Callable, Dict
+
+
+class SingleFlight(object):
+    """Runs at most one call per key at a time. Threads that ask for a key while its call is still
+    running wait for that call instead of starting their own, and get its exception if it fails.
+    The in-memory indexes of the annotation store use this to load the data of an index once,
+    when several request threads find it missing or stale at the same time."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights: Dict[str, SimpleNamespace] = {}
+
+    def run(self, key: str, call: Callable[[], None]) -> None:
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = SimpleNamespace(done=threading.Event(), error=None)
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return None
+        try:
+            call()
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
@@ -0,0 +1,145 @@
+import contextvars
+import datetime
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Union
+import pytz
+import models.tenant as tenant
+
+"""--------------- Slow query log ------------------"""
+
+# ES calls of the annotation store that take longer than the threshold are logged as JSON lines,
+# with the query body, the request parameters it was made for, the number of hits and the time
+# ES itself took. Entries are sampled and rate limited, so a slow cluster doesn't flood the log.
+
+logger = logging.getLogger("swa.slow_queries")
+
+# the request parameters that are logged, the rest (e.g. view) doesn't change the query
+logged_params = ["username", "groups", "access_status", "can_see", "can_edit", "filter", "query", "page", "page_size",
+                 "cursor", "facets", "facet_size", "all_projects"]
+
+# only the bodies of queries are logged, the bodies of writes are whole annotations with their permissions
+logged_body_operations = ["search", "count"]
+
+current_params = contextvars.ContextVar("slow_query_params", default=None)
+
+
+@contextmanager
+def request_params(params):
+    """Make the request parameters part of the entries of slow ES calls made in this context."""
+    token = current_params.set(params)
+    try:
+        yield
+    finally:
+        current_params.reset(token)
+
+
+def get_hit_count(response) -> Union[None, int]:
+    if not isinstance(response, dict):
+        return None
+    if "hits" in response:
+        total = response["hits"]["total"]
+        return total["value"] if isinstance(total, dict) else total
+    if "count" in response:
+        return response["count"]
+    if "docs" in response:
+        return len([doc for doc in response["docs"] if doc.get("found")])
+    if "deleted" in response:
+        return response["deleted"]
+    return None
+
+
+class SlowQueryLog(object):
+
+    def __init__(self, threshold: float, sample_rate: float = 1.0, rate_limit: int = 60,
+                 log_file: Union[None, str] = None):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        # maximum number of entries per minute
+        self.rate_limit = rate_limit
+        self.window_start = time.time()
+        self.window_entries = 0
+        self.suppressed = 0
+        self.lock = threading.Lock()
+        if log_file:
+            add_file_handler(log_file)
+
+    def is_slow(self, duration: float) -> bool:
+        return duration >= self.threshold
+
+    def allow_entry(self) -> Union[None, int]:
+        """Return the number of entries suppressed since the last entry, or None if this entry
+        is not sampled or exceeds the rate limit."""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return None
+        with self.lock:
+            now = time.time()
+            if now - self.window_start >= 60:
+                self.window_start = now
+                self.window_entries = 0
+            if self.window_entries >= self.rate_limit:
+                self.suppressed += 1
+                return None
+            self.window_entries += 1
+            suppressed, self.suppressed = self.suppressed, 0
+            return suppressed
+
+    def make_entry(self, operation: str, duration: float, kwargs: Dict, response=None, error=None) -> Dict:
+        entry = {
+            "timestamp": datetime.datetime.now(pytz.utc).isoformat(),
+            "operation": operation,
+            "duration_ms": round(duration * 1000, 2),
+            "index": kwargs.get("index"),
+            "project": tenant.get_project()
+        }
+        if "body" in kwargs and operation in logged_body_operations:
+            entry["body"] = kwargs["body"]
+        if "id" in kwargs:
+            entry["id"] = kwargs["id"]
+        params = current_params.get()
+        if params:
+            entry["params"] = {param: params[param] for param in logged_params if param in params}
+        if isinstance(response, dict):
+            entry["hits"] = get_hit_count(response)
+            if "took" in response:
+                entry["took_ms"] = response["took"]
+        if error is not None:
+            entry["error"] = str(error)
+        return entry
+
+    def record(self, operation: str, duration: float, kwargs: Dict, response=None, error=None) -> None:
+        """Log the call if it is slow, as a hook of InstrumentedElasticsearch."""
+        if not self.is_slow(duration):
+            return None
+        suppressed = self.allow_entry()
+        if suppressed is None:
+            return None
+        entry = self.make_entry(operation, duration, kwargs, response=response, error=error)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        logger.warning(json.dumps(entry, default=str))
+
+
+def add_file_handler(log_file: str) -> None:
+    for handler in logger.handlers:
+        if isinstance(handler, logging.FileHandler) and handler.baseFilename.endswith(log_file):
+            return None
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+
+
+def make_slow_query_log(es_config: Dict) -> Union[None, SlowQueryLog]:
+    """Return the slow query log of the settings, or None if it is disabled."""
+    threshold = es_config["slow_query_threshold_ms"] if "slow_query_threshold_ms" in es_config else None
+    if threshold is None or threshold < 0:
+        return None
+    return SlowQueryLog(threshold / 1000,
+                        sample_rate=es_config["slow_query_sample_rate"]
+                        if "slow_query_sample_rate" in es_config else 1.0,
+                        rate_limit=es_config["slow_query_rate_limit"] if "slow_query_rate_limit" in es_config else 60,
+                        log_file=es_config["slow_query_log_file"] if "slow_query_log_file" in es_config else None)
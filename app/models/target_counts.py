@@ -0,0 +1,265 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Set, Tuple, Union
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import scan
+import models.queries as query_helper
+from models.change_feed import ChangeFeed, get_change_age
+from models.single_flight import SingleFlight
+
+# the parts of an annotation that determine where and for whom it is counted
+counted_fields = ["id", "type", "status", "target_list.id", "permissions"]
+
+
+def get_access_keys(permissions: Union[None, Dict]) -> Tuple[str, ...]:
+    """Return the keys an annotation is counted under: public annotations once for everyone,
+    private annotations for their owner and shared annotations for their owner and for every
+    user and group they are shared with."""
+    if not permissions:
+        return ()
+    access_status = permissions["access_status"] or []
+    if isinstance(access_status, str):
+        access_status = [access_status]
+    keys = []
+    if "public" in access_status:
+        keys.append("public")
+    if "private" in access_status:
+        keys.append("private:" + permissions["owner"])
+    if "shared" in access_status:
+        principals = [permissions["owner"]] + (permissions["can_see"] if "can_see" in permissions else [])
+        keys += ["shared:" + principal for principal in dict.fromkeys(principals)]
+    return tuple(keys)
+
+
+def get_counted_target_ids(annotation: Dict) -> Tuple[str, ...]:
+    if "target_list" not in annotation or not annotation["target_list"]:
+        return ()
+    return tuple(dict.fromkeys(target["id"] for target in annotation["target_list"]))
+
+
+def is_counted(annotation: Dict) -> bool:
+    if "status" in annotation and annotation["status"] == "deleted":
+        return False
+    return annotation["type"] == "Annotation"
+
+
+def get_requested_keys(username: Union[None, str], groups: Union[None, List[str]],
+                       access_status: Union[None, List[str]]) -> Dict[str, List[str]]:
+    """Return the keys to add up per access level, for the same access levels as the see query."""
+    if not username:
+        # anonymous access only sees public annotations
+        return {"public": ["public"]}
+    if not access_status:
+        # username without explicit access_status is assumed private access
+        access_status = ["private"]
+    elif isinstance(access_status, str):
+        access_status = [access_status]
+    keys = {}
+    if "private" in access_status:
+        keys["private"] = ["private:" + username]
+    if "shared" in access_status:
+        keys["shared"] = ["shared:" + principal for principal in [username] + (groups or [])]
+    if "public" in access_status:
+        keys["public"] = ["public"]
+    return keys
+
+
+def count_distinct(keyed_ids: Dict[str, Set[str]], keys: List[str]) -> Set[str]:
+    if len(keys) == 1:
+        return keyed_ids.get(keys[0], set())
+    return set().union(*[keyed_ids[key] for key in keys if key in keyed_ids])
+
+
+class TargetCounts(object):
+    """In-memory counts of the annotations per target id and access level, per index, so the number
+    of annotations on thousands of targets doesn't need a query per target. The ids of the annotations
+    on a target are kept per access key, so an annotation that a user can see in several ways, e.g.
+    shared with the user and with one of their groups, is counted once.
+
+    The annotations of an index are loaded with a scroll on first use and updated on every write
+    of an annotation. Writes of other worker processes are picked up from the change feed every
+    refresh interval, by reading the changed annotations only. Without a change feed, the index is
+    reloaded every reload interval."""
+
+    def __init__(self, es: Elasticsearch, changes: Union[None, ChangeFeed] = None, refresh_interval: int = 5,
+                 reload_interval: int = 300, batch_size: int = 1000, rollover: bool = False):
+        self.es = es
+        self.changes = changes
+        self.rollover = rollover
+        self.refresh_interval = refresh_interval
+        self.reload_interval = reload_interval
+        self.batch_size = batch_size
+        self.counts: Dict[str, Dict[str, Dict[str, Set[str]]]] = {}
+        self.counted: Dict[str, Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]]] = {}
+        self.loaded_at: Dict[str, float] = {}
+        self.synced_at: Dict[str, float] = {}
+        self.last_seq: Dict[str, int] = {}
+        self.written_during_refresh: Dict[str, Dict[str, Union[None, Dict]]] = {}
+        self.lock = threading.Lock()
+        self.refreshes = SingleFlight()
+
+    def load(self, index: str) -> None:
+        # threads that find the same index stale at the same time share a single load
+        self.refreshes.run(index, lambda: self.load_index(index))
+
+    def load_index(self, index: str) -> None:
+        with self.lock:
+            self.written_during_refresh[index] = {}
+        try:
+            # changes after this sequence number are applied by the next sync, writes of this process
+            # during the scroll are applied at the end
+            last_seq = self.changes.get_last_seq(index) if self.changes else None
+            # make sure the scroll sees all annotations written so far
+            self.es.indices.refresh(index=index)
+            query = {
+                "query": {"bool": {"filter": [{"match": {"type": "Annotation"}}],
+                                   "must_not": [query_helper.make_tombstone_query()]}},
+                "_source": {"includes": counted_fields}
+            }
+            counts = {}
+            counted = {}
+            for hit in scan(self.es, index=index, query=query):
+                self.count(counts, counted, hit["_id"], hit["_source"])
+        finally:
+            with self.lock:
+                written = self.written_during_refresh.pop(index)
+        with self.lock:
+            # writes during the scroll may or may not be part of it, their latest version wins
+            for annotation_id, annotation in written.items():
+                self.count(counts, counted, annotation_id, annotation)
+            self.counts[index] = counts
+            self.counted[index] = counted
+            self.loaded_at[index] = self.synced_at[index] = time.time()
+            self.last_seq[index] = last_seq
+
+    def sync_index(self, index: str) -> None:
+        """Apply the changes of the change feed since the last sync, by reading the current version
+        of the changed annotations. A change whose annotation can't be read yet stops the sync, so
+        the next sync continues from that change, until it is older than the gap timeout of the
+        change feed."""
+        with self.lock:
+            if index not in self.counts:
+                # cleared in the meantime, the next call loads the index again
+                return None
+            counts, counted, since = self.counts[index], self.counted[index], self.last_seq[index]
+            self.written_during_refresh[index] = {}
+        try:
+            while True:
+                changes, last_seq = self.changes.read(index, since, self.batch_size)
+                live_ids = list(dict.fromkeys(change["id"] for change in changes
+                                              if change["type"] == "Annotation" and change["action"] != "deleted"))
+                found = self.get_annotations(index, live_ids) if live_ids else {}
+                changed = {}
+                synced_seq = since
+                for change in changes:
+                    if change["type"] == "Annotation":
+                        if change["action"] != "deleted" and change["id"] not in found and \
+                                get_change_age(change) < self.changes.gap_timeout:
+                            # the annotation may not be visible yet
+                            break
+                        changed[change["id"]] = found.get(change["id"])
+                    synced_seq = change["seq"]
+                with self.lock:
+                    for annotation_id, annotation in changed.items():
+                        self.count(counts, counted, annotation_id, annotation)
+                    self.last_seq[index] = synced_seq
+                if synced_seq != last_seq or len(changes) < self.batch_size:
+                    break
+                since = last_seq
+        finally:
+            with self.lock:
+                written = self.written_during_refresh.pop(index)
+                # writes of this process during the sync may be newer than the versions read
+                for annotation_id, annotation in written.items():
+                    self.count(counts, counted, annotation_id, annotation)
+                self.synced_at[index] = time.time()
+
+    def get_annotations(self, index: str, annotation_ids: List[str]) -> Dict[str, Dict]:
+        """Return the counted fields of the annotations that exist, by id. A multi-get is realtime,
+        so it sees every write that was recorded in the change feed. With rollover, the index is an
+        alias of several backing indices, which can only be searched after a refresh."""
+        if not self.rollover:
+            response = self.es.mget(index=index, body={"ids": annotation_ids}, _source_includes=counted_fields)
+            return {doc["_id"]: doc["_source"] for doc in response["docs"] if doc.get("found")}
+        self.es.indices.refresh(index=index)
+        query = {"query": query_helper.make_ids_query(annotation_ids), "size": len(annotation_ids),
+                 "_source": {"includes": counted_fields}}
+        return {hit["_id"]: hit["_source"] for hit in self.es.search(index=index, body=query)["hits"]["hits"]}
+
+    def refresh_index(self, index: str) -> None:
+        if self.needs_load(index):
+            self.load_index(index)
+        elif self.needs_sync(index):
+            self.sync_index(index)
+
+    @staticmethod
+    def count(counts: Dict[str, Dict[str, Set[str]]], counted: Dict, annotation_id: str,
+              annotation: Union[None, Dict]) -> None:
+        """Replace the counts of the previous version of the annotation (if any) with those of the
+        given version, or remove them if the annotation is None."""
+        if annotation_id in counted:
+            target_ids, keys = counted.pop(annotation_id)
+            for target_id in target_ids:
+                keyed_ids = counts[target_id]
+                for key in keys:
+                    keyed_ids[key].discard(annotation_id)
+                    if not keyed_ids[key]:
+                        del keyed_ids[key]
+                if not keyed_ids:
+                    del counts[target_id]
+        if annotation is None or not is_counted(annotation):
+            return None
+        target_ids = get_counted_target_ids(annotation)
+        keys = get_access_keys(annotation["permissions"] if "permissions" in annotation else None)
+        if not target_ids or not keys:
+            return None
+        for target_id in target_ids:
+            keyed_ids = counts.setdefault(target_id, {})
+            for key in keys:
+                keyed_ids.setdefault(key, set()).add(annotation_id)
+        counted[annotation_id] = (target_ids, keys)
+
+    def needs_load(self, index: str) -> bool:
+        loaded_at = self.loaded_at.get(index)
+        if loaded_at is None:
+            return True
+        return self.changes is None and time.time() - loaded_at > self.reload_interval
+
+    def needs_sync(self, index: str) -> bool:
+        synced_at = self.synced_at.get(index)
+        return self.changes is not None and synced_at is not None and time.time() - synced_at > self.refresh_interval
+
+    def set(self, index: str, annotation_id: str, annotation: Union[None, Dict]) -> None:
+        """Count the new version of the annotation, None when it is removed."""
+        with self.lock:
+            if index in self.counts:
+                self.count(self.counts[index], self.counted[index], annotation_id, annotation)
+            if index in self.written_during_refresh:
+                self.written_during_refresh[index][annotation_id] = annotation
+
+    def get_counts(self, index: str, target_ids: Iterable[str], username: Union[None, str] = None,
+                   groups: Union[None, List[str]] = None,
+                   access_status: Union[None, List[str]] = None) -> Dict[str, Dict[str, int]]:
+        if self.needs_load(index) or self.needs_sync(index):
+            self.refreshes.run(index, lambda: self.refresh_index(index))
+        requested_keys = get_requested_keys(username, groups, access_status)
+        all_keys = [key for keys in requested_keys.values() for key in keys]
+        target_counts = {}
+        with self.lock:
+            # the counts may have been cleared after the load, the next call loads them again
+            counts = self.counts.get(index, {})
+            for target_id in target_ids:
+                keyed_ids = counts.get(target_id, {})
+                level_counts = {level: len(count_distinct(keyed_ids, keys)) for level, keys in requested_keys.items()}
+                # an annotation can be counted at more than one access level
+                level_counts["total"] = len(count_distinct(keyed_ids, all_keys))
+                target_counts[target_id] = level_counts
+        return target_counts
+
+    def clear(self) -> None:
+        with self.lock:
+            self.counts = {}
+            self.counted = {}
+            self.loaded_at = {}
+            self.synced_at = {}
+            self.last_seq = {}
@@ -0,0 +1,45 @@
+import re
+import contextvars
+from typing import Union
+from models.error import InvalidUsage
+
+"""--------------- Project (tenant) routing ------------------"""
+
+# Annotations of a project are stored in their own index, named after the base annotation index.
+# All project indices share an alias, so cross-project reads are a single search on that alias.
+
+project_pattern = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+all_projects_name = "all"
+
+# the project of the current request, set per request by the API
+current_project = contextvars.ContextVar("current_project", default=None)
+
+
+def validate_project(project: Union[None, str]) -> Union[None, str]:
+    if project is None:
+        return None
+    if project == all_projects_name or not project_pattern.match(project):
+        raise InvalidUsage("'%s' is not a valid project name, use lowercase letters, digits, '-' and '_'" % project)
+    return project
+
+
+def set_project(project: Union[None, str]) -> contextvars.Token:
+    return current_project.set(validate_project(project))
+
+
+def reset_project(token: contextvars.Token) -> None:
+    current_project.reset(token)
+
+
+def get_project() -> Union[None, str]:
+    return current_project.get()
+
+
+def project_index_name(base_index: str, project: Union[None, str]) -> str:
+    if project is None:
+        return base_index
+    return "{b}__{p}".format(b=base_index, p=project)
+
+
+def all_projects_alias(base_index: str) -> str:
+    return project_index_name(base_index, all_projects_name)
@@ -0,0 +1,148 @@
+import datetime
+import logging
+import re
+import threading
+import time
+from typing import Dict, Union
+import pytz
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import TransportError
+from elasticsearch.helpers import scan
+import models.queries as query_helper
+from models.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+duration_pattern = re.compile(r"^(\d+)([smhdw])$")
+duration_units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_duration(duration: str) -> datetime.timedelta:
+    # the durations of the settings, e.g. "30d"
+    match = duration_pattern.match(duration)
+    if not match:
+        raise ValueError("Invalid duration %s, expected a number with unit s, m, h, d or w" % duration)
+    return datetime.timedelta(seconds=int(match.group(1)) * duration_units[match.group(2)])
+
+
+def parse_timestamp(timestamp: Union[None, str]) -> datetime.datetime:
+    # tombstones written before they had a deletion timestamp are kept until the next purge
+    if not timestamp:
+        return datetime.datetime.now(pytz.utc)
+    return datetime.datetime.fromisoformat(timestamp)
+
+
+class TombstoneRegistry(object):
+    """In-memory set of the ids of deleted annotations and collections per index, so checking
+    whether an id is deleted doesn't need a request to ES. The ids of an index are loaded with a
+    scroll when the index is bootstrapped (or on first use), and updated on delete. Deletes made
+    by other worker processes are picked up periodically by searching only the tombstones with a
+    recent deletion timestamp. Such a search can miss tombstones that aren't searchable yet, so it
+    overlaps the previous one by the overlap period (in seconds), instead of forcing a refresh."""
+
+    def __init__(self, es: Elasticsearch, refresh_interval: int = 60, overlap: int = 60):
+        self.es = es
+        self.refresh_interval = refresh_interval
+        self.overlap = datetime.timedelta(seconds=overlap)
+        # the deletion timestamps by id, to drop the ids of purged tombstones
+        self.deleted_ids: Dict[str, Dict[str, datetime.datetime]] = {}
+        self.synced_at: Dict[str, datetime.datetime] = {}
+        self.checked_at: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.loads = SingleFlight()
+
+    def load(self, index: str) -> None:
+        """Load all tombstones of the index, unless they are loaded already."""
+        if index not in self.synced_at:
+            # threads that find the same index missing at the same time share a single load
+            self.loads.run(index, lambda: self.load_index(index))
+
+    def load_index(self, index: str) -> None:
+        if index in self.synced_at:
+            return None
+        started_at = datetime.datetime.now(pytz.utc)
+        deleted_ids = self.scan_tombstones(index, query_helper.make_tombstone_query())
+        with self.lock:
+            # deletes of this process during the load were added to the registry already
+            deleted_ids.update(self.deleted_ids.get(index, {}))
+            self.deleted_ids[index] = deleted_ids
+            self.synced_at[index] = started_at
+            self.checked_at[index] = time.time()
+
+    def update(self, index: str) -> None:
+        """Add the tombstones of the index that were written since the last load or update."""
+        self.loads.run(index, lambda: self.update_index(index))
+
+    def update_index(self, index: str) -> None:
+        if not self.is_stale(index):
+            return None
+        started_at = datetime.datetime.now(pytz.utc)
+        since = (self.synced_at[index] - self.overlap).isoformat()
+        query = query_helper.bool_filter([query_helper.make_tombstone_query(), {"range": {"deleted": {"gte": since}}}])
+        deleted_ids = self.scan_tombstones(index, query)
+        with self.lock:
+            self.deleted_ids.setdefault(index, {}).update(deleted_ids)
+            self.synced_at[index] = started_at
+            self.checked_at[index] = time.time()
+
+    def scan_tombstones(self, index: str, query: Dict) -> Dict[str, datetime.datetime]:
+        hits = scan(self.es, index=index, query={"query": query, "_source": ["deleted"]})
+        return {hit["_id"]: parse_timestamp(hit["_source"].get("deleted")) for hit in hits}
+
+    def is_stale(self, index: str) -> bool:
+        checked_at = self.checked_at.get(index)
+        return checked_at is None or time.time() - checked_at > self.refresh_interval
+
+    def is_deleted(self, index: str, annotation_id: str) -> bool:
+        if index not in self.synced_at:
+            self.load(index)
+        elif self.is_stale(index):
+            self.update(index)
+        with self.lock:
+            # the registry may have been cleared after the load, the next call loads it again
+            return annotation_id in self.deleted_ids.get(index, {})
+
+    def add(self, index: str, annotation_id: str) -> None:
+        with self.lock:
+            self.deleted_ids.setdefault(index, {})[annotation_id] = datetime.datetime.now(pytz.utc)
+
+    def expire(self, retention: str) -> None:
+        """Drop the ids of tombstones that were deleted longer than the retention period ago,
+        after they are purged from the indices."""
+        expired_at = datetime.datetime.now(pytz.utc) - parse_duration(retention)
+        with self.lock:
+            for deleted_ids in self.deleted_ids.values():
+                for annotation_id in [annotation_id for annotation_id, deleted in deleted_ids.items()
+                                      if deleted < expired_at]:
+                    del deleted_ids[annotation_id]
+
+    def clear(self) -> None:
+        # all indices are loaded again on next use
+        with self.lock:
+            self.deleted_ids = {}
+            self.synced_at = {}
+            self.checked_at = {}
+
+
+class TombstoneCompactor(threading.Thread):
+    """Background thread that periodically purges tombstones older than the retention period."""
+
+    def __init__(self, annotation_store, interval: int, retention: str = None):
+        threading.Thread.__init__(self, name="tombstone-compactor", daemon=True)
+        self.annotation_store = annotation_store
+        self.interval = interval
+        self.retention = retention
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            try:
+                purged = self.annotation_store.purge_tombstones(self.retention)
+                logger.info("purged %s tombstones", purged)
+            except TransportError as error:
+                # ES is not available, try again after the next interval
+                logger.warning("purging tombstones failed: %s", error)
+
+    def stop(self) -> None:
+        self.stopped.set()
@@ -37,6 +37,8 @@ class User(object):
         self.username = user_data["username"]
         self.user_id = user_data["user_id"] if "user_id" in user_data else generate_id()
         self.password_hash = user_data["password_hash"] if "password_hash" in user_data else None
+        # ids of the groups the user is a member of, resolved by the user store and not stored
+        self.groups = []
 
     def hash_password(self, password):
         self.password_hash = pwd_context.hash(password)
@@ -1,32 +1,83 @@
-from typing import Dict, Union
+from typing import Dict, List, Union
+import threading
+import time
 from models.user import User
+from models.group import Group, group_prefix, is_group_id
 from models.error import UserError
 from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import NotFoundError, RequestError
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, BadSignature, SignatureExpired
 
 
+def make_member_groups_query(username: str) -> Dict:
+    return {"query": {"bool": {"filter": [{"term": {"type.keyword": "group"}},
+                                          {"term": {"members.keyword": username}}]}},
+            "size": 10000}
+
+
+class GroupCache(object):
+    """Caches the group ids per username for a number of seconds. Changes to groups made through
+    this process clear the cache, changes made by other processes are seen when entries expire."""
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self.groups: Dict[str, tuple] = {}
+        self.lock = threading.Lock()
+
+    def get(self, username: str) -> Union[None, List[str]]:
+        with self.lock:
+            if username not in self.groups:
+                return None
+            expires, group_ids = self.groups[username]
+            if expires < time.time():
+                del self.groups[username]
+                return None
+            return group_ids
+
+    def set(self, username: str, group_ids: List[str]) -> None:
+        with self.lock:
+            self.groups[username] = (time.time() + self.ttl, group_ids)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.groups = {}
+
+
 class UserStore(object):
 
-    def __init__(self, es_config: Dict[str, Union[str, int]]):
-        self.secret_key = "some combination of key words"
-        if "secret_key" in es_config:
-            self.secret_key = es_config["secret_key"]
+    def __init__(self, es_config: Dict[str, Union[str, int]], es: Union[None, Elasticsearch] = None,
+                 bootstrap: bool = True):
+        self.index_lock = threading.Lock()
+        self.configure(es_config, es=es, bootstrap=bootstrap)
 
-        # initialise ES
+    def configure(self, es_config: Dict[str, Union[str, int]], es: Union[None, Elasticsearch] = None,
+                  bootstrap: bool = True) -> None:
+        self.secret_key = es_config["secret_key"] if "secret_key" in es_config else "some combination of key words"
         self.es_config = es_config
         self.es_index = es_config['user_index']
-        self.es = Elasticsearch([{"host": es_config['host'], "port": es_config['port']}])
-        if not self.es.indices.exists(index=self.es_index):
-            self.es.indices.create(index=self.es_index)
+        self.es = es if es else Elasticsearch([{"host": es_config['host'], "port": es_config['port']}])
+        self.index_ready = False
+        self.group_cache = GroupCache(es_config["group_cache_ttl"] if "group_cache_ttl" in es_config else 60)
+        if bootstrap:
+            self.ensure_index()
         self.needs_refresh = False
 
-    def configure(self, es_config: Dict[str, Union[str, int]]) -> None:
-        self.es_config = es_config
-        self.es_index = es_config['user_index']
-        self.es = Elasticsearch([{"host": es_config['host'], "port": es_config['port']}])
-        if not self.es.indices.exists(index=self.es_index):
-            self.es.indices.create(index=self.es_index)
-        self.needs_refresh = False
+    def ensure_index(self) -> None:
+        """Create the user index if it doesn't exist. Once the index is known to exist,
+        this no longer calls ES until the store is reconfigured."""
+        if self.index_ready:
+            return None
+        with self.index_lock:
+            if self.index_ready:
+                return None
+            if not self.es.indices.exists(index=self.es_index):
+                try:
+                    self.es.indices.create(index=self.es_index)
+                except RequestError as error:
+                    # another worker process created the index in the meantime
+                    if error.error != "resource_already_exists_exception":
+                        raise
+            self.index_ready = True
 
     def index_needs_refresh(self):
         return self.needs_refresh
@@ -44,6 +95,8 @@ class UserStore(object):
             self.index_refresh()
 
     def register_user(self, username, password):
+        if username.startswith(group_prefix):
+            raise UserError(f"Username cannot start with '{group_prefix}'")
         if not self.username_available(username):
             raise UserError(f"User {username} already exists!")
         user = User({"username": username})
@@ -65,13 +118,17 @@ class UserStore(object):
             raise UserError("User {u} doesn't exist".format(u=username))
         if user_id:
             response = self.es.get(index=self.es_index, doc_type="user", id=user_id)
-            return User(response["_source"])
+            return self.with_groups(User(response["_source"]))
         response = self.es.search(index=self.es_index, body={"query": {"match": {"username": username}}})
         if isinstance(response["hits"]["total"], int) and response["hits"]["total"] == 0:
             raise UserError("User {u} doesn't exist".format(u=username))
         if isinstance(response["hits"]["total"], dict) and response["hits"]["total"]["value"] == 0:
             raise UserError("User {u} doesn't exist".format(u=username))
-        return User(response["hits"]["hits"][0]["_source"])
+        return self.with_groups(User(response["hits"]["hits"][0]["_source"]))
+
+    def with_groups(self, user):
+        user.groups = self.get_user_groups(user.username)
+        return user
 
     def verify_user(self, username, password):
         user = self.get_user_from_index(username=username)
@@ -125,3 +182,58 @@ class UserStore(object):
         self.es.indices.refresh(index=self.es_index)
         return user
 
+    def create_group(self, name, owner, members=None):
+        group = Group({"name": name, "owner": owner, "members": members if members else []})
+        return self.add_group_to_index(group)
+
+    def get_group(self, group_id):
+        if not is_group_id(group_id):
+            raise UserError("Group {g} doesn't exist".format(g=group_id), status_code=404)
+        try:
+            response = self.es.get(index=self.es_index, doc_type="group", id=group_id)
+        except NotFoundError:
+            raise UserError("Group {g} doesn't exist".format(g=group_id), status_code=404)
+        return Group(response["_source"])
+
+    def get_group_if_owner(self, group_id, username):
+        group = self.get_group(group_id)
+        if group.owner != username:
+            raise UserError("Only the owner can change group {g}".format(g=group_id), status_code=403)
+        return group
+
+    def update_group_members(self, group_id, username, add_members=None, remove_members=None):
+        group = self.get_group_if_owner(group_id, username)
+        if add_members:
+            group.add_members(add_members)
+        if remove_members:
+            group.remove_members(remove_members)
+        return self.add_group_to_index(group)
+
+    def delete_group(self, group_id, username):
+        group = self.get_group_if_owner(group_id, username)
+        self.es.delete(index=self.es_index, doc_type="group", id=group.group_id)
+        self.es.indices.refresh(index=self.es_index)
+        self.group_cache.clear()
+        return group
+
+    def get_groups(self, username) -> List[Group]:
+        """Return the groups the user is a member of."""
+        response = self.es.search(index=self.es_index, body=make_member_groups_query(username))
+        return [Group(hit["_source"]) for hit in response["hits"]["hits"]]
+
+    def get_user_groups(self, username) -> List[str]:
+        """Return the ids of the groups the user is a member of, which annotations can be shared with.
+        The ids are cached, as they are needed for every request of the user."""
+        if not username:
+            return []
+        group_ids = self.group_cache.get(username)
+        if group_ids is None:
+            group_ids = [group.group_id for group in self.get_groups(username)]
+            self.group_cache.set(username, group_ids)
+        return group_ids
+
+    def add_group_to_index(self, group):
+        self.es.index(index=self.es_index, doc_type="group", id=group.group_id, body=group.json())
+        self.es.indices.refresh(index=self.es_index)
+        self.group_cache.clear()
+        return group
@@ -1,5 +1,8 @@
 from flask import g
 from models.error import InvalidUsage, PermissionError
+import models.queries as query_helper
+from models.annotation_container import default_page_size as default_container_page_size
+from settings import server_config
 
 """--------------- Parse Request Headers and Parameters ------------------"""
 
@@ -17,6 +20,8 @@ def get_params(request, anon_allowed=True):
     # print("annotation type params parsed")
     determine_representation(request, params)
     parse_search_parameters(request, params)
+    parse_facet_parameters(request, params)
+    determine_projects(request, params)
     return params
 
 
@@ -29,10 +34,13 @@ def interpret_header(headers, params, anon_allowed):
     try:
         # if g.get('user') and g.user.__getattribute__('username'):
         params["username"] = g.user.username
+        # annotations shared with a group are shared with all its members
+        params["groups"] = g.user.groups if hasattr(g.user, "groups") else []
     except AttributeError:
         if not anon_allowed:
             raise PermissionError(message="Anonymous access with this method is not allowed")
         params["username"] = None  # anonymous requests for accessing public annotations
+        params["groups"] = []
     return params
 
 
@@ -83,9 +91,20 @@ def get_share_permissions(request, params):
 
 def determine_page_view(request, params):
     params["page"] = 0
+    params["page_size"] = get_page_size(request)
+    # container pages keep their default size unless a page size is requested, the page_size of the
+    # settings is the size of ES queries that aren't paged through a container
+    params["container_page_size"] = params["page_size"] if request.args.get("page_size") is not None \
+        else min(default_container_page_size, params["page_size"])
+    params["cursor"] = get_cursor(request)
+    params["show_page"] = False
     page = request.args.get("page")
     if page is not None:
-        params["page "] = int(page)
+        params["page"] = get_non_negative_int(page, "page")
+        params["show_page"] = True
+        params["view"] = "PreferContainedIRIs"
+    if params["cursor"] is not None:
+        params["show_page"] = True
         params["view"] = "PreferContainedIRIs"
     iris = request.args.get("iris")
     if iris is not None:
@@ -94,6 +113,58 @@ def determine_page_view(request, params):
             params["view"] = "PreferContainedDescriptions"
 
 
+def check_result_window(params):
+    """Listings that page with from and size in ES can't go beyond the maximum result window of the
+    index. Pages of a collection are slices of its items and have no such limit."""
+    if params["cursor"] is None and (params["page"] + 1) * params["page_size"] > get_es_setting("max_result_window",
+                                                                                                 10000):
+        raise InvalidUsage("'page' and 'page_size' go beyond the maximum result window, use 'cursor' to page "
+                           "through large result sets")
+
+
+def get_es_setting(setting, default):
+    return server_config["Elasticsearch"][setting] if setting in server_config["Elasticsearch"] else default
+
+
+def get_non_negative_int(value, param_name):
+    try:
+        value = int(value)
+    except ValueError:
+        raise InvalidUsage("'{p}' parameter should be a non-negative integer".format(p=param_name))
+    if value < 0:
+        raise InvalidUsage("'{p}' parameter should be a non-negative integer".format(p=param_name))
+    return value
+
+
+def get_page_size(request):
+    default_page_size = server_config["Elasticsearch"]["page_size"]
+    max_page_size = get_es_setting("max_page_size", default_page_size)
+    if request.args.get("page_size") is None:
+        return min(default_page_size, max_page_size)
+    page_size = get_non_negative_int(request.args.get("page_size"), "page_size")
+    if page_size < 1 or page_size > max_page_size:
+        raise InvalidUsage("'page_size' parameter should be between 1 and {m}".format(m=max_page_size))
+    return page_size
+
+
+def get_cursor(request):
+    cursor = request.args.get("cursor")
+    if cursor is None:
+        return None
+    if cursor == "":
+        # empty cursor starts at the beginning of the result set
+        return []
+    sort_values = query_helper.decode_cursor(cursor)
+    if sort_values is None:
+        raise InvalidUsage("'cursor' parameter is not a valid cursor")
+    return sort_values
+
+
+def get_link_params(request):
+    """Return the request parameters that should be repeated in the page links of a container."""
+    return {key: value for key, value in request.args.items() if key not in ["page", "iris", "cursor"]}
+
+
 def determine_annotation_type(request, params):
     annotation_type = request.args.get("type")
     if annotation_type is not None:
@@ -105,10 +176,42 @@ def determine_representation(request, params):
     params["include_permissions"] = False
     if include and include == "true":
         params["include_permissions"] = True
+    if request.args.get("fields"):
+        params["fields"] = [field.strip() for field in request.args.get("fields").split(",")]
+        if "" in params["fields"]:
+            raise InvalidUsage("'fields' parameter should be a comma-separated list of field names")
 
 
 def parse_search_parameters(request, params):
+    if request.args.get("q"):
+        params["query"] = request.args.get("q")
     if request.args.get("target_id"):
         params["filter"] = {"target_id": request.args.get("target_id").split(",")}
     if request.args.get("target_type"):
         params["filter"] = {"target_type": request.args.get("target_type").split(",")}
+
+
+def parse_facet_parameters(request, params):
+    params["facets"] = list(query_helper.facet_fields.keys())
+    params["facet_size"] = 10
+    if request.args.get("facets"):
+        params["facets"] = request.args.get("facets").split(",")
+        for facet in params["facets"]:
+            if facet not in query_helper.facet_fields:
+                raise InvalidUsage("'facets' parameter should be a list of one or more of {f}".format(
+                    f=", ".join(query_helper.facet_fields.keys())))
+    if request.args.get("facet_size"):
+        params["facet_size"] = get_non_negative_int(request.args.get("facet_size"), "facet_size")
+        if params["facet_size"] < 1 or params["facet_size"] > 1000:
+            raise InvalidUsage("'facet_size' parameter should be between 1 and 1000")
+
+
+def get_project(request):
+    """Return the project of the request, given in the X-Project header or the project parameter."""
+    project = request.headers.get("X-Project", request.args.get("project"))
+    return project if project else None
+
+
+def determine_projects(request, params):
+    # searching across projects is opt-in, by default requests only see their own project
+    params["all_projects"] = request.args.get("all_projects") == "true"
@@ -1,42 +1,162 @@
+import time
 from typing import Dict, Union
-from flask import Flask, json
+from flask import Flask, current_app, json, jsonify, make_response, request, g
+from elasticsearch.exceptions import TransportError
 from flask_cors import CORS
 
 from apis import blueprint as api
-from apis.user import configure_store as configure_user_store
-from apis.annotation import configure_store as configure_annotation_store
-from apis.collection import configure_store as configure_collection_store
+import stores
+import models.instrumentation as instrumentation
+import models.profiling as profiling
 from settings import server_config
 
-app = Flask(__name__, static_url_path='', static_folder='public')
-app.add_url_rule('/', 'root', lambda: app.send_static_file('index.html'))
-app.add_url_rule('/api', 'api_versions', lambda: app.send_static_file('index.html'))
-app.add_url_rule('/favicon.ico', 'favicon', lambda: app.send_static_file('favicon.ico'))
-app.add_url_rule('/robots.txt', 'robots', lambda: app.send_static_file('robots.txt'))
-app.add_url_rule('/ns/swao', 'swao', lambda: app.send_static_file('vocabularies/index.html'))
-app.config['SECRET_KEY'] = "some combination of key words"
-cors = CORS(app)
 
-app.register_blueprint(api, url_prefix=server_config['SWAServer']['api_prefix'])
+def create_app(config: Dict[str, Union[str, Dict]] = server_config) -> Flask:
+    """Create the Flask application. The API namespaces share the stores in the stores module,
+    so each (worker) process has a single ES client and connection pool. The stores are
+    configured with the Elasticsearch settings of the given config."""
+    stores.configure_stores(config["Elasticsearch"])
+    flask_app = Flask(__name__, static_url_path='', static_folder='public')
+    flask_app.add_url_rule('/', 'root', lambda: flask_app.send_static_file('index.html'))
+    flask_app.add_url_rule('/api', 'api_versions', lambda: flask_app.send_static_file('index.html'))
+    flask_app.add_url_rule('/favicon.ico', 'favicon', lambda: flask_app.send_static_file('favicon.ico'))
+    flask_app.add_url_rule('/robots.txt', 'robots', lambda: flask_app.send_static_file('robots.txt'))
+    flask_app.add_url_rule('/ns/swao', 'swao', lambda: flask_app.send_static_file('vocabularies/index.html'))
+    flask_app.add_url_rule('/ns/swao.jsonld', 'swao-jsonld', swao)
+    flask_app.add_url_rule('/ready', 'ready', ready)
+    flask_app.add_url_rule('/metrics', 'metrics', metrics)
+    # requests are only profiled on demand, without a token the hooks are not registered at all
+    profiling_token = config["SWAServer"]["profiling_token"] if "profiling_token" in config["SWAServer"] else None
+    if profiling_token:
+        flask_app.config["PROFILING_TOKEN"] = profiling_token
+        flask_app.add_url_rule('/profiles', 'profiles', list_profiles, methods=["GET", "DELETE"])
+        flask_app.add_url_rule('/profiles/<int:profile_id>', 'profile', get_profile)
+        flask_app.before_request(start_profile)
+        flask_app.after_request(stop_profile)
+        flask_app.teardown_request(stop_failed_profile)
+    flask_app.before_request(start_timings)
+    flask_app.after_request(add_server_timing)
+    flask_app.config['SECRET_KEY'] = "some combination of key words"
+    # expose the total count header of HEAD requests and the request timings to browser clients
+    CORS(flask_app, expose_headers=["X-Total-Count", "Server-Timing", "X-Profile-Id"])
+    flask_app.register_blueprint(api, url_prefix=config['SWAServer']['api_prefix'])
+    return flask_app
 
 
 def configure_stores(config: Dict[str, Union[str, int]]):
-    configure_user_store(config)
-    configure_annotation_store(config)
-    configure_collection_store(config)
+    stores.configure_stores(config)
 
 
 """--------------- Ontology endpoints ------------------"""
 
 
-@app.route("/ns/swao.jsonld", endpoint="swao-jsonld")
 def swao():
     with open('./public/vocabularies/swao.json', 'rt') as fh:
         swao_json = json.load(fh)
         return swao_json
 
 
+def ready():
+    # readiness probe for the worker: the indices exist and ES is reachable
+    if not stores.indices_ready():
+        try:
+            stores.ensure_indices()
+        except TransportError:
+            return make_response(jsonify({"status": "unavailable"}), 503)
+    return jsonify({"status": "ready"})
+
+
+"""--------------- Instrumentation ------------------"""
+
+
+def start_timings():
+    g.timings_token = instrumentation.start_request()
+
+
+def add_server_timing(response):
+    if "timings_token" not in g:
+        return response
+    timings = instrumentation.finish_request(g.pop("timings_token"), request.endpoint, request.method)
+    if timings is not None:
+        response.headers["Server-Timing"] = timings.server_timing()
+    return response
+
+
+def metrics():
+    response = make_response(instrumentation.metrics.render())
+    response.headers["Content-Type"] = "text/plain; version=0.0.4"
+    return response
+
+
+"""--------------- Profiling ------------------"""
+
+
+def has_profiling_token():
+    return profiling.is_valid_token(request.headers.get("X-Profile-Token"), current_app.config["PROFILING_TOKEN"])
+
+
+def start_profile():
+    if not has_profiling_token():
+        return None
+    profiler = profiling.profiles.start()
+    if profiler is not None:
+        g.profiler = profiler
+        g.profile_start = time.perf_counter()
+
+
+def finish_profile():
+    return profiling.profiles.stop(g.pop("profiler"), request.method, request.path, str(request.endpoint),
+                                   time.perf_counter() - g.pop("profile_start"))
+
+
+def stop_profile(response):
+    if "profiler" in g:
+        profile = finish_profile()
+        response.headers["X-Profile-Id"] = str(profile.profile_id)
+    return response
+
+
+def stop_failed_profile(_error=None):
+    # the profiler is still running if the request failed before the response was made
+    if "profiler" in g:
+        finish_profile()
+
+
+def list_profiles():
+    if not has_profiling_token():
+        return make_response(jsonify({'message': 'Unauthorized access'}), 403)
+    if request.method == "DELETE":
+        profiling.profiles.reset()
+        return jsonify({"message": "Profiles removed"})
+    all_modules = request.args.get("all_modules") == "true"
+    limit = int(request.args.get("limit")) if request.args.get("limit", "").isdigit() else 30
+    return jsonify({
+        "profiled_requests": profiling.profiles.num_profiled,
+        "hot_frames": profiling.profiles.hot_frames(all_modules=all_modules, limit=limit),
+        "profiles": profiling.profiles.list_profiles()
+    })
+
+
+def get_profile(profile_id):
+    if not has_profiling_token():
+        return make_response(jsonify({'message': 'Unauthorized access'}), 403)
+    profile = profiling.profiles.get_profile(profile_id)
+    if profile is None:
+        return make_response(jsonify({'message': 'Profile %s does not exist' % profile_id}), 404)
+    if request.args.get("format") == "pstats":
+        response = make_response(profile.dump())
+        response.headers["Content-Type"] = "application/octet-stream"
+        response.headers["Content-Disposition"] = "attachment; filename=profile-%s.prof" % profile_id
+        return response
+    modules = None if request.args.get("all_modules") == "true" else profiling.profiles.modules
+    limit = int(request.args.get("limit")) if request.args.get("limit", "").isdigit() else 30
+    profile_json = profile.summary()
+    profile_json["hot_frames"] = profiling.get_hot_frames(profile.stats, modules, limit)
+    return jsonify(profile_json)
+
+
 if __name__ == "__main__":
+    app = create_app()
     swas_host = server_config["SWAServer"]["host"]
     swas_port = server_config["SWAServer"]["port"]
     app.run(host=swas_host, port=swas_port, debug=True, threaded=True)
@@ -5,13 +5,50 @@ server_config = {
         "port": 9200,
         "annotation_index": "swa_unittest",
         "user_index": "swa_user_unittest",
-        "page_size": 1000
+        "page_size": 1000,
+        "max_page_size": 1000,
+        "max_result_window": 10000,
+        "max_batch_size": 10000,
+        "maxsize": 10,
+        # the projects that can have their own index (None allows any project), unknown projects are 404
+        "projects": None,
+        # rollover to dated backing indices behind read and write aliases, see lifecycle.py
+        "rollover": False,
+        "rollover_conditions": {"max_age": "30d", "max_docs": 1000000},
+        "tombstone_retention": "30d",
+        # seconds between reloads of the deleted ids and between tombstone purges (0 disables purging)
+        "tombstone_refresh_interval": 60,
+        "tombstone_compaction_interval": 0,
+        # seconds between updates of the annotation counts per target with the writes of other processes
+        # from the change feed, or between full reloads of the counts if the change feed is disabled
+        "target_count_refresh_interval": 5,
+        "target_count_reload_interval": 300,
+        # record every write in the change feed of /annotations/_changes, readers only move past a
+        # missing sequence number after gap_timeout seconds. Long-polls wait at most max_wait seconds
+        # and hold a request thread, so at most max_waiting of them wait per worker process
+        "change_feed": True,
+        "change_feed_gap_timeout": 5,
+        "change_feed_max_wait": 10,
+        "change_feed_max_waiting": 1,
+        # expected number of ids per index for the bloom filter of known ids (not used with rollover)
+        "id_filter_capacity": 1000000,
+        # ES calls slower than the threshold are logged as JSON lines (None disables), at most
+        # rate_limit entries per minute, to the log file or else to the swa.slow_queries logger
+        "slow_query_threshold_ms": 500,
+        "slow_query_sample_rate": 1.0,
+        "slow_query_rate_limit": 60,
+        "slow_query_log_file": None,
+        # seconds that the groups of a user are cached per process, group changes made by other
+        # processes are seen after at most this time
+        "group_cache_ttl": 60
     },
     "SWAServer": {
         "host": "0.0.0.0",
         "port": "3000",
         "url": "http://localhost:3000",
         "api_prefix": "/api/v1",
+        # requests with this token in the X-Profile-Token header are profiled, see /profiles (None disables)
+        "profiling_token": None,
     },
     "user1": {
         "username": "user1",
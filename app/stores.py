@@ -0,0 +1,82 @@
+import logging
+import threading
+from typing import Dict, Union
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import TransportError
+from models.annotation_store import AnnotationStore
+from models.user_store import UserStore
+from models.tombstones import TombstoneCompactor
+from models.instrumentation import InstrumentedElasticsearch
+from settings import server_config
+
+logger = logging.getLogger(__name__)
+
+"""--------------- Shared stores ------------------"""
+
+# All API namespaces use the same store instances, which share a single ES client (and
+# its connection pool) per process.
+
+
+def make_es_client(es_config: Dict[str, Union[str, int]]) -> Elasticsearch:
+    # maxsize is the number of connections kept open per ES node, it should be at least
+    # the number of request threads per worker process
+    maxsize = es_config["maxsize"] if "maxsize" in es_config else 10
+    es_client = Elasticsearch([{"host": es_config['host'], "port": es_config['port']}], maxsize=maxsize)
+    # count and time all ES calls of the stores, see /metrics and the Server-Timing header
+    return InstrumentedElasticsearch(es_client)
+
+
+es = make_es_client(server_config["Elasticsearch"])
+# the indices are checked on first use, so importing the API doesn't depend on ES being up
+annotation_store = AnnotationStore(server_config["Elasticsearch"], es=es, bootstrap=False)
+user_store = UserStore(server_config["Elasticsearch"], es=es, bootstrap=False)
+
+
+def configure_stores(config: Dict[str, Union[str, int]]):
+    """Give the shared stores a new ES client for the given configuration. This is also called
+    after forking a worker process, so that workers don't share the connections of the parent."""
+    global es
+    es = make_es_client(config)
+    annotation_store.configure(config, es=es, bootstrap=False)
+    user_store.configure(config, es=es, bootstrap=False)
+
+
+def ensure_indices() -> None:
+    """Make sure the annotation and user indices exist. This only calls ES until both
+    indices are known to exist in this process."""
+    annotation_store.ensure_index()
+    user_store.ensure_index()
+
+
+def indices_ready() -> bool:
+    return annotation_store.index_ready and user_store.index_ready
+
+
+def start_bootstrap() -> threading.Thread:
+    """Bootstrap the indices in a background thread, which also loads the tombstones and known
+    ids of the annotation index, so the first requests of a worker don't wait for them. If ES is
+    not available yet, the indices are bootstrapped on the first API request instead."""
+    def bootstrap():
+        try:
+            ensure_indices()
+        except TransportError as error:
+            logger.warning("bootstrapping the indices failed: %s", error)
+
+    thread = threading.Thread(target=bootstrap, name="bootstrap", daemon=True)
+    thread.start()
+    return thread
+
+
+compactor = None
+
+
+def start_compactor(config: Dict[str, Union[str, int]]):
+    """Start the background tombstone compactor of this process, if a compaction interval (in
+    seconds) is configured. The purge is idempotent, so every worker process may run one."""
+    global compactor
+    interval = config["tombstone_compaction_interval"] if "tombstone_compaction_interval" in config else 0
+    if interval <= 0 or (compactor and compactor.is_alive()):
+        return None
+    retention = config["tombstone_retention"] if "tombstone_retention" in config else None
+    compactor = TombstoneCompactor(annotation_store, interval, retention=retention)
+    compactor.start()
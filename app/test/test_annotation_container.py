@@ -3,7 +3,7 @@ import unittest
 from test.annotation_examples import annotations as examples, annotation_collections as example_collections
 from models.annotation import Annotation, AnnotationError
 from models.annotation_collection import AnnotationCollection
-from models.annotation_container import AnnotationContainer, update_url
+from models.annotation_container import AnnotationContainer, LazyAnnotationContainer, update_url
 
 
 class TestAnnotationContainer(unittest.TestCase):
@@ -140,3 +140,84 @@ class TestAnnotationContainer(unittest.TestCase):
             self.assertEqual(item[key], anno.data[key])
 
 
+class TestLazyAnnotationContainer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Lazy Annotation Container Model tests")
+
+    def setUp(self):
+        self.annotations = [Annotation(copy.copy(examples["vincent"])), Annotation(copy.copy(examples["theo"])),
+                            Annotation(copy.copy(examples["brothers"]))]
+        self.base_url = "http://localhost:3000/api/annotations/"
+        self.fetched_pages = []
+
+    def fetch_page(self, page_num, page_size):
+        self.fetched_pages.append(page_num)
+        start_index = page_num * page_size
+        return [copy.copy(anno.data) for anno in self.annotations[start_index: start_index + page_size]]
+
+    def test_lazy_container_cannot_be_initialized_with_negative_total(self):
+        error = None
+        try:
+            LazyAnnotationContainer(self.base_url, -1, self.fetch_page)
+        except AnnotationError as err:
+            error = err
+        self.assertNotEqual(error, None)
+
+    def test_lazy_container_minimal_view_fetches_no_pages(self):
+        container = LazyAnnotationContainer(self.base_url, 1000000, self.fetch_page, page_size=10)
+        view = container.view()
+        self.assertEqual(self.fetched_pages, [])
+        self.assertEqual(view["total"], 1000000)
+        self.assertEqual(view["last"], update_url(self.base_url, {"iris": 1, "page": 99999}))
+
+    def test_lazy_container_iris_view_fetches_only_first_page(self):
+        container = LazyAnnotationContainer(self.base_url, len(self.annotations), self.fetch_page,
+                                            page_size=1, view="PreferContainedIRIs")
+        view = container.view()
+        self.assertEqual(self.fetched_pages, [0])
+        self.assertEqual(len(view["first"]["items"]), 1)
+        self.assertEqual(view["first"]["next"], update_url(self.base_url, {"iris": 1, "page": 1}))
+
+    def test_lazy_container_can_generate_pages(self):
+        container = LazyAnnotationContainer(self.base_url, len(self.annotations), self.fetch_page, page_size=2)
+        view = container.view_page(page=1)
+        self.assertEqual(self.fetched_pages, [1])
+        self.assertEqual(view["startIndex"], 2)
+        self.assertEqual(len(view["items"]), 1)
+        self.assertEqual(view["prev"], update_url(self.base_url, {"iris": 1, "page": 0}))
+        self.assertTrue("next" not in view)
+
+    def test_lazy_container_does_not_fetch_pages_beyond_total(self):
+        container = LazyAnnotationContainer(self.base_url, len(self.annotations), self.fetch_page, page_size=2)
+        view = container.view_page(page=5)
+        self.assertEqual(self.fetched_pages, [])
+        self.assertEqual(view["items"], [])
+
+    def test_lazy_container_can_show_collection_metadata(self):
+        collection = AnnotationCollection(copy.copy(example_collections["empty_collection"])).to_json()
+        item_ids = [anno.id for anno in self.annotations]
+        container = LazyAnnotationContainer(self.base_url, len(item_ids), lambda page_num, page_size: item_ids,
+                                            view="PreferContainedIRIs", collection=collection)
+        view = container.view()
+        self.assertEqual(view["label"], collection["label"])
+        self.assertEqual(view["total"], 3)
+        self.assertEqual(len(view["first"]["items"]), 3)
+
+    def test_lazy_container_links_include_link_params(self):
+        link_params = {"page_size": 2, "target_id": "urn:vangogh:testletter.sender"}
+        container = LazyAnnotationContainer(self.base_url, len(self.annotations), self.fetch_page, page_size=2,
+                                            link_params=link_params)
+        view = container.view()
+        self.assertEqual(view["id"], update_url(self.base_url, dict(link_params, iris=1)))
+        self.assertEqual(view["last"], update_url(self.base_url, dict(link_params, iris=1, page=1)))
+
+    def test_lazy_container_can_generate_cursor_page(self):
+        container = LazyAnnotationContainer(self.base_url, len(self.annotations), self.fetch_page, page_size=2)
+        items = self.fetch_page(0, 2)
+        view = container.view_cursor_page("", items, next_cursor="abc")
+        self.assertEqual(view["id"], update_url(self.base_url, {"iris": 1, "cursor": ""}))
+        self.assertEqual(view["next"], update_url(self.base_url, {"iris": 1, "cursor": "abc"}))
+        self.assertEqual(len(view["items"]), 2)
+        self.assertTrue("startIndex" not in view)
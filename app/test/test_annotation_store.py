@@ -7,6 +7,7 @@ from models.annotation import Annotation, AnnotationError
 from models.annotation_store import AnnotationStore
 from models.error import *
 from models.permissions import add_permissions
+import models.tenant as tenant
 from settings_unittest import server_config
 
 
@@ -76,6 +77,48 @@ class TestAnnotationStore(unittest.TestCase):
                 exists = True
         self.assertTrue(exists)
 
+    def test_store_without_bootstrap_creates_index_on_demand(self):
+        self.store.es.indices.delete(self.config["annotation_index"])
+        store = AnnotationStore(self.config, es=self.store.es, bootstrap=False)
+        self.assertFalse(store.index_ready)
+        self.assertFalse(store.es.indices.exists(index=self.config["annotation_index"]))
+        store.ensure_index()
+        self.assertTrue(store.index_ready)
+        self.assertTrue(store.es.indices.exists(index=self.config["annotation_index"]))
+
+    def test_store_routes_annotations_to_project_index(self):
+        token = tenant.set_project("unittest")
+        try:
+            annotation = self.store.add_annotation_es(self.example_annotation, params=self.public_params)
+            project_index = tenant.project_index_name(self.config["annotation_index"], "unittest")
+            self.assertTrue(self.store.es.exists(index=project_index, id=annotation["id"]))
+            self.assertFalse(self.store.es.exists(index=self.config["annotation_index"], id=annotation["id"]))
+            self.store.index_refresh()
+        finally:
+            tenant.reset_project(token)
+        self.assertEqual(self.store.count_annotations_es(self.public_params), 0)
+        params = dict(self.public_params, all_projects=True)
+        self.assertEqual(self.store.count_annotations_es(params), 1)
+        self.store.es.indices.delete(project_index)
+
+    def test_store_with_rollover_reads_across_backing_indices(self):
+        config = dict(self.config, annotation_index=self.config["annotation_index"] + "_rollover", rollover=True)
+        store = AnnotationStore(config, es=self.store.es)
+        try:
+            annotation1 = store.add_annotation_es(copy.copy(examples["vincent"]), params=self.public_params)
+            store.index_refresh()
+            rolled_over = store.rollover_indices(conditions={"max_docs": 1})
+            self.assertTrue(rolled_over[config["annotation_index"]])
+            annotation2 = store.add_annotation_es(copy.copy(examples["theo"]), params=self.public_params)
+            self.assertEqual(store.get_annotation_es(annotation1["id"], self.public_params)["id"], annotation1["id"])
+            self.assertEqual(store.get_annotation_es(annotation2["id"], self.public_params)["id"], annotation2["id"])
+            deleted = store.remove_annotation_es(annotation1["id"], self.public_params)
+            self.assertIn("deleted", deleted)
+            self.assertTrue(store.is_deleted(annotation1["id"]))
+            self.assertEqual(store.purge_tombstones(retention="1d"), 0)
+        finally:
+            store.es.indices.delete(config["annotation_index"] + "-*")
+
     def test_store_raises_error_updating_annotation_from_index_without_target_list(self):
         error = None
         anno = Annotation(self.example_annotation)
@@ -173,6 +216,30 @@ class TestAnnotationStore(unittest.TestCase):
         response = self.store.update_in_index(anno.to_json(), anno.data['type'])
         self.assertEqual(response['result'], "updated")
 
+    def test_store_registers_tombstone_of_removed_annotation(self):
+        annotation = self.store.add_annotation_es(self.example_annotation, params=self.public_params)
+        self.assertFalse(self.store.is_deleted(annotation["id"]))
+        self.store.remove_annotation_es(annotation["id"], params=self.public_params)
+        self.assertTrue(self.store.tombstones.is_deleted(self.config["annotation_index"], annotation["id"]))
+        # a reload from the index gives the same answer
+        self.store.tombstones.clear()
+        self.assertTrue(self.store.is_deleted(annotation["id"]))
+
+    def test_store_raises_error_updating_annotation_with_outdated_version(self):
+        anno = Annotation(self.example_annotation)
+        self.store.add_target_list(anno)
+        add_permissions(anno, self.private_params)
+        self.store.add_to_index(anno.to_json(), anno.data['type'])
+        document = self.store.get_existing_document(anno.id, anno.data['type'])
+        self.store.update_in_index(anno.to_json(), anno.data['type'], document=document)
+        error = None
+        try:
+            self.store.update_in_index(anno.to_json(), anno.data['type'], document=document)
+        except AnnotationError as err:
+            error = err
+        self.assertNotEqual(error, None)
+        self.assertEqual(error.status_code, 409)
+
     def test_store_raises_error_removing_unknown_annotation_from_index(self):
         anno = Annotation(self.example_annotation)
         error = None
@@ -634,6 +701,34 @@ class TestAnnotationStore(unittest.TestCase):
             error = err
         self.assertNotEqual(error, None)
 
+    def test_store_cannot_add_annotation_to_collection_twice(self):
+        annotation = self.store.add_annotation_es(copy.copy(examples["vincent"]), self.private_params)
+        collection_data = example_collections["empty_collection"]
+        collection = self.store.create_collection_es(collection_data, self.private_params)
+        collection = self.store.add_annotation_to_collection_es(annotation['id'], collection["id"], self.params)
+        self.assertEqual(collection["total"], 1)
+        error = None
+        try:
+            self.store.add_annotation_to_collection_es(annotation['id'], collection["id"], self.params)
+        except AnnotationError as err:
+            error = err
+        self.assertNotEqual(error, None)
+        self.assertEqual(error.message, "Collection already contains this annotation")
+
+    def test_store_can_add_and_remove_annotations_to_collection_in_batch(self):
+        annotation1 = self.store.add_annotation_es(copy.copy(examples["vincent"]), self.private_params)
+        annotation2 = self.store.add_annotation_es(copy.copy(examples["theo"]), self.private_other_params)
+        collection_data = example_collections["empty_collection"]
+        collection = self.store.create_collection_es(collection_data, self.private_params)
+        result = self.store.update_collection_items_es(collection["id"], [annotation1["id"], annotation2["id"],
+                                                                          "urn:uuid:unknown"], [], self.params)
+        self.assertEqual(result["total"], 1)
+        self.assertTrue(result["modified"])
+        rejected_ids = [rejected["id"] for rejected in result["rejected"]]
+        self.assertEqual(sorted(rejected_ids), sorted([annotation2["id"], "urn:uuid:unknown"]))
+        result = self.store.update_collection_items_es(collection["id"], [], [annotation1["id"]], self.params)
+        self.assertEqual(result["total"], 0)
+
     def test_store_cannot_remove_public_annotation_from_shared_collection_by_anonymous_user(self):
         annotation = self.store.add_annotation_es(copy.copy(examples["vincent"]), self.public_params)
         collection_data = example_collections["empty_collection"]
@@ -687,6 +782,32 @@ class TestAnnotationStore(unittest.TestCase):
         self.assertEqual(annotations_data["total"], 1)
         self.assertEqual(annotations_data["annotations"][0]["id"], annotation["id"])
 
+    def test_store_can_get_facets_of_visible_annotations(self):
+        annotation = copy.copy(self.example_annotation)
+        self.store.add_annotation_es(annotation, self.private_params)
+        annotation = copy.copy(self.example_annotation)
+        self.store.add_annotation_es(annotation, self.public_params)
+        params = copy.copy(self.anon_params)
+        params["facets"] = ["target_id", "created"]
+        params["facet_size"] = 10
+        facets_data = self.store.get_facets_es(params)
+        self.assertEqual(facets_data["total"], 1)
+        target_id = self.example_annotation["target"][0]["id"]
+        self.assertTrue({"value": target_id, "count": 1} in facets_data["facets"]["target_id"])
+        self.assertEqual(sum([bucket["count"] for bucket in facets_data["facets"]["created"]]), 1)
+
+    def test_store_can_search_annotation_bodies(self):
+        annotation = copy.copy(self.example_annotation)
+        self.store.add_annotation_es(annotation, self.public_params)
+        params = copy.copy(self.anon_params)
+        params["query"] = "gogh"
+        search_data = self.store.search_annotations_es(params)
+        self.assertEqual(search_data["total"], 1)
+        self.assertEqual(search_data["results"][0]["annotation"]["id"], annotation["id"])
+        self.assertTrue("<em>Gogh</em>" in search_data["results"][0]["highlight"]["body.value"][0])
+        params["query"] = "theo"
+        self.assertEqual(self.store.search_annotations_es(params)["total"], 0)
+
     def test_store_can_get_private_collections_by_owner(self):
         collection_data = example_collections["empty_collection"]
         self.store.create_collection_es(collection_data, self.private_params)
@@ -0,0 +1,202 @@
+import asyncio
+import base64
+import copy
+import json
+import unittest
+
+import asgi
+import server
+import stores
+from test.annotation_examples import annotations as examples, annotation_collections as example_collections
+from models.async_annotation_store import AsyncAnnotationStore
+from models.async_user_store import AsyncUserStore
+from benchmark.fake_es import FakeElasticsearch, AsyncFakeElasticsearch
+from settings_unittest import server_config
+
+config = server_config["Elasticsearch"]
+
+
+class RecordingAsyncElasticsearch(AsyncFakeElasticsearch):
+    """Records the calls made through the async client, and how many were waiting at the same time."""
+
+    def __init__(self, client):
+        AsyncFakeElasticsearch.__init__(self, client)
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def __getattr__(self, name):
+        call = AsyncFakeElasticsearch.__getattr__(self, name)
+        if not callable(call):
+            return call
+
+        async def recorded_call(*args, **kwargs):
+            self.calls.append(name)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                self.in_flight -= 1
+
+        return recorded_call
+
+
+def basic_auth(username, password):
+    return {"Authorization": "Basic " + base64.b64encode(bytes(username + ":" + password, "ascii")).decode("ascii")}
+
+
+class TestASGI(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning ASGI tests")
+
+    def setUp(self):
+        self.flask_app = server.create_app(server_config)
+        self.es = FakeElasticsearch()
+        stores.annotation_store.configure(config, es=self.es)
+        stores.user_store.configure(config, es=self.es)
+        stores.ensure_indices()
+        self.async_es = RecordingAsyncElasticsearch(self.es)
+        self.app = asgi.SWAServerASGI(self.flask_app, server_config)
+        self.app.annotation_store = AsyncAnnotationStore(stores.annotation_store, self.async_es)
+        self.app.user_store = AsyncUserStore(stores.user_store, self.async_es)
+        self.client = self.flask_app.test_client()
+        self.username = server_config["user1"]["username"]
+        stores.user_store.register_user(self.username, server_config["user1"]["password"])
+        self.headers = basic_auth(self.username, server_config["user1"]["password"])
+        self.params = {"username": self.username, "access_status": ["private"]}
+
+    def tearDown(self):
+        stores.configure_stores(config)
+
+    def request(self, method, path, body=None, headers=None):
+        """Make a request to the ASGI app, and return the status and JSON response."""
+        headers = dict(headers) if headers else {}
+        body = json.dumps(body).encode() if body is not None else b""
+        if body:
+            headers["Content-Type"] = "application/json"
+            headers["Content-Length"] = str(len(body))
+        scope = {"type": "http", "method": method, "path": path, "root_path": "", "query_string": b"",
+                 "http_version": "1.1", "scheme": "http", "server": ("localhost", 80),
+                 "headers": [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers.items()]}
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.app(scope, receive, send))
+        finally:
+            loop.close()
+        return messages[0]["status"], json.loads(b"".join(message.get("body", b"") for message in messages[1:]))
+
+    def flask_request(self, method, path, body=None, headers=None):
+        response = self.client.open(path, method=method, headers=headers,
+                                    data=json.dumps(body) if body is not None else None,
+                                    content_type="application/json")
+        return response.status_code, json.loads(response.get_data(as_text=True))
+
+    def add_annotation(self, access_status):
+        params = dict(self.params, access_status=[access_status])
+        return stores.annotation_store.add_annotation_es(copy.deepcopy(examples["vincent"]), params)
+
+    def add_collection(self):
+        return stores.annotation_store.create_collection_es(copy.deepcopy(example_collections["empty_collection"]),
+                                                            copy.deepcopy(self.params))
+
+    def test_GET_annotation_is_served_natively_like_flask(self):
+        annotation = self.add_annotation("public")
+        path = "/api/v1/annotations/" + annotation["id"]
+        status, data = self.request("GET", path)
+        self.assertEqual(status, 200)
+        self.assertIn("get", self.async_es.calls)
+        self.assertEqual((status, data), self.flask_request("GET", path))
+
+    def test_GET_annotation_checks_permissions_like_flask(self):
+        annotation = self.add_annotation("private")
+        path = "/api/v1/annotations/" + annotation["id"]
+        self.assertEqual(self.request("GET", path)[0], 403)
+        self.assertEqual(self.request("GET", path), self.flask_request("GET", path))
+        self.assertEqual(self.request("GET", path, headers=self.headers)[0], 200)
+        self.assertEqual(self.request("GET", path, headers=basic_auth(self.username, "wrong"))[0], 403)
+        status, data = self.request("GET", "/api/v1/annotations/does-not-exist")
+        flask_status, flask_data = self.flask_request("GET", "/api/v1/annotations/does-not-exist")
+        # Flask-RESTX adds suggestions of other URLs to the message of a 404
+        self.assertEqual(status, flask_status)
+        self.assertTrue(flask_data["message"].startswith(data["message"]))
+
+    def test_POST_existing_annotation_to_collection_checks_permissions_concurrently(self):
+        collection = self.add_collection()
+        annotation = self.add_annotation("private")
+        path = "/api/v1/collections/%s/annotations/" % collection["id"]
+        status, data = self.request("POST", path, body={"id": annotation["id"]}, headers=self.headers)
+        self.assertEqual(status, 200)
+        self.assertEqual(data["total"], 1)
+        self.assertEqual(self.async_es.max_in_flight, 2)
+        stored = stores.annotation_store.get_collection_es(collection["id"], copy.deepcopy(self.params))
+        self.assertEqual(stored["items"], [annotation["id"]])
+        # adding it again is rejected, like the Flask app does
+        status, data = self.request("POST", path, body={"id": annotation["id"]}, headers=self.headers)
+        self.assertEqual((status, data),
+                         self.flask_request("POST", path, body={"id": annotation["id"]}, headers=self.headers))
+        self.assertEqual(status, 400)
+
+    def test_POST_existing_annotation_to_collection_doesnt_return_items_of_update(self):
+        collection = self.add_collection()
+        annotations = [self.add_annotation("private") for _ in range(2)]
+        path = "/api/v1/collections/%s/annotations/" % collection["id"]
+        update = self.es.update
+        updated_sources = []
+
+        def recorded_update(*args, **kwargs):
+            response = update(*args, **kwargs)
+            if kwargs.get("doc_type") == "AnnotationCollection":
+                updated_sources.append(response["get"]["_source"])
+            return response
+
+        self.es.update = recorded_update
+        prefer = 'return=representation;include="http://www.w3.org/ns/ldp#PreferContainedIRIs"'
+        headers = dict(self.headers, Prefer=prefer)
+        status, data = self.request("POST", path, body={"id": annotations[0]["id"]}, headers=headers)
+        self.assertEqual(status, 200)
+        self.assertEqual(data["total"], 1)
+        self.assertEqual(len(data["first"]["items"]), 1)
+        status, data = self.flask_request("POST", path, body={"id": annotations[1]["id"]}, headers=headers)
+        self.assertEqual(status, 200)
+        self.assertEqual(data["total"], 2)
+        self.assertEqual(len(data["first"]["items"]), 2)
+        self.assertEqual(len(updated_sources), 2)
+        self.assertTrue(all("items" not in source and "total" in source for source in updated_sources))
+
+    def test_POST_new_annotation_to_collection_is_passed_to_flask(self):
+        collection = self.add_collection()
+        path = "/api/v1/collections/%s/annotations/" % collection["id"]
+        status, data = self.request("POST", path, body=copy.deepcopy(examples["vincent"]), headers=self.headers)
+        self.assertEqual(status, 200)
+        self.assertEqual(data["total"], 1)
+        self.assertEqual(self.async_es.calls, [])
+
+    def test_changes_give_urls_of_the_endpoint_of_each_type(self):
+        annotation = self.add_annotation("private")
+        collection = self.add_collection()
+        status, data = self.request("GET", "/api/v1/annotations/_changes", headers=self.headers)
+        self.assertEqual(status, 200)
+        ids = {change["type"]: change["id"] for change in data["changes"]}
+        self.assertTrue(ids["Annotation"].endswith("/annotations/" + annotation["id"]))
+        self.assertTrue(ids["AnnotationCollection"].endswith("/collections/" + collection["id"]))
+
+    def test_other_requests_are_passed_to_flask(self):
+        self.add_annotation("public")
+        status, data = self.request("GET", "/api/v1/annotations/_count")
+        self.assertEqual((status, data), (200, {"total": 1}))
+        self.assertEqual(self.async_es.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import copy
+import threading
+import time
+import unittest
+import uuid
+from elasticsearch.exceptions import TransportError
+from test.annotation_examples import annotations as examples
+from models.annotation import AnnotationError
+from models.annotation_store import AnnotationStore
+from models.bloom_filter import BloomFilter, KnownIdFilter
+from benchmark.fake_es import FakeElasticsearch
+from settings_unittest import server_config
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Bloom filter tests")
+
+    def test_bloom_filter_contains_added_items(self):
+        bloom_filter = BloomFilter(1000)
+        ids = [uuid.uuid4().urn for _ in range(1000)]
+        for annotation_id in ids:
+            bloom_filter.add(annotation_id)
+        for annotation_id in ids:
+            self.assertTrue(annotation_id in bloom_filter)
+
+    def test_bloom_filter_has_few_false_positives(self):
+        bloom_filter = BloomFilter(1000, error_rate=0.01)
+        for _ in range(1000):
+            bloom_filter.add(uuid.uuid4().urn)
+        false_positives = len([1 for _ in range(10000) if uuid.uuid4().urn in bloom_filter])
+        self.assertTrue(false_positives < 300)
+
+    def test_empty_bloom_filter_contains_nothing(self):
+        bloom_filter = BloomFilter(10)
+        self.assertFalse("urn:uuid:1" in bloom_filter)
+
+
+
+class TestKnownIdFilter(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Known Id Filter tests")
+
+    def setUp(self):
+        self.es = FakeElasticsearch()
+        self.es.indices.create(index="known")
+        self.es.index(index="known", id="a1", body={"id": "a1", "type": "Annotation"})
+
+    def test_known_id_filter_contains_indexed_and_added_ids(self):
+        known_ids = KnownIdFilter(self.es, capacity=100)
+        self.assertTrue(known_ids.might_contain("known", "a1"))
+        self.assertFalse(known_ids.might_contain("known", "a2"))
+        known_ids.add("known", "a2")
+        self.assertTrue(known_ids.might_contain("known", "a2"))
+
+    def test_known_id_filter_loads_index_once_for_concurrent_threads(self):
+        known_ids = KnownIdFilter(self.es, capacity=100)
+        count = self.es.count
+        counts = []
+
+        def slow_count(index=None, **kwargs):
+            counts.append(index)
+            time.sleep(0.1)
+            return count(index=index, **kwargs)
+
+        self.es.count = slow_count
+        results = []
+
+        def check():
+            try:
+                results.append(known_ids.might_contain("known", "a1"))
+            except Exception as error:
+                results.append(error)
+
+        threads = [threading.Thread(target=check) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True] * 4)
+        self.assertEqual(counts, ["known"])
+
+    def test_known_id_filter_loads_index_again_after_failed_load(self):
+        known_ids = KnownIdFilter(self.es, capacity=100)
+        search = self.es.search
+
+        def unavailable_search(**kwargs):
+            raise TransportError("N/A", "ES is not available")
+
+        self.es.search = unavailable_search
+        self.assertRaises(TransportError, known_ids.might_contain, "known", "a1")
+        self.assertNotIn("loading:known", known_ids.filters)
+        self.es.search = search
+        self.assertTrue(known_ids.might_contain("known", "a1"))
+
+    def test_store_loads_known_ids_with_the_index(self):
+        store = AnnotationStore(server_config["Elasticsearch"], es=self.es)
+        self.assertIn(store.es_index, store.known_ids.filters)
+
+    def test_rollover_checks_existence_of_client_ids_in_es(self):
+        es = FakeElasticsearch()
+        config = dict(server_config["Elasticsearch"], rollover=True)
+        store = AnnotationStore(config, es=es)
+        other_store = AnnotationStore(config, es=es)
+        params = {"username": "user1", "access_status": ["private"]}
+        # the filter of the store is loaded before another worker creates the id
+        self.assertTrue(store.should_not_exist("urn:uuid:client-id"))
+        annotation = dict(copy.deepcopy(examples["vincent"]), id="urn:uuid:client-id")
+        other_store.add_annotation_es(copy.deepcopy(annotation), copy.deepcopy(params))
+        other_store.rollover_indices(conditions={"max_docs": 1})
+        # the write index has rolled over, so only the check in ES finds the id
+        self.assertRaises(AnnotationError, store.add_annotation_es, copy.deepcopy(annotation), params)
+
+
+if __name__ == "__main__":
+    unittest.main()
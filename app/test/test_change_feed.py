@@ -0,0 +1,122 @@
+import copy
+import threading
+import time
+import unittest
+from elasticsearch.exceptions import ConflictError
+
+from test.annotation_examples import annotations as examples
+from models.annotation_store import AnnotationStore
+from models.change_feed import ChangeFeed, change_index_name
+from benchmark.fake_es import FakeElasticsearch
+from settings_unittest import server_config
+
+
+class TestChangeFeed(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Change Feed tests")
+
+    def setUp(self):
+        self.store = AnnotationStore(server_config["Elasticsearch"], es=FakeElasticsearch())
+        self.params = {"username": "user1", "access_status": ["private"]}
+
+    def add_annotation(self, params):
+        return self.store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(params))
+
+    def test_changes_follow_writes_of_annotation(self):
+        annotation = self.add_annotation(self.params)
+        annotation["motivation"] = "commenting"
+        self.store.update_annotation_es(copy.deepcopy(annotation), copy.deepcopy(self.params))
+        self.store.remove_annotation_es(annotation["id"], copy.deepcopy(self.params))
+        feed = self.store.get_changes_es(0, 100, copy.deepcopy(self.params))
+        self.assertEqual([(change["seq"], change["action"]) for change in feed["changes"]],
+                         [(1, "created"), (2, "updated"), (3, "deleted")])
+        self.assertTrue(all(change["id"] == annotation["id"] for change in feed["changes"]))
+        self.assertEqual(feed["last_seq"], 3)
+        self.assertEqual(self.store.get_changes_es(2, 100, copy.deepcopy(self.params))["changes"][0]["seq"], 3)
+
+    def test_changes_of_other_users_are_hidden_but_skipped(self):
+        self.add_annotation(self.params)
+        public = self.add_annotation({"username": "user2", "access_status": ["public"]})
+        feed = self.store.get_changes_es(0, 100, {"username": "user2", "access_status": ["private", "public"]})
+        self.assertEqual([change["id"] for change in feed["changes"]], [public["id"]])
+        self.assertEqual(feed["last_seq"], 2)
+        feed = self.store.get_changes_es(1, 100, {"username": "user3", "access_status": ["private"]})
+        self.assertEqual([change["id"] for change in feed["changes"]], [public["id"]])
+        feed = self.store.get_changes_es(0, 1, {"username": "user3", "access_status": ["private"]})
+        self.assertEqual(feed, {"changes": [], "last_seq": 1})
+
+    def test_gap_is_held_back_until_gap_timeout(self):
+        es = FakeElasticsearch()
+        change_feed = ChangeFeed(es, gap_timeout=60)
+        permissions = {"access_status": ["public"], "owner": "user1"}
+        change_feed.record("swa", "a1", "Annotation", "created", permissions)
+        # a reserved sequence number of which the change isn't written (yet)
+        change_feed.next_seq(change_index_name("swa"))
+        change_feed.record("swa", "a2", "Annotation", "created", permissions)
+        self.assertEqual(change_feed.read("swa", 0, 100)[1], 1)
+        change_feed.gap_timeout = 0
+        changes, last_seq = change_feed.read("swa", 0, 100)
+        self.assertEqual([change["seq"] for change in changes], [1, 3])
+        self.assertEqual(last_seq, 3)
+
+    def test_concurrent_changes_share_blocks_of_sequence_numbers(self):
+        es = FakeElasticsearch()
+        change_feed = ChangeFeed(es)
+        permissions = {"access_status": ["public"], "owner": "user1"}
+        next_seq = change_feed.next_seq
+        counts = []
+
+        def slow_next_seq(change_index, count=1):
+            counts.append(count)
+            time.sleep(0.1)
+            return next_seq(change_index, count=count)
+
+        change_feed.next_seq = slow_next_seq
+        seqs = []
+
+        def record(annotation_id):
+            seqs.append(change_feed.record("swa", annotation_id, "Annotation", "created", permissions))
+
+        threads = [threading.Thread(target=record, args=["a%s" % num]) for num in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(seqs), list(range(1, 9)))
+        self.assertEqual(sum(counts), 8)
+        self.assertLess(len(counts), 8)
+        changes, last_seq = change_feed.read("swa", 0, 100)
+        self.assertEqual(last_seq, 8)
+        self.assertEqual(sorted(change["id"] for change in changes), ["a%s" % num for num in range(8)])
+
+    def test_long_poll_returns_on_new_change(self):
+        self.add_annotation(self.params)
+        self.store.changes.poll_interval = 10
+        writer = threading.Timer(0.2, self.add_annotation, args=[self.params])
+        writer.start()
+        start = time.time()
+        feed = self.store.get_changes_es(1, 100, copy.deepcopy(self.params), wait=5)
+        writer.join()
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual([change["seq"] for change in feed["changes"]], [2])
+
+    def test_long_poll_does_not_wait_beyond_max_waiting(self):
+        # another long-poll of this process is waiting already
+        self.store.changes.waiting.acquire()
+        start = time.time()
+        feed = self.store.get_changes_es(0, 100, copy.deepcopy(self.params), wait=5)
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(feed, {"changes": [], "last_seq": 0})
+        self.store.changes.waiting.release()
+
+    def test_write_succeeds_when_change_is_not_recorded(self):
+        def conflicting_seq(change_index, count=1):
+            raise ConflictError(409, "version_conflict_engine_exception", {})
+
+        self.store.changes.next_seq = conflicting_seq
+        with self.assertLogs("models.change_feed") as logs:
+            annotation = self.add_annotation(self.params)
+        self.assertIn(annotation["id"], logs.output[0])
+        self.assertTrue(self.store.should_exist(annotation["id"]))
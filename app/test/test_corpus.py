@@ -0,0 +1,65 @@
+import io
+import json
+import unittest
+
+from models.annotation import Annotation
+from models.annotation_store import AnnotationStore
+from benchmark.fake_es import FakeElasticsearch
+import benchmark.corpus as corpus
+from settings_unittest import server_config
+
+
+class TestCorpus(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Corpus tests")
+
+    def test_corpus_is_deterministic(self):
+        corpus1 = list(corpus.generate_corpus(200, seed=3, num_collections=2, collection_size=10))
+        corpus2 = list(corpus.generate_corpus(200, seed=3, num_collections=2, collection_size=10))
+        self.assertEqual(corpus1, corpus2)
+
+    def test_corpus_collections_do_not_change_annotations(self):
+        annotations = list(corpus.generate_annotations(200, seed=3))
+        records = list(corpus.generate_corpus(200, seed=3, num_collections=2, collection_size=10))
+        self.assertEqual(records[:200], annotations)
+
+    def test_corpus_has_all_target_shapes(self):
+        selector_types = set()
+        for record in corpus.generate_annotations(200, seed=3):
+            for target in record["annotation"]["target"]:
+                if target["type"] != "Annotation":
+                    selector_types.add(target["selector"]["type"] if target["selector"] else None)
+        self.assertEqual(selector_types, {None, "SubresourceSelector", "NestedPIDSelector"})
+
+    def test_corpus_annotations_are_valid(self):
+        for record in corpus.generate_annotations(50, seed=3, chain_depth=3):
+            Annotation(record["annotation"])
+
+    def test_corpus_chains_are_not_deeper_than_chain_depth(self):
+        depths = set(record["depth"] for record in corpus.generate_annotations(500, seed=3, chain_depth=2))
+        self.assertEqual(depths, {0, 1, 2})
+
+    def test_corpus_collection_owner_can_see_items(self):
+        records = list(corpus.generate_corpus(200, seed=3, num_collections=1, collection_size=10))
+        params = {record["annotation"]["id"]: record["params"] for record in records[:200]}
+        collection = records[200]
+        self.assertEqual(len(collection["items"]), 10)
+        for annotation_id in collection["items"]:
+            self.assertTrue(corpus.can_see(params[annotation_id], collection["params"]["username"]))
+
+    def test_corpus_can_be_read_from_ndjson(self):
+        records = list(corpus.generate_corpus(20, seed=3, num_collections=1, collection_size=5))
+        fh = io.StringIO("".join(json.dumps(record) + "\n" for record in records))
+        self.assertEqual(list(corpus.read_ndjson(fh)), records)
+
+    def test_corpus_loader_computes_target_lists_like_store(self):
+        store = AnnotationStore(server_config["Elasticsearch"], es=FakeElasticsearch())
+        records = list(corpus.generate_corpus(300, seed=3, chain_depth=3, num_collections=1, collection_size=10))
+        loader = corpus.load_corpus(store, records, batch_size=50)
+        self.assertEqual(loader.indexed, 301)
+        self.assertEqual(loader.errors, [])
+        chained = [record for record in records[:300] if record["depth"] == 3][0]
+        stored = store.get_from_index_by_id(chained["annotation"]["id"])
+        self.assertEqual(stored["target_list"], store.get_target_list(Annotation(chained["annotation"])))
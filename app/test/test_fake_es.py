@@ -0,0 +1,149 @@
+import copy
+import unittest
+
+from elasticsearch.exceptions import ConflictError, NotFoundError
+from elasticsearch.helpers import scan
+from test.annotation_examples import annotations as examples, annotation_collections as example_collections
+from models.annotation import AnnotationError
+from models.annotation_store import AnnotationStore
+from benchmark.fake_es import FakeElasticsearch
+import benchmark.corpus as corpus
+import benchmark.run as benchmark
+from settings_unittest import server_config
+
+
+class TestFakeElasticsearch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Fake Elasticsearch tests")
+
+    def setUp(self):
+        self.es = FakeElasticsearch()
+        self.es.indices.create(index="fake", body={"aliases": {"fake_all": {}}})
+
+    def test_fake_es_create_conflicts_on_existing_id(self):
+        self.es.index(index="fake", id="1", body={"id": "1"}, op_type="create")
+        with self.assertRaises(ConflictError):
+            self.es.index(index="fake", id="1", body={"id": "1"}, op_type="create")
+
+    def test_fake_es_index_checks_seq_no(self):
+        response = self.es.index(index="fake", id="1", body={"id": "1"})
+        self.es.index(index="fake", id="1", body={"id": "1", "label": "new"}, if_seq_no=response["_seq_no"],
+                      if_primary_term=1)
+        with self.assertRaises(ConflictError):
+            self.es.index(index="fake", id="1", body={"id": "1"}, if_seq_no=response["_seq_no"], if_primary_term=1)
+
+    def test_fake_es_get_missing_raises_not_found(self):
+        with self.assertRaises(NotFoundError):
+            self.es.get(index="fake", id="missing")
+
+    def test_fake_es_search_filters_sorts_and_pages(self):
+        for doc_num in range(5):
+            self.es.index(index="fake", id=str(doc_num), body={"id": str(doc_num), "status": "deleted"
+                          if doc_num % 2 else "active", "body": {"value": "Vincent van Gogh"}})
+        query = {"query": {"bool": {"filter": [{"term": {"status": "active"}}],
+                                    "must": [{"simple_query_string": {"query": "vincent", "fields": ["body.value"],
+                                                                      "default_operator": "and"}}]}},
+                 "sort": [{"id.keyword": "asc"}], "size": 2, "_source": {"includes": ["id"]}}
+        response = self.es.search(index="fake_all", body=query)
+        self.assertEqual(response["hits"]["total"]["value"], 3)
+        self.assertEqual([hit["_source"] for hit in response["hits"]["hits"]], [{"id": "0"}, {"id": "2"}])
+        query["search_after"] = response["hits"]["hits"][-1]["sort"]
+        response = self.es.search(index="fake_all", body=query)
+        self.assertEqual([hit["_id"] for hit in response["hits"]["hits"]], ["4"])
+
+    def test_fake_es_supports_scan(self):
+        for doc_num in range(25):
+            self.es.index(index="fake", id=str(doc_num), body={"id": str(doc_num)})
+        hits = list(scan(self.es, index="fake", query={"_source": False}, size=10))
+        self.assertEqual(len(hits), 25)
+
+
+class TestAnnotationStoreWithFakeElasticsearch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Annotation Store with Fake Elasticsearch tests")
+
+    def setUp(self):
+        self.store = AnnotationStore(server_config["Elasticsearch"], es=FakeElasticsearch())
+        self.params = {"page": 0, "username": "user1", "access_status": ["private"]}
+
+    def test_store_can_add_update_and_remove_annotation(self):
+        annotation = self.store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(self.params))
+        with self.assertRaises(AnnotationError):
+            self.store.add_annotation_es(copy.deepcopy(annotation), copy.deepcopy(self.params))
+        annotation["motivation"] = "commenting"
+        updated = self.store.update_annotation_es(copy.deepcopy(annotation), copy.deepcopy(self.params))
+        self.assertEqual(updated["motivation"], "commenting")
+        self.store.remove_annotation_es(annotation["id"], copy.deepcopy(self.params))
+        self.assertTrue(self.store.is_deleted(annotation["id"]))
+        with self.assertRaises(AnnotationError):
+            self.store.get_annotation_es(annotation["id"], copy.deepcopy(self.params))
+
+    def test_store_can_page_annotations_by_target(self):
+        for _ in range(3):
+            self.store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(self.params))
+        params = {"page": 0, "page_size": 2, "cursor": [], "username": "user1", "access_status": ["private"],
+                  "filter": {"target_id": ["urn:vangogh:testletter.sender"]}}
+        response = self.store.get_annotations_es(params)
+        self.assertEqual(response["total"], 3)
+        self.assertEqual(len(response["annotations"]), 2)
+        self.assertNotEqual(response["cursor"], None)
+
+    def test_store_updates_collection_items_in_batch_without_reading_items(self):
+        annotations = [self.store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(self.params))
+                       for _ in range(3)]
+        collection = self.store.create_collection_es(copy.deepcopy(example_collections["empty_collection"]),
+                                                     copy.deepcopy(self.params))
+        update = self.store.es.update
+        updated_sources = []
+
+        def recorded_update(*args, **kwargs):
+            response = update(*args, **kwargs)
+            if kwargs.get("doc_type") == "AnnotationCollection":
+                updated_sources.append(response["get"]["_source"])
+            return response
+
+        self.store.es.update = recorded_update
+        annotation_ids = [annotation["id"] for annotation in annotations]
+        result = self.store.update_collection_items_es(collection["id"], annotation_ids, [], copy.deepcopy(self.params))
+        self.assertEqual(result["total"], 3)
+        result = self.store.update_collection_items_es(collection["id"], [], annotation_ids[:1],
+                                                       copy.deepcopy(self.params))
+        self.assertEqual(result["total"], 2)
+        self.assertEqual(len(updated_sources), 2)
+        self.assertTrue(all("items" not in source for source in updated_sources))
+        self.assertEqual(self.store.get_collection_items(collection["id"]), annotation_ids[1:])
+
+    def test_store_rollover_names_new_index_after_the_write_index(self):
+        config = dict(server_config["Elasticsearch"], rollover=True)
+        store = AnnotationStore(config, es=FakeElasticsearch())
+        read_alias = store.tenant_index()
+        for _ in range(2):
+            store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(self.params))
+            self.assertTrue(store.rollover_indices(conditions={"max_docs": 1})[read_alias])
+        backing_indices = sorted(store.es.indices.get_alias(name=read_alias))
+        self.assertEqual([name[-6:] for name in backing_indices], ["000001", "000002", "000003"])
+        # with a backing index gone, counting the backing indices would give the name of the write index
+        store.es.indices.delete(backing_indices[0])
+        store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(self.params))
+        self.assertTrue(store.rollover_indices(conditions={"max_docs": 1})[read_alias])
+        write_index = [name for name, index in store.es.indices.get_alias(name=read_alias + "-write").items()
+                       if index["aliases"][read_alias + "-write"].get("is_write_index")]
+        self.assertEqual([name[-6:] for name in write_index], ["000004"])
+
+
+class TestBenchmark(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Benchmark tests")
+
+    def test_benchmark_runs_all_operations(self):
+        items = list(corpus.generate_annotations(100, seed=1))
+        store = AnnotationStore(server_config["Elasticsearch"], es=FakeElasticsearch())
+        stats = benchmark.run_benchmark(store, items, iterations=2, collection_size=20, page_size=10, seed=1)
+        for operation in benchmark.operations:
+            self.assertEqual(stats[operation].summary()["count"], len(items) if operation == "create" else 2)
@@ -0,0 +1,107 @@
+import unittest
+from flask import Flask
+from models.error import InvalidUsage
+import models.queries as query_helper
+from parse.headers_params import get_params, get_link_params, check_result_window
+from settings import server_config
+
+
+class TestHeadersParams(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Headers and Parameters parsing tests")
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.max_page_size = server_config["Elasticsearch"]["max_page_size"]
+
+    def get_params(self, query_string):
+        with self.app.test_request_context("/api/v1/annotations/", query_string=query_string) as context:
+            return get_params(context.request)
+
+    def get_error(self, query_string):
+        error = None
+        try:
+            self.get_params(query_string)
+        except InvalidUsage as err:
+            error = err
+        return error
+
+    def test_params_default_to_first_page(self):
+        params = self.get_params({})
+        self.assertEqual(params["page"], 0)
+        self.assertEqual(params["page_size"], server_config["Elasticsearch"]["page_size"])
+        self.assertEqual(params["cursor"], None)
+        self.assertEqual(params["show_page"], False)
+
+    def test_params_contain_requested_page(self):
+        params = self.get_params({"page": 3})
+        self.assertEqual(params["page"], 3)
+        self.assertEqual(params["show_page"], True)
+        self.assertEqual(params["view"], "PreferContainedIRIs")
+
+    def test_params_reject_invalid_page(self):
+        self.assertNotEqual(self.get_error({"page": -1}), None)
+        self.assertNotEqual(self.get_error({"page": "first"}), None)
+
+    def test_params_contain_requested_page_size(self):
+        params = self.get_params({"page_size": 10})
+        self.assertEqual(params["page_size"], 10)
+        self.assertEqual(params["container_page_size"], 10)
+
+    def test_container_page_size_defaults_to_container_default(self):
+        params = self.get_params({})
+        self.assertEqual(params["container_page_size"], min(100, server_config["Elasticsearch"]["page_size"]))
+
+    def test_params_reject_page_size_out_of_bounds(self):
+        self.assertNotEqual(self.get_error({"page_size": 0}), None)
+        self.assertNotEqual(self.get_error({"page_size": self.max_page_size + 1}), None)
+
+    def test_params_reject_page_beyond_result_window(self):
+        params = self.get_params({"page": 100000, "page_size": 10})
+        self.assertRaises(InvalidUsage, check_result_window, params)
+        # cursor pages are not limited by the result window
+        check_result_window(self.get_params({"cursor": "", "page_size": 10}))
+
+    def test_params_can_start_cursor(self):
+        params = self.get_params({"cursor": ""})
+        self.assertEqual(params["cursor"], [])
+        self.assertEqual(params["show_page"], True)
+
+    def test_params_can_decode_cursor(self):
+        cursor = query_helper.encode_cursor(["urn:uuid:1234"])
+        params = self.get_params({"cursor": cursor})
+        self.assertEqual(params["cursor"], ["urn:uuid:1234"])
+
+    def test_params_reject_invalid_cursor(self):
+        self.assertNotEqual(self.get_error({"cursor": "not a cursor"}), None)
+
+    def test_params_contain_requested_fields(self):
+        params = self.get_params({"fields": "body, motivation"})
+        self.assertEqual(params["fields"], ["body", "motivation"])
+
+    def test_params_reject_empty_field_names(self):
+        self.assertNotEqual(self.get_error({"fields": "body,,motivation"}), None)
+
+    def test_params_contain_requested_facets(self):
+        params = self.get_params({"facets": "target_id,created", "facet_size": 20})
+        self.assertEqual(params["facets"], ["target_id", "created"])
+        self.assertEqual(params["facet_size"], 20)
+
+    def test_params_reject_unknown_facets(self):
+        self.assertNotEqual(self.get_error({"facets": "target_id,body"}), None)
+
+    def test_params_contain_full_text_query(self):
+        params = self.get_params({"q": "van gogh"})
+        self.assertEqual(params["query"], "van gogh")
+
+    def test_link_params_exclude_page_parameters(self):
+        query_string = {"page": 2, "iris": 1, "page_size": 10, "target_id": "urn:vangogh:testletter.sender"}
+        with self.app.test_request_context("/api/v1/annotations/", query_string=query_string) as context:
+            link_params = get_link_params(context.request)
+        self.assertEqual(link_params, {"page_size": "10", "target_id": "urn:vangogh:testletter.sender"})
+
+
+if __name__ == "__main__":
+    unittest.main()
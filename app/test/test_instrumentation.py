@@ -0,0 +1,59 @@
+import unittest
+import models.instrumentation as instrumentation
+
+
+class FakeIndicesClient(object):
+
+    def refresh(self, index=None):
+        return {"index": index}
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.indices = FakeIndicesClient()
+
+    def get(self, index=None, id=None):
+        return {"_index": index, "_id": id}
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Instrumentation tests")
+
+    def setUp(self):
+        instrumentation.metrics.reset()
+
+    def test_instrumented_client_counts_calls_per_operation(self):
+        es = instrumentation.InstrumentedElasticsearch(FakeClient())
+        self.assertEqual(es.get(index="swa", id="1")["_id"], "1")
+        es.indices.refresh(index="swa")
+        rendered = instrumentation.metrics.render()
+        self.assertIn('swa_es_requests_total{operation="get"} 1', rendered)
+        self.assertIn('swa_es_requests_total{operation="indices.refresh"} 1', rendered)
+
+    def test_request_timings_include_es_calls_and_sections(self):
+        es = instrumentation.InstrumentedElasticsearch(FakeClient())
+        token = instrumentation.start_request()
+        es.get(index="swa", id="1")
+        es.get(index="swa", id="2")
+        with instrumentation.timed("permissions"):
+            pass
+        timings = instrumentation.finish_request(token, "annotations_api", "GET")
+        self.assertEqual(timings.es_calls, 2)
+        self.assertIn("permissions", timings.sections)
+        self.assertIn('desc="2 calls"', timings.server_timing())
+
+    def test_histogram_buckets_are_cumulative(self):
+        instrumentation.metrics.observe("test_seconds", 0.003)
+        instrumentation.metrics.observe("test_seconds", 0.3)
+        rendered = instrumentation.metrics.render()
+        self.assertIn('test_seconds_bucket{le="0.005"} 1', rendered)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 2', rendered)
+        self.assertIn('test_seconds_count 2', rendered)
+
+
+if __name__ == "__main__":
+    unittest.main()
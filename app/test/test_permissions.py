@@ -155,6 +155,25 @@ class TestPermissionModel(unittest.TestCase):
         self.assertEqual(permissions.is_allowed_action(params["can_see"][0], "see", annotation), True)
         self.assertEqual(permissions.is_allowed_action(params["can_see"][0], "edit", annotation), False)
 
+    def test_permission_sets_follow_updated_permissions(self):
+        annotation = Annotation(self.example_annotation)
+        permissions.add_permissions(annotation, self.shared_params)
+        self.assertEqual(annotation.permission_sets.can_see, frozenset(["user2", "user3", "user4"]))
+        permissions.add_permissions(annotation, {"access_status": ["public"], "username": "user1"})
+        self.assertEqual(permissions.is_allowed_to_edit("user4", annotation), False)
+        annotation.permissions = {"access_status": ["private"], "owner": "user2"}
+        self.assertEqual(permissions.is_allowed_to_see("user1", annotation), False)
+        self.assertEqual(permissions.is_allowed_to_see("user2", annotation), True)
+
+
+    def test_user_can_see_annotation_shared_with_group(self):
+        annotation = Annotation(self.example_annotation)
+        params = {"access_status": "shared", "username": "user1", "can_see": ["group:project"]}
+        permissions.add_permissions(annotation, params)
+        self.assertEqual(permissions.is_allowed_to_see("user2", annotation, groups=["group:project"]), True)
+        self.assertEqual(permissions.is_allowed_to_see("user2", annotation, groups=["group:other"]), False)
+        self.assertEqual(permissions.is_allowed_to_edit("user2", annotation, groups=["group:project"]), False)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,84 @@
+import copy
+import json
+import marshal
+import unittest
+from types import SimpleNamespace
+import models.profiling as profiling
+import models.permissions as permissions
+import server
+from settings_unittest import server_config
+
+
+def get_json(response):
+    return json.loads(response.get_data(as_text=True))
+
+
+class TestProfiling(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Profiling tests")
+
+    def setUp(self):
+        profiling.profiles.reset()
+        config = copy.deepcopy(server_config)
+        config["SWAServer"]["profiling_token"] = "secret"
+        self.app = server.create_app(config).test_client()
+
+    def test_token_must_match(self):
+        self.assertTrue(profiling.is_valid_token("secret", "secret"))
+        self.assertFalse(profiling.is_valid_token("guess", "secret"))
+        self.assertFalse(profiling.is_valid_token(None, "secret"))
+        self.assertFalse(profiling.is_valid_token("secret", None))
+
+    def test_profile_store_aggregates_hot_frames_of_modules(self):
+        store = profiling.ProfileStore(modules=["models/permissions.py"])
+        profiler = store.start()
+        permissions.is_allowed_action("user1", "see", SimpleNamespace(permissions={"access_status": ["public"],
+                                                                                 "owner": "user1"}))
+        profile = store.stop(profiler, "GET", "/", "root", 0.1)
+        self.assertEqual(store.get_profile(profile.profile_id), profile)
+        frames = store.hot_frames()
+        self.assertTrue(len(frames) > 0)
+        self.assertTrue(all("permissions.py" in frame["function"] for frame in frames))
+
+    def test_profile_store_profiles_one_request_at_a_time(self):
+        store = profiling.ProfileStore()
+        profiler = store.start()
+        self.assertEqual(store.start(), None)
+        store.stop(profiler, "GET", "/", "root", 0.1)
+
+    def test_profile_store_keeps_most_recent_profiles(self):
+        store = profiling.ProfileStore(max_profiles=2)
+        for _ in range(3):
+            store.stop(store.start(), "GET", "/", "root", 0.1)
+        self.assertEqual([profile["id"] for profile in store.list_profiles()], [3, 2])
+        self.assertEqual(store.num_profiled, 3)
+
+    def test_request_without_token_is_not_profiled(self):
+        response = self.app.get("/ns/swao.jsonld")
+        self.assertNotIn("X-Profile-Id", response.headers)
+        self.assertEqual(profiling.profiles.num_profiled, 0)
+
+    def test_request_with_token_is_profiled(self):
+        response = self.app.get("/ns/swao.jsonld", headers={"X-Profile-Token": "secret"})
+        self.assertIn("X-Profile-Id", response.headers)
+        profile_url = "/profiles/" + response.headers["X-Profile-Id"]
+        response = self.app.get(profile_url + "?all_modules=true", headers={"X-Profile-Token": "secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_json(response)["endpoint"], "swao-jsonld")
+        self.assertTrue(len(get_json(response)["hot_frames"]) > 0)
+        response = self.app.get(profile_url + "?format=pstats", headers={"X-Profile-Token": "secret"})
+        self.assertIsInstance(marshal.loads(response.get_data()), dict)
+
+    def test_profiles_endpoint_requires_token(self):
+        response = self.app.get("/profiles")
+        self.assertEqual(response.status_code, 403)
+        response = self.app.get("/profiles", headers={"X-Profile-Token": "secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_json(response)["profiled_requests"], 0)
+
+    def test_profiling_is_not_registered_without_token(self):
+        app = server.create_app(server_config).test_client()
+        response = app.get("/profiles", headers={"X-Profile-Token": "secret"})
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,93 @@
+import unittest
+import models.queries as query_helper
+
+
+class TestQueries(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Query helper tests")
+
+    def test_source_filter_for_iris_view_only_includes_id(self):
+        source_filter = query_helper.make_source_filter({"view": "PreferContainedIRIs"})
+        self.assertEqual(source_filter, {"includes": ["id", "type"]})
+
+    def test_source_filter_for_descriptions_view_excludes_internal_fields(self):
+        source_filter = query_helper.make_source_filter({"view": "PreferContainedDescriptions"})
+        self.assertEqual(source_filter, {"excludes": ["target_list", "permissions"]})
+
+    def test_source_filter_for_descriptions_view_can_include_permissions(self):
+        params = {"view": "PreferContainedDescriptions", "include_permissions": True}
+        source_filter = query_helper.make_source_filter(params)
+        self.assertEqual(source_filter, {"excludes": ["target_list"]})
+
+    def test_source_filter_includes_requested_fields(self):
+        params = {"view": "PreferContainedDescriptions", "fields": ["body", "id", "target_list"]}
+        source_filter = query_helper.make_source_filter(params)
+        self.assertEqual(source_filter, {"includes": ["id", "type", "body", "target_list"]})
+
+    def test_facet_aggregations_use_keyword_fields(self):
+        aggregations = query_helper.make_facet_aggregations(["target_id", "motivation"], facet_size=5)
+        self.assertEqual(aggregations["target_id"], {"terms": {"field": "target_list.id.keyword", "size": 5}})
+        self.assertEqual(aggregations["motivation"]["terms"]["field"], "motivation.keyword")
+
+    def test_facet_aggregations_count_created_per_day(self):
+        aggregations = query_helper.make_facet_aggregations(["created"])
+        self.assertEqual(aggregations["created"]["date_histogram"]["calendar_interval"], "day")
+
+    def test_facet_aggregations_reject_unknown_facet(self):
+        self.assertRaises(ValueError, query_helper.make_facet_aggregations, ["body"])
+
+    def test_search_query_applies_permissions_in_filter_context(self):
+        params = {"username": None, "access_status": None}
+        query = query_helper.make_search_query(params, "Annotation")
+        self.assertTrue("must" not in query["bool"])
+        self.assertTrue(query_helper.access_match("public") in query["bool"]["filter"])
+
+    def test_search_query_scores_only_on_text_query(self):
+        params = {"username": None, "access_status": None, "query": "van gogh"}
+        query = query_helper.make_search_query(params, "Annotation")
+        self.assertEqual(query["bool"]["must"], [query_helper.make_text_query("van gogh")])
+        self.assertTrue(query_helper.access_match("public") in query["bool"]["filter"])
+
+    def test_sort_order_uses_score_for_text_query(self):
+        self.assertEqual(query_helper.make_sort_order({}), [{"id.keyword": "asc"}])
+        self.assertEqual(query_helper.make_sort_order({"query": "gogh"})[0], {"_score": "desc"})
+
+    def test_cursor_can_be_encoded_and_decoded(self):
+        cursor = query_helper.encode_cursor(["urn:uuid:1234", 5])
+        self.assertEqual(query_helper.decode_cursor(cursor), ["urn:uuid:1234", 5])
+
+    def test_invalid_cursor_is_not_decoded(self):
+        self.assertEqual(query_helper.decode_cursor("not a cursor"), None)
+        self.assertEqual(query_helper.decode_cursor(query_helper.encode_cursor({"a": 1})), None)
+
+    def test_expired_tombstone_query_uses_retention(self):
+        query = query_helper.make_expired_tombstone_query("7d")
+        self.assertIn({"term": {"status": "deleted"}}, query["bool"]["filter"])
+        self.assertIn({"range": {"deleted": {"lt": "now-7d"}}}, query["bool"]["filter"])
+
+    def test_permission_see_query_is_memoized_per_user_and_access_status(self):
+        query = query_helper.make_permission_see_query({"username": "user1", "access_status": ["private", "shared"]})
+        same_query = query_helper.make_permission_see_query({"username": "user1",
+                                                              "access_status": ["shared", "private"]})
+        self.assertIs(query, same_query)
+        other_query = query_helper.make_permission_see_query({"username": "user2",
+                                                               "access_status": ["private", "shared"]})
+        self.assertIsNot(query, other_query)
+        self.assertEqual(len(query["bool"]["should"]), 2)
+
+    def test_permission_edit_query_accepts_single_access_status(self):
+        query = query_helper.make_permission_edit_query({"username": "user1", "access_status": "private"})
+        self.assertEqual(query, query_helper.bool_must([query_helper.private_match("user1")]))
+
+
+    def test_permission_see_query_matches_principals_of_user(self):
+        params = {"username": "user1", "access_status": ["shared"], "groups": ["group:b", "group:a"]}
+        query = query_helper.make_permission_see_query(params)
+        principals_match = {"terms": {"permissions.can_see.keyword": ["user1", "group:a", "group:b"]}}
+        self.assertIn(principals_match, query["bool"]["must"][0]["bool"]["must"][1]["bool"]["should"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,8 @@ import copy
 import json
 from elasticsearch import Elasticsearch
 import server as server
+import stores
+from benchmark.fake_es import FakeElasticsearch
 from test.annotation_examples import annotations as examples, annotation_collections as example_collections
 from models.annotation_store import AnnotationStore
 from models.user_store import UserStore
@@ -49,8 +51,7 @@ class TestAnnotationAPI(unittest.TestCase):
         # always start with empty store
         server.annotation_store = AnnotationStore(config)
         server.user_store = UserStore(config)
-        server.configure_stores(config)
-        self.app = server.app.test_client()
+        self.app = server.create_app(server_config).test_client()
         user1 = bytes(server_config["user1"]["username"] + ":" + server_config["user1"]["password"], 'ascii')
         user2 = bytes(server_config["user2"]["username"] + ":" + server_config["user2"]["password"], 'ascii')
         self.headers1 = {
@@ -187,6 +188,22 @@ class TestAnnotationAPI(unittest.TestCase):
         self.assertEqual(container["total"], 1)
         self.assertEqual(container["first"]["items"][0]["target"][0]["id"], annotation1["target"][0]["id"])
 
+    def test_GET_annotations_count_returns_total(self):
+        self.add_example(access_status="private")
+        server.annotation_store.es.indices.refresh(config["annotation_index"])
+        response = self.app.get('/api/v1/annotations/_count', headers=self.headers1)
+        self.assertEqual(get_json(response), {"total": 1})
+        response = self.app.get('/api/v1/annotations/_count')
+        self.assertEqual(get_json(response), {"total": 0})
+
+    def test_HEAD_annotations_returns_total_header(self):
+        self.add_example(access_status="private")
+        server.annotation_store.es.indices.refresh(config["annotation_index"])
+        response = self.app.head('/api/v1/annotations/', headers=self.headers1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["X-Total-Count"], "1")
+        self.assertEqual(response.get_data(), b"")
+
     def test_PUT_annotation_returns_modified_annotation(self):
         example = self.add_example()
         example["motivation"] = "linking"
@@ -216,8 +233,7 @@ class TestAnnotationAPICollectionEndpoints(unittest.TestCase):
     def setUp(self):
         # always start with empty store
         server.annotation_store = AnnotationStore(config)
-        server.configure_stores(config)
-        self.app = server.app.test_client()
+        self.app = server.create_app(server_config).test_client()
         user1 = bytes(server_config["user1"]["username"] + ":" + server_config["user1"]["password"], 'ascii')
         user2 = bytes(server_config["user2"]["username"] + ":" + server_config["user2"]["password"], 'ascii')
         self.headers1 = {
@@ -446,6 +462,52 @@ def remove_test_index():
         es.indices.delete(index=config["user_index"])
 
 
+class TestAnnotationListAPI(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Annotation List API tests")
+
+    def setUp(self):
+        self.app = server.create_app(server_config).test_client()
+        self.es = FakeElasticsearch()
+        stores.annotation_store.configure(config, es=self.es)
+        stores.user_store.configure(config, es=self.es)
+        params = {"username": "user1", "access_status": ["public"]}
+        for _ in range(150):
+            stores.annotation_store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(params))
+        self.calls = []
+        for name in ["search", "count"]:
+            self.record_calls(name)
+
+    def tearDown(self):
+        stores.configure_stores(config)
+
+    def record_calls(self, name):
+        call = getattr(self.es, name)
+
+        def recorded(*args, **kwargs):
+            self.calls.append(name)
+            return call(*args, **kwargs)
+
+        setattr(self.es, name, recorded)
+
+    def test_GET_annotation_list_takes_total_from_page_search(self):
+        response = self.app.get("/api/v1/annotations/", query_string={"page": 0})
+        self.assertEqual(response.status_code, 200)
+        annotation_page = get_json(response)
+        self.assertEqual(annotation_page["partOf"]["total"], 150)
+        self.assertEqual(len(annotation_page["items"]), 100)
+        self.assertEqual(self.calls, ["search"])
+
+    def test_GET_annotation_list_keeps_default_container_page_size(self):
+        response = self.app.get("/api/v1/annotations/")
+        container = get_json(response)
+        self.assertEqual(container["total"], 150)
+        self.assertIn("page=1", container["last"])
+        self.assertEqual(self.calls, ["search"])
+
+
 class TestUserAPI(unittest.TestCase):
 
     @classmethod
@@ -456,8 +518,7 @@ class TestUserAPI(unittest.TestCase):
         # make sure there is no previous test index
         remove_test_index()
         server.user_store = UserStore(config)
-        server.configure_stores(config)
-        self.app = server.app.test_client()
+        self.app = server.create_app(server_config).test_client()
         self.testuser = "testuser"
         self.testpass = "testpass"
         self.headers = {
@@ -0,0 +1,85 @@
+import copy
+import json
+import unittest
+
+from test.annotation_examples import annotations as examples
+from models.annotation_store import AnnotationStore
+import models.instrumentation as instrumentation
+from models.slow_query_log import SlowQueryLog, make_slow_query_log, logger
+from benchmark.fake_es import FakeElasticsearch
+from settings_unittest import server_config
+
+
+class TestSlowQueryLog(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Slow Query Log tests")
+
+    def setUp(self):
+        self.config = copy.deepcopy(server_config["Elasticsearch"])
+        self.config["slow_query_threshold_ms"] = 0
+
+    def assert_no_entries(self, slow_query_log, *args):
+        # assertNoLogs is not available before Python 3.10, a last message makes sure something is logged
+        with self.assertLogs("swa.slow_queries") as logs:
+            slow_query_log.record(*args)
+            logger.warning("no entries")
+        self.assertEqual([record.getMessage() for record in logs.records], ["no entries"])
+
+    def test_slow_query_log_can_be_disabled(self):
+        self.config["slow_query_threshold_ms"] = None
+        self.assertEqual(make_slow_query_log(self.config), None)
+        store = AnnotationStore(self.config, es=FakeElasticsearch())
+        self.assertIsInstance(store.es, FakeElasticsearch)
+
+    def test_slow_query_log_ignores_fast_calls(self):
+        slow_query_log = SlowQueryLog(threshold=1.0)
+        self.assert_no_entries(slow_query_log, "search", 0.5, {"index": "swa"})
+
+    def test_slow_query_log_is_rate_limited(self):
+        slow_query_log = SlowQueryLog(threshold=0.0, rate_limit=2)
+        with self.assertLogs("swa.slow_queries") as logs:
+            for _ in range(5):
+                slow_query_log.record("search", 0.5, {"index": "swa"})
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(slow_query_log.suppressed, 3)
+
+    def test_slow_query_log_can_be_sampled(self):
+        slow_query_log = SlowQueryLog(threshold=0.0, sample_rate=0.0)
+        self.assert_no_entries(slow_query_log, "search", 0.5, {"index": "swa"})
+
+    def test_slow_query_entry_has_no_body_of_writes(self):
+        slow_query_log = SlowQueryLog(threshold=0.0)
+        annotation = copy.deepcopy(examples["vincent"])
+        entry = slow_query_log.make_entry("index", 0.5, {"index": "swa", "id": "a1", "body": annotation})
+        self.assertNotIn("body", entry)
+        self.assertEqual(entry["id"], "a1")
+
+    def test_slow_query_entry_has_query_params_and_hits(self):
+        store = AnnotationStore(self.config, es=FakeElasticsearch())
+        params = {"page": 0, "username": "user1", "access_status": ["private"]}
+        store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(params))
+        params["filter"] = {"target_id": ["urn:vangogh:testletter.sender"]}
+        with self.assertLogs("swa.slow_queries") as logs:
+            store.get_annotations_es(params)
+        entries = [json.loads(record.getMessage()) for record in logs.records]
+        entry = [entry for entry in entries if entry["operation"] == "search"][0]
+        self.assertEqual(entry["hits"], 1)
+        self.assertEqual(entry["params"]["filter"], params["filter"])
+        self.assertIn("query", entry["body"])
+        self.assertIn("took_ms", entry)
+
+    def test_slow_query_log_is_a_hook_of_the_instrumented_client(self):
+        es = instrumentation.InstrumentedElasticsearch(FakeElasticsearch())
+        store = AnnotationStore(self.config, es=es)
+        instrumentation.metrics.reset()
+        # a single wrapper records the metrics and logs the slow calls
+        self.assertIsInstance(store.es.client, FakeElasticsearch)
+        self.assertEqual(len(store.es.hooks), 2)
+        with self.assertLogs("swa.slow_queries") as logs:
+            store.count_annotations_es({"username": "user1", "access_status": ["private"]})
+        operations = [json.loads(record.getMessage())["operation"] for record in logs.records]
+        self.assertEqual(operations.count("count"), 1)
+        self.assertIn('swa_es_requests_total{operation="count"} 1', instrumentation.metrics.render())
+
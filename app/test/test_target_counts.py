@@ -0,0 +1,169 @@
+import copy
+import threading
+import time
+import unittest
+
+from test.annotation_examples import annotations as examples
+from models.annotation_store import AnnotationStore
+from models.target_counts import TargetCounts, get_access_keys
+from benchmark.fake_es import FakeElasticsearch
+from settings_unittest import server_config
+
+
+def make_annotation(annotation_id, target_ids, permissions):
+    return {"id": annotation_id, "type": "Annotation", "permissions": permissions,
+            "target_list": [{"id": target_id, "type": "Text"} for target_id in target_ids]}
+
+
+class TestTargetCounts(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Target Counts tests")
+
+    def setUp(self):
+        self.es = FakeElasticsearch()
+        self.es.indices.create(index="counts")
+        self.target_counts = TargetCounts(self.es)
+        self.target_counts.load("counts")
+
+    def test_access_keys_include_owner_and_principals_of_shared_annotation(self):
+        keys = get_access_keys({"access_status": ["shared"], "owner": "user1", "can_see": ["user2", "group:a"]})
+        self.assertEqual(keys, ("shared:user1", "shared:user2", "shared:group:a"))
+        self.assertEqual(get_access_keys({"access_status": ["public"], "owner": "user1"}), ("public",))
+
+    def test_counts_follow_writes_of_annotation(self):
+        permissions = {"access_status": ["private"], "owner": "user1"}
+        self.target_counts.set("counts", "a1", make_annotation("a1", ["t1", "t2"], permissions))
+        counts = self.target_counts.get_counts("counts", ["t1", "t2"], username="user1")
+        self.assertEqual(counts["t1"], {"private": 1, "total": 1})
+        # a new version replaces the counts of the previous version
+        self.target_counts.set("counts", "a1", make_annotation("a1", ["t2"], permissions))
+        counts = self.target_counts.get_counts("counts", ["t1", "t2"], username="user1")
+        self.assertEqual(counts["t1"]["total"], 0)
+        self.assertEqual(counts["t2"]["total"], 1)
+        self.target_counts.set("counts", "a1", None)
+        self.assertEqual(self.target_counts.counts["counts"], {})
+
+    def test_counts_depend_on_access_of_user(self):
+        self.target_counts.set("counts", "a1", make_annotation("a1", ["t1"], {"access_status": ["public"],
+                                                                               "owner": "user1"}))
+        self.target_counts.set("counts", "a2", make_annotation("a2", ["t1"], {"access_status": ["shared"],
+                                                                               "owner": "user1",
+                                                                               "can_see": ["group:a"]}))
+        counts = self.target_counts.get_counts("counts", ["t1"])
+        self.assertEqual(counts["t1"], {"public": 1, "total": 1})
+        counts = self.target_counts.get_counts("counts", ["t1"], username="user2", groups=["group:a"],
+                                               access_status=["shared", "public"])
+        self.assertEqual(counts["t1"], {"shared": 1, "public": 1, "total": 2})
+        counts = self.target_counts.get_counts("counts", ["t1"], username="user3", access_status=["shared"])
+        self.assertEqual(counts["t1"], {"shared": 0, "total": 0})
+
+    def test_annotation_visible_in_several_ways_is_counted_once(self):
+        self.target_counts.set("counts", "a1", make_annotation("a1", ["t1"], {"access_status": ["shared", "public"],
+                                                                               "owner": "user1",
+                                                                               "can_see": ["user2", "group:a",
+                                                                                           "group:b"]}))
+        counts = self.target_counts.get_counts("counts", ["t1"], username="user2", groups=["group:a", "group:b"],
+                                               access_status=["shared", "public"])
+        self.assertEqual(counts["t1"], {"shared": 1, "public": 1, "total": 1})
+
+    def test_index_is_loaded_once_for_concurrent_threads(self):
+        target_counts = TargetCounts(self.es)
+        refresh = self.es.indices.refresh
+        refreshes = []
+
+        def slow_refresh(index=None, **kwargs):
+            refreshes.append(index)
+            time.sleep(0.1)
+            return refresh(index=index, **kwargs)
+
+        self.es.indices.refresh = slow_refresh
+        results = []
+
+        def get_counts():
+            try:
+                results.append(target_counts.get_counts("counts", ["t1"])["t1"]["total"])
+            except Exception as error:
+                results.append(error)
+
+        threads = [threading.Thread(target=get_counts) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [0] * 4)
+        self.assertEqual(refreshes, ["counts"])
+
+    def test_counts_follow_writes_of_other_processes_through_change_feed(self):
+        es = FakeElasticsearch()
+        config = dict(server_config["Elasticsearch"], target_count_refresh_interval=0)
+        store = AnnotationStore(config, es=es)
+        other_store = AnnotationStore(config, es=es)
+        params = {"username": "user1", "access_status": ["public"]}
+        target_id = "urn:vangogh:testletter.sender"
+        self.assertEqual(store.get_target_counts_es([target_id], copy.deepcopy(params))["counts"][target_id]["total"], 0)
+        annotation = other_store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(params))
+        other_store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(params))
+        other_store.remove_annotation_es(annotation["id"], copy.deepcopy(params))
+        # only the changed annotations are read, the index isn't scanned again
+        store.target_counts.load_index = None
+        self.assertEqual(store.get_target_counts_es([target_id], copy.deepcopy(params))["counts"][target_id]["total"], 1)
+
+    def test_store_counts_equal_reloaded_counts(self):
+        store = AnnotationStore(server_config["Elasticsearch"], es=FakeElasticsearch())
+        params = {"username": "user1", "access_status": ["private", "public"]}
+        target_id = "urn:vangogh:testletter.sender"
+        annotation = store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(params))
+        store.add_annotation_es(copy.deepcopy(examples["vincent"]), {"username": "user1", "access_status": ["public"]})
+        store.remove_annotation_es(annotation["id"], copy.deepcopy(params))
+        counts = store.get_target_counts_es([target_id], copy.deepcopy(params))["counts"]
+        self.assertEqual(counts[target_id], {"private": 0, "public": 1, "total": 1})
+        store.target_counts.load(store.tenant_index())
+        self.assertEqual(store.get_target_counts_es([target_id], copy.deepcopy(params))["counts"], counts)
+
+    def test_sync_waits_for_changed_annotations_that_are_not_visible_yet(self):
+        es = FakeElasticsearch()
+        config = dict(server_config["Elasticsearch"], target_count_refresh_interval=0)
+        store = AnnotationStore(config, es=es)
+        other_store = AnnotationStore(config, es=es)
+        params = {"username": "user1", "access_status": ["public"]}
+        target_id = "urn:vangogh:testletter.sender"
+        self.assertEqual(store.get_target_counts_es([target_id], copy.deepcopy(params))["counts"][target_id]["total"], 0)
+        last_seq = store.target_counts.last_seq[store.tenant_index()]
+        annotation = other_store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(params))
+        mget = es.mget
+        lagging_ids = {annotation["id"]}
+
+        def lagging_mget(body=None, **kwargs):
+            response = mget(body=body, **kwargs)
+            return {"docs": [{"_id": doc["_id"], "found": False} if doc["_id"] in lagging_ids else doc
+                             for doc in response["docs"]]}
+
+        es.mget = lagging_mget
+        self.assertEqual(store.get_target_counts_es([target_id], copy.deepcopy(params))["counts"][target_id]["total"], 0)
+        # the change isn't skipped, the next sync reads the annotation again
+        self.assertEqual(store.target_counts.last_seq[store.tenant_index()], last_seq)
+        lagging_ids.clear()
+        self.assertEqual(store.get_target_counts_es([target_id], copy.deepcopy(params))["counts"][target_id]["total"], 1)
+        self.assertEqual(store.target_counts.last_seq[store.tenant_index()], last_seq + 1)
+
+    def test_sync_reads_changed_annotations_with_realtime_multi_get(self):
+        es = FakeElasticsearch()
+        config = dict(server_config["Elasticsearch"], target_count_refresh_interval=0)
+        store = AnnotationStore(config, es=es)
+        params = {"username": "user1", "access_status": ["public"]}
+        target_id = "urn:vangogh:testletter.sender"
+        store.get_target_counts_es([target_id], copy.deepcopy(params))
+        AnnotationStore(config, es=es).add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(params))
+        searched = []
+        search = es.search
+
+        def recorded_search(index=None, **kwargs):
+            searched.append(index)
+            return search(index=index, **kwargs)
+
+        es.search = recorded_search
+        self.assertEqual(store.get_target_counts_es([target_id], copy.deepcopy(params))["counts"][target_id]["total"], 1)
+        # only the change index is searched
+        self.assertNotIn(store.tenant_index(), searched)
@@ -0,0 +1,69 @@
+import copy
+import unittest
+import models.tenant as tenant
+from test.annotation_examples import annotations as examples
+from models.annotation import AnnotationError
+from models.annotation_store import AnnotationStore
+from models.error import InvalidUsage
+from benchmark.fake_es import FakeElasticsearch
+from settings_unittest import server_config
+
+
+class TestTenant(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Tenant routing tests")
+
+    def test_project_index_name_without_project_is_base_index(self):
+        self.assertEqual(tenant.project_index_name("swa", None), "swa")
+
+    def test_project_index_name_includes_project(self):
+        self.assertEqual(tenant.project_index_name("swa", "letters"), "swa__letters")
+
+    def test_all_projects_alias_is_not_a_valid_project(self):
+        self.assertEqual(tenant.all_projects_alias("swa"), "swa__all")
+        self.assertRaises(InvalidUsage, tenant.validate_project, "all")
+
+    def test_invalid_project_name_is_rejected(self):
+        for project in ["Letters", "_letters", "letters,diaries", "letters*", "a" * 65]:
+            self.assertRaises(InvalidUsage, tenant.validate_project, project)
+
+    def test_project_is_set_and_reset(self):
+        self.assertEqual(tenant.get_project(), None)
+        token = tenant.set_project("letters")
+        self.assertEqual(tenant.get_project(), "letters")
+        tenant.reset_project(token)
+        self.assertEqual(tenant.get_project(), None)
+
+    def test_reading_unknown_project_does_not_create_index(self):
+        store = AnnotationStore(server_config["Elasticsearch"], es=FakeElasticsearch())
+        params = {"page": 0, "username": "user1", "access_status": ["private"]}
+        project_index = tenant.project_index_name(store.es_index, "letters")
+        token = tenant.set_project("letters")
+        try:
+            with self.assertRaises(AnnotationError) as context:
+                store.get_annotations_es(copy.deepcopy(params))
+            self.assertEqual(context.exception.status_code, 404)
+            self.assertFalse(store.es.indices.exists(index=project_index))
+            # the first write creates the index of the project
+            store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(params))
+            self.assertTrue(store.es.indices.exists(index=project_index))
+            self.assertEqual(store.get_annotations_es(copy.deepcopy(params))["total"], 1)
+        finally:
+            tenant.reset_project(token)
+
+    def test_writing_to_unconfigured_project_is_rejected(self):
+        config = dict(server_config["Elasticsearch"], projects=["letters"])
+        store = AnnotationStore(config, es=FakeElasticsearch())
+        params = {"username": "user1", "access_status": ["private"]}
+        token = tenant.set_project("diaries")
+        try:
+            self.assertRaises(AnnotationError, store.add_annotation_es, copy.deepcopy(examples["vincent"]), params)
+            self.assertFalse(store.es.indices.exists(index=tenant.project_index_name(store.es_index, "diaries")))
+        finally:
+            tenant.reset_project(token)
+
+
+if __name__ == "__main__":
+    unittest.main()
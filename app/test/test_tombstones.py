@@ -0,0 +1,124 @@
+import copy
+import threading
+import time
+import unittest
+
+from test.annotation_examples import annotations as examples
+from models.annotation_store import AnnotationStore, make_tombstone
+from models.tombstones import TombstoneRegistry, TombstoneCompactor
+from benchmark.fake_es import FakeElasticsearch
+from settings_unittest import server_config
+
+
+def make_comment(target_id):
+    return {"@context": "http://www.w3.org/ns/anno.jsonld", "type": "Annotation", "motivation": "commenting",
+            "body": [{"type": "TextualBody", "value": "a comment"}],
+            "target": [{"id": target_id, "type": "Annotation"}]}
+
+
+class TestTombstones(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Tombstone tests")
+
+    def setUp(self):
+        self.es = FakeElasticsearch()
+        self.es.indices.create(index="tombstones")
+        self.params = {"username": "user1", "access_status": ["private"]}
+
+    def test_registry_loads_tombstones_and_follows_deletes(self):
+        self.es.index(index="tombstones", id="a1", body=make_tombstone("a1", "Annotation"))
+        self.es.index(index="tombstones", id="a2", body={"id": "a2", "type": "Annotation"})
+        registry = TombstoneRegistry(self.es)
+        self.assertTrue(registry.is_deleted("tombstones", "a1"))
+        self.assertFalse(registry.is_deleted("tombstones", "a2"))
+        registry.add("tombstones", "a2")
+        self.assertTrue(registry.is_deleted("tombstones", "a2"))
+        # after clearing, the tombstones are loaded again
+        registry.clear()
+        self.assertTrue(registry.is_deleted("tombstones", "a1"))
+        self.assertFalse(registry.is_deleted("tombstones", "a2"))
+
+    def test_registry_loads_index_once_for_concurrent_threads(self):
+        registry = TombstoneRegistry(self.es)
+        search = self.es.search
+        searches = []
+
+        def slow_search(index=None, **kwargs):
+            searches.append(index)
+            time.sleep(0.1)
+            return search(index=index, **kwargs)
+
+        self.es.search = slow_search
+        errors = []
+
+        def check():
+            try:
+                registry.is_deleted("tombstones", "a1")
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=check) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(searches, ["tombstones"])
+
+    def test_registry_update_only_reads_recent_tombstones_without_refresh(self):
+        self.es.index(index="tombstones", id="a1", body=make_tombstone("a1", "Annotation"))
+        registry = TombstoneRegistry(self.es, refresh_interval=0)
+        registry.load("tombstones")
+        self.es.index(index="tombstones", id="a2", body=make_tombstone("a2", "Annotation"))
+        refreshes, queries = [], []
+        self.es.indices.refresh = lambda index=None, **kwargs: refreshes.append(index)
+        search = self.es.search
+
+        def recorded_search(**kwargs):
+            queries.append(kwargs)
+            return search(**kwargs)
+
+        self.es.search = recorded_search
+        self.assertTrue(registry.is_deleted("tombstones", "a2"))
+        self.assertTrue(registry.is_deleted("tombstones", "a1"))
+        self.assertEqual(refreshes, [])
+        self.assertTrue(all("range" in str(query) for query in queries))
+        # tombstones that are purged after the retention period are dropped from the registry
+        self.es.delete(index="tombstones", id="a1")
+        registry.expire("0s")
+        self.assertFalse(registry.is_deleted("tombstones", "a1"))
+
+    def test_store_loads_tombstones_with_the_index(self):
+        es = FakeElasticsearch()
+        store = AnnotationStore(server_config["Elasticsearch"], es=es)
+        self.assertIn(store.es_index, store.tombstones.synced_at)
+
+    def test_target_deleted_by_other_worker_is_skipped(self):
+        es = FakeElasticsearch()
+        store = AnnotationStore(server_config["Elasticsearch"], es=es)
+        other_store = AnnotationStore(server_config["Elasticsearch"], es=es)
+        target = store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(self.params))
+        # the registry of the store is loaded before the other worker deletes the target
+        self.assertFalse(store.is_deleted(target["id"]))
+        other_store.remove_annotation_es(target["id"], copy.deepcopy(self.params))
+        comment = store.add_annotation_es(make_comment(target["id"]), copy.deepcopy(self.params))
+        self.assertEqual(comment["target"][0]["id"], target["id"])
+
+    def test_compactor_purges_expired_tombstones(self):
+        store = AnnotationStore(server_config["Elasticsearch"], es=FakeElasticsearch())
+        annotation = store.add_annotation_es(copy.deepcopy(examples["vincent"]), copy.deepcopy(self.params))
+        store.remove_annotation_es(annotation["id"], copy.deepcopy(self.params))
+        self.assertTrue(store.is_deleted(annotation["id"]))
+        compactor = TombstoneCompactor(store, 0.05, retention="0s")
+        compactor.start()
+        time.sleep(0.3)
+        compactor.stop()
+        compactor.join()
+        self.assertIsNone(store.get_document(annotation["id"]))
+        self.assertFalse(store.is_deleted(annotation["id"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
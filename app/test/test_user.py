@@ -1,5 +1,6 @@
 import unittest
 from models.user import User, pwd_context
+from models.group import Group, is_group_id
 from models.error import UserError
 
 
@@ -78,3 +79,13 @@ class TestUser(unittest.TestCase):
         user_json = user.json()
         self.assertEqual(user_json["username"], self.username)
         self.assertTrue("password_hash" in user_json)
+
+    def test_group_model_includes_owner_as_member(self):
+        group = Group({"name": "project", "owner": self.username, "members": ["user2"]})
+        self.assertTrue(is_group_id(group.group_id))
+        self.assertEqual(group.members, [self.username, "user2"])
+
+    def test_group_model_rejects_removing_owner(self):
+        group = Group({"name": "project", "owner": self.username})
+        with self.assertRaises(UserError):
+            group.remove_members([self.username])
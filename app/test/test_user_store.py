@@ -154,3 +154,20 @@ class TestUserStore(unittest.TestCase):
         token = self.user_store.generate_auth_token(user.user_id, expiration=0.1)
         verified_user = self.user_store.verify_auth_token(token)
         self.assertEqual(verified_user.user_id, user.user_id)
+
+    def test_user_store_rejects_username_of_group(self):
+        with self.assertRaises(UserError):
+            self.user_store.register_user("group:project", self.testpass)
+
+    def test_user_store_resolves_groups_of_user(self):
+        user = self.add_test_user()
+        group = self.user_store.create_group("project", "owner", members=[user.username])
+        self.assertEqual(self.user_store.get_user_groups(user.username), [group.group_id])
+        self.assertEqual(self.user_store.get_user(user.username).groups, [group.group_id])
+        self.user_store.update_group_members(group.group_id, "owner", remove_members=[user.username])
+        self.assertEqual(self.user_store.get_user_groups(user.username), [])
+
+    def test_only_owner_can_change_group(self):
+        group = self.user_store.create_group("project", "owner")
+        with self.assertRaises(UserError):
+            self.user_store.delete_group(group.group_id, self.testname)
@@ -0,0 +1,28 @@
+"""WSGI entry point for running the server with pre-forked workers, e.g.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+    uwsgi app.ini
+
+The application is loaded once in the master process. Each worker gets its own ES client
+after forking, so workers don't share the connections opened in the master, and bootstraps the
+indices in the background.
+"""
+import stores
+from server import create_app
+from settings import server_config
+
+app = create_app(server_config)
+
+
+def post_fork(*args):
+    stores.configure_stores(server_config["Elasticsearch"])
+    stores.start_bootstrap()
+    stores.start_compactor(server_config["Elasticsearch"])
+
+
+try:
+    # only available when running under uWSGI
+    from uwsgidecorators import postfork
+    postfork(post_fork)
+except ImportError:
+    pass